@@ -0,0 +1,320 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import config
+import metrics
+
+# Running aggregates over LabTestResults for the dashboards. Rows are read
+# in key order past a high-water mark, turned into column arrays and folded
+# into the totals with a handful of vectorised NumPy operations per block,
+# so a dashboard query only reads precomputed numbers.
+#
+# Two levels are kept:
+#   per test type        count, sum, sum of squares, min, max, below/above
+#                        the reference range and a fixed-bin histogram
+#   per (patient, test)  count, first/last date, last value, out-of-range
+#                        counts and the sums for a least-squares trend line
+#
+# Only inserts are picked up incrementally; a periodic full rebuild brings
+# in updated and deleted rows.
+
+SECONDS_PER_DAY = 86400.0
+EPOCH = datetime(1970, 1, 1)
+
+
+def _grow(array, size):
+    if len(array) >= size:
+        return array
+    grown = np.zeros((max(size, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+class LabAggregates:
+    def __init__(self, bins=20):
+        self.bins = bins
+        self.high_water_mark = None
+        self.rows = 0
+        self._origin = None  # time origin in epoch days, keeps the trend sums well conditioned
+        self._lock = threading.Lock()
+
+        self._tests = {}  # test type -> row in the test arrays
+        self._test_names = []
+        self._t_count = np.zeros(8)
+        self._t_sum = np.zeros(8)
+        self._t_sumsq = np.zeros(8)
+        self._t_min = np.full(8, np.inf)
+        self._t_max = np.full(8, -np.inf)
+        self._t_below = np.zeros(8)
+        self._t_above = np.zeros(8)
+        self._t_edges = np.zeros((8, bins + 1))
+        self._t_hist = np.zeros((8, bins + 2))  # underflow, bins..., overflow
+
+        self._pairs = {}  # (patient, test) -> row in the pair arrays
+        self._patient_rows = {}  # patient -> [pair rows]
+        self._p_test = np.zeros(1024, dtype=np.int64)
+        self._p_n = np.zeros(1024)
+        self._p_st = np.zeros(1024)  # sum of t (days since origin)
+        self._p_sv = np.zeros(1024)  # sum of values
+        self._p_stt = np.zeros(1024)
+        self._p_stv = np.zeros(1024)
+        self._p_below = np.zeros(1024)
+        self._p_above = np.zeros(1024)
+        self._p_first = np.full(1024, np.inf)
+        self._p_last = np.full(1024, -np.inf)
+        self._p_last_value = np.full(1024, np.nan)
+
+    def _test_row(self, name, low, high, values):
+        row = self._tests.get(name)
+        if row is not None:
+            return row
+        row = self._tests[name] = len(self._test_names)
+        self._test_names.append(name)
+        size = row + 1
+        self._t_count, self._t_sum, self._t_sumsq = (_grow(a, size) for a in (self._t_count, self._t_sum, self._t_sumsq))
+        self._t_below, self._t_above = _grow(self._t_below, size), _grow(self._t_above, size)
+        if len(self._t_min) < size:
+            self._t_min = np.concatenate([self._t_min, np.full(len(self._t_min), np.inf)])
+            self._t_max = np.concatenate([self._t_max, np.full(len(self._t_max), -np.inf)])
+        self._t_edges, self._t_hist = _grow(self._t_edges, size), _grow(self._t_hist, size)
+
+        # Histogram spans the reference range with the same width again on
+        # both sides; without a reference range, this block's spread
+        low = np.nanmedian(low) if np.isfinite(low).any() else np.nan
+        high = np.nanmedian(high) if np.isfinite(high).any() else np.nan
+        if not (np.isfinite(low) and np.isfinite(high) and high > low):
+            finite = values[np.isfinite(values)]
+            low, high = (finite.min(), finite.max()) if finite.size else (0.0, 1.0)
+            if high <= low:
+                high = low + 1.0
+        span = high - low
+        self._t_edges[row] = np.linspace(low - span, high + span, self.bins + 1)
+        return row
+
+    def _pair_rows(self, patients, tests, test_rows):
+        # Row per (patient, test); only the distinct pairs of the block are looped over
+        pair_keys, first_of, inverse = np.unique(
+            np.array([f"{patient}\x00{test}" for patient, test in zip(patients, tests)], dtype=object),
+            return_index=True,
+            return_inverse=True,
+        )
+        rows = np.empty(len(pair_keys), dtype=np.int64)
+        for position, key in enumerate(pair_keys):
+            patient, test = key.split("\x00", 1)
+            row = self._pairs.get((patient, test))
+            if row is None:
+                row = self._pairs[(patient, test)] = len(self._pairs)
+                self._patient_rows.setdefault(patient, []).append(row)
+                self._grow_pairs(row + 1)
+                self._p_test[row] = test_rows[first_of[position]]
+            rows[position] = row
+        return rows[inverse]
+
+    def _grow_pairs(self, size):
+        if len(self._p_n) >= size:
+            return
+        for name in ("_p_test", "_p_n", "_p_st", "_p_sv", "_p_stt", "_p_stv", "_p_below", "_p_above"):
+            setattr(self, name, _grow(getattr(self, name), size))
+        new_size = len(self._p_n)
+        for name, fill in (("_p_first", np.inf), ("_p_last", -np.inf), ("_p_last_value", np.nan)):
+            old = getattr(self, name)
+            setattr(self, name, np.concatenate([old, np.full(new_size - len(old), fill)]))
+
+    def apply(self, keys, patients, tests, dates, values, lows, highs):
+        # One block of rows in key order; the arrays are columns of equal length
+        if not len(keys):
+            return
+        with self._lock, metrics.timer("analytics", "apply_block"):
+            # Dates (date or naive datetime) as days; a NULL date becomes NaN
+            stamps = np.asarray(dates, dtype="datetime64[s]")
+            t = stamps.astype(np.int64) / SECONDS_PER_DAY
+            t[np.isnat(stamps)] = np.nan
+            if self._origin is None and np.isfinite(t).any():
+                self._origin = float(np.nanmin(t))
+            if self._origin is not None:
+                t -= self._origin
+            values = np.asarray(values, dtype=float)
+            lows = np.asarray(lows, dtype=float)
+            highs = np.asarray(highs, dtype=float)
+
+            names, test_inverse = np.unique(np.asarray(tests, dtype=object), return_inverse=True)
+            test_map = np.array(
+                [
+                    self._test_row(name, lows[test_inverse == i], highs[test_inverse == i], values[test_inverse == i])
+                    for i, name in enumerate(names)
+                ],
+                dtype=np.int64,
+            )
+            test_rows = test_map[test_inverse]
+            pair_rows = self._pair_rows(patients, tests, test_rows)
+
+            valid = np.isfinite(values)
+            below = valid & (values < lows)  # comparisons with NaN are False
+            above = valid & (values > highs)
+            v, tr = values[valid], test_rows[valid]
+            # A row without a date still counts for its test, but for none of
+            # the per-patient figures, which all share this mask
+            dated = valid & np.isfinite(t)
+            dv, pr, tv = values[dated], pair_rows[dated], t[dated]
+            size = len(self._test_names)
+
+            self._t_count[:size] += np.bincount(tr, minlength=size)
+            self._t_sum[:size] += np.bincount(tr, weights=v, minlength=size)
+            self._t_sumsq[:size] += np.bincount(tr, weights=v * v, minlength=size)
+            np.minimum.at(self._t_min, tr, v)
+            np.maximum.at(self._t_max, tr, v)
+            self._t_below[:size] += np.bincount(test_rows[below], minlength=size)
+            self._t_above[:size] += np.bincount(test_rows[above], minlength=size)
+            for row in np.unique(tr):
+                in_test = tr == row
+                slots = np.searchsorted(self._t_edges[row], v[in_test], side="right")
+                self._t_hist[row] += np.bincount(slots, minlength=self.bins + 2)[: self.bins + 2]
+
+            pairs = len(self._pairs)
+            self._p_n[:pairs] += np.bincount(pr, minlength=pairs)
+            self._p_st[:pairs] += np.bincount(pr, weights=tv, minlength=pairs)
+            self._p_sv[:pairs] += np.bincount(pr, weights=dv, minlength=pairs)
+            self._p_stt[:pairs] += np.bincount(pr, weights=tv * tv, minlength=pairs)
+            self._p_stv[:pairs] += np.bincount(pr, weights=tv * dv, minlength=pairs)
+            self._p_below[:pairs] += np.bincount(pair_rows[below & dated], minlength=pairs)
+            self._p_above[:pairs] += np.bincount(pair_rows[above & dated], minlength=pairs)
+            np.minimum.at(self._p_first, pr, tv)
+            # Latest value per pair: stable sort by time, the last write wins
+            order = np.argsort(tv, kind="stable")
+            newer = tv[order] >= self._p_last[pr[order]]
+            self._p_last_value[pr[order][newer]] = dv[order][newer]
+            np.maximum.at(self._p_last, pr, tv)
+
+            self.high_water_mark = keys[-1]
+            self.rows += len(keys)
+
+    def _date(self, days):
+        return (EPOCH + timedelta(days=float(days) + self._origin)).isoformat()
+
+    def tests(self, name=None):
+        with self._lock:
+            rows = self._tests.items() if name is None else [(name, self._tests.get(name))]
+            result = []
+            for test, row in rows:
+                if row is None:
+                    continue
+                count = self._t_count[row]
+                mean = self._t_sum[row] / count if count else None
+                variance = max(self._t_sumsq[row] / count - mean * mean, 0.0) if count else None
+                summary = {
+                    "test_type": test,
+                    "count": int(count),
+                    "mean": mean,
+                    "std": variance ** 0.5 if count else None,
+                    "min": self._t_min[row] if count else None,
+                    "max": self._t_max[row] if count else None,
+                    "below_range": int(self._t_below[row]),
+                    "above_range": int(self._t_above[row]),
+                    "out_of_range_share": (self._t_below[row] + self._t_above[row]) / count if count else None,
+                }
+                if name is not None:
+                    summary["histogram"] = {
+                        "edges": self._t_edges[row].tolist(),
+                        "counts": self._t_hist[row][1:-1].astype(int).tolist(),
+                        "underflow": int(self._t_hist[row][0]),
+                        "overflow": int(self._t_hist[row][-1]),
+                    }
+                result.append(summary)
+            return result
+
+    def patient(self, patient_id):
+        with self._lock:
+            rows = np.array(self._patient_rows.get(str(patient_id), []), dtype=np.int64)
+            if not len(rows):
+                return []
+            n, st, sv = self._p_n[rows], self._p_st[rows], self._p_sv[rows]
+            denominator = n * self._p_stt[rows] - st * st
+            with np.errstate(divide="ignore", invalid="ignore"):
+                slope = np.where(denominator > 1e-9, (n * self._p_stv[rows] - st * sv) / denominator, np.nan)
+                mean = sv / n
+            return [
+                {
+                    "test_type": self._test_names[self._p_test[row]],
+                    "count": int(n[i]),
+                    "mean": mean[i] if n[i] else None,
+                    "first_date": self._date(self._p_first[row]) if n[i] else None,
+                    "last_date": self._date(self._p_last[row]) if n[i] else None,
+                    "last_value": self._p_last_value[row],
+                    # Least-squares trend of the value, in units per day
+                    "trend_per_day": slope[i],
+                    "below_range": int(self._p_below[row]),
+                    "above_range": int(self._p_above[row]),
+                }
+                for i, row in enumerate(rows)
+            ]
+
+    def stats(self):
+        return {"rows": self.rows, "tests": len(self._test_names), "patient_tests": len(self._pairs)}
+
+
+lab_results = LabAggregates(bins=config.ANALYTICS_HISTOGRAM_BINS)
+
+
+def _query():
+    columns = [
+        config.LAB_RESULTS_KEY_COLUMN,
+        config.LAB_RESULTS_PATIENT_COLUMN,
+        config.LAB_RESULTS_TEST_COLUMN,
+        config.LAB_RESULTS_DATE_COLUMN,
+        config.LAB_RESULTS_VALUE_COLUMN,
+        config.LAB_RESULTS_LOW_COLUMN,
+        config.LAB_RESULTS_HIGH_COLUMN,
+    ]
+    key = config.LAB_RESULTS_KEY_COLUMN
+    return (
+        f"SELECT {', '.join(columns)} FROM LabTestResults "
+        f"WHERE $1::bigint IS NULL OR {key} > $1 ORDER BY {key} LIMIT $2;"
+    )
+
+
+async def catch_up(db, aggregates, block_size):
+    # Folds every row past the high-water mark into `aggregates`, one block at a time
+    query = _query()
+    while True:
+        rows = await db.fetch(query, aggregates.high_water_mark, block_size)
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        nan = float("nan")
+        await asyncio.to_thread(
+            aggregates.apply,
+            columns[0],
+            [str(patient) for patient in columns[1]],
+            [str(test) for test in columns[2]],
+            # numpy has no time zones: timestamptz values become naive UTC
+            [
+                date.astimezone(timezone.utc).replace(tzinfo=None) if getattr(date, "tzinfo", None) else date
+                for date in columns[3]
+            ],
+            [nan if value is None else value for value in columns[4]],
+            [nan if value is None else value for value in columns[5]],
+            [nan if value is None else value for value in columns[6]],
+        )
+        if len(rows) < block_size:
+            return
+
+
+async def keep_fresh(db, refresh_interval, rebuild_interval):
+    global lab_results
+    rebuilt_at = time.monotonic()
+    while True:
+        try:
+            if time.monotonic() - rebuilt_at > rebuild_interval:
+                # Built on the side and swapped in, so readers never see it half done
+                fresh = LabAggregates(bins=config.ANALYTICS_HISTOGRAM_BINS)
+                await catch_up(db, fresh, config.ANALYTICS_BLOCK_SIZE)
+                lab_results = fresh
+                rebuilt_at = time.monotonic()
+            await catch_up(db, lab_results, config.ANALYTICS_BLOCK_SIZE)
+        except Exception as e:
+            print(f"Lab analytics refresh failed: {e}")
+        await asyncio.sleep(refresh_interval)
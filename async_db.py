@@ -0,0 +1,284 @@
+import asyncio
+
+import asyncpg
+
+import config
+import metrics
+import py_functions
+
+DatabaseError = asyncpg.PostgresError
+
+# Async counterparts of the py_functions helpers, used by the `async def`
+# endpoints so a database round trip never blocks the event loop.
+# Every helper takes an asyncpg pool (or connection) as its first argument,
+# the same way the sync helpers take `cnxn`.
+
+
+async def create_pool(min_size=None):
+    return await asyncpg.create_pool(
+        host=config.SERVER_NAME,
+        database=config.DATABASE_NAME,
+        user=config.USER,
+        password=config.PASSWORD,
+        port=config.PORT,
+        ssl=config.SSLMODE,
+        min_size=config.ASYNC_DB_POOL_MIN_SIZE if min_size is None else min_size,
+        max_size=config.ASYNC_DB_POOL_MAX_SIZE,
+        timeout=config.DB_POOL_ACQUIRE_TIMEOUT,
+    )
+
+
+async def warm_pool(db, count):
+    # Open `count` connections at once; the pool keeps them around while idle
+    connections = await asyncio.gather(
+        *(db.acquire() for _ in range(count)), return_exceptions=True
+    )
+    errors = [conn for conn in connections if isinstance(conn, BaseException)]
+    for conn in connections:
+        if not isinstance(conn, BaseException):
+            await db.release(conn)
+    if errors:
+        raise errors[0]
+
+
+async def iter_rows(db, query, *args, prefetch=5000):
+    # Server-side cursor so large tables are read in chunks
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            async for record in conn.cursor(query, *args, prefetch=prefetch):
+                yield record
+
+
+async def estimate_rows(db, table):
+    # Planner estimate; cheap and good enough for sizing in-memory indexes
+    query = "SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = lower($1);"
+    return await db.fetchval(query, table) or 0
+
+
+@metrics.timed("db")
+async def existing_patient(db, email, referral_no):
+    query = "SELECT COUNT(1) FROM PATIENTS WHERE Email = $1 OR Referral_No = $2;"
+    count = await db.fetchval(query, email, referral_no)
+    return count > 0
+
+
+# The insert SQL comes from the statement registry in py_functions; asyncpg
+# prepares it once per connection and reuses it from its statement cache.
+
+# Raised by the email/referral unique constraints. The membership filters
+# only know this worker's inserts (until their next refresh), so a signup
+# racing one on another worker gets this far.
+AlreadyExists = asyncpg.exceptions.UniqueViolationError
+
+
+@metrics.timed("db")
+async def store_patient(db, new_patient):
+    # Returns the new PatientID, or None if the insert failed; AlreadyExists
+    # is raised so the caller can answer 400
+    statement = py_functions.PATIENT_INSERT
+    try:
+        return await db.fetchval(statement.sql, *statement.params(new_patient))
+    except AlreadyExists:
+        raise
+    except asyncpg.PostgresError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+
+@metrics.timed("db")
+async def store_guardian(db, guardian_data):
+    if isinstance(guardian_data, dict):
+        guardian_data = py_functions.Guardian(**guardian_data)
+    statement = py_functions.GUARDIAN_INSERT
+
+    try:
+        return await db.fetchval(statement.sql, *statement.params(guardian_data))
+    except asyncpg.PostgresError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+
+@metrics.timed("db")
+async def fetch_patient_by_email(db, email):
+    sql = "SELECT Name, Password FROM PATIENTS WHERE Email = $1;"
+    result = await db.fetchrow(sql, email)
+
+    if result:
+        return {"name": result[0], "password": result[1]}
+    else:
+        return None
+
+
+@metrics.timed("db")
+async def fetch_patient_id(db, email):
+    return await db.fetchval("SELECT PatientID FROM PATIENTS WHERE Email = $1;", email)
+
+
+@metrics.timed("db")
+async def update_password(db, table, email, new_hash, old_hash=None):
+    # table is PATIENTS or Doctors. With old_hash the update only applies if
+    # the password was not changed in the meantime (background rehash on login).
+    if old_hash is None:
+        status = await db.execute(f"UPDATE {table} SET Password = $2 WHERE Email = $1;", email, new_hash)
+    else:
+        status = await db.execute(
+            f"UPDATE {table} SET Password = $2 WHERE Email = $1 AND Password = $3;",
+            email,
+            new_hash,
+            old_hash,
+        )
+    return status != "UPDATE 0"
+
+
+@metrics.timed("db")
+async def existing_hospital(db, email):
+    query = "SELECT COUNT(1) FROM Hospitals WHERE Email = $1;"
+    count = await db.fetchval(query, email)
+    return count > 0
+
+
+@metrics.timed("db")
+async def add_hospital(db, new_hospital):
+    # Returns the new HospitalID
+    statement = py_functions.HOSPITAL_INSERT
+    return await db.fetchval(statement.sql, *statement.params(new_hospital))
+
+
+@metrics.timed("db")
+async def existing_doctor(db, email):
+    query = "SELECT COUNT(1) FROM Doctors WHERE Email = $1;"
+    count = await db.fetchval(query, email)
+    return count > 0
+
+
+@metrics.timed("db")
+async def add_doctor(db, new_doctor):
+    # Status is converted to a boolean by the registered statement; returns the new DoctorID
+    statement = py_functions.DOCTOR_INSERT
+    return await db.fetchval(statement.sql, *statement.params(new_doctor))
+
+
+@metrics.timed("db")
+async def fetch_doctor_by_email(db, email):
+    sql = "SELECT DoctorName, Password, Verified FROM Doctors WHERE Email = $1;"
+    result = await db.fetchrow(sql, email)
+
+    if result:
+        return {"DoctorName": result[0], "Password": result[1], "Verified": bool(result[2])}
+    else:
+        return None
+
+
+@metrics.timed("db")
+async def fetch_doctor_id(db, email):
+    return await db.fetchval("SELECT DoctorID FROM Doctors WHERE Email = $1;", email)
+
+
+@metrics.timed("db")
+async def online_doctors(db):
+    rows = await db.fetch("SELECT DoctorID FROM Doctors WHERE Status;")
+    return [row[0] for row in rows]
+
+
+@metrics.timed("db")
+async def update_doctor_statuses(db, doctor_ids, statuses):
+    # One statement for the whole batch; rows already in that state are not rewritten
+    query = """
+        UPDATE Doctors SET Status = batch.status
+        FROM unnest($1::integer[], $2::boolean[]) AS batch(doctor_id, status)
+        WHERE Doctors.DoctorID = batch.doctor_id AND Doctors.Status IS DISTINCT FROM batch.status;
+    """
+    await db.execute(query, doctor_ids, statuses)
+
+
+# Raised by the Appointments exclusion constraint when a doctor is double-booked
+SlotTaken = asyncpg.exceptions.ExclusionViolationError
+
+
+@metrics.timed("db")
+async def book_appointment(db, appointment):
+    statement = py_functions.APPOINTMENT_INSERT
+    return await db.fetchval(statement.sql, *statement.params(appointment))
+
+
+@metrics.timed("db")
+async def fetch_appointment(db, appointment_id):
+    sql = (
+        "SELECT DoctorID, Date, Time, Duration, Status, PatientID FROM Appointments "
+        "WHERE AppointmentID = $1;"
+    )
+    result = await db.fetchrow(sql, appointment_id)
+    if result:
+        return {
+            "DoctorID": result[0],
+            "Date": result[1],
+            "Time": result[2],
+            "Duration": result[3],
+            "Status": result[4],
+            "PatientID": result[5],
+        }
+    else:
+        return None
+
+
+@metrics.timed("db")
+async def reschedule_appointment(db, appointment_id, day, start, minutes):
+    status = await db.execute(
+        "UPDATE Appointments SET Date = $2, Time = $3, Duration = $4 WHERE AppointmentID = $1;",
+        appointment_id,
+        day,
+        start,
+        minutes,
+    )
+    return status != "UPDATE 0"
+
+
+@metrics.timed("db")
+async def doctor_exists(db, doctor_id):
+    # Appointments store DoctorID as text; Doctors.DoctorID is an integer.
+    # Only the canonical form (schedule.doctor_key) counts, never "007"
+    doctor_id = str(doctor_id)
+    if not (doctor_id.isascii() and doctor_id.isdigit()) or str(int(doctor_id)) != doctor_id:
+        return False
+    return await db.fetchval("SELECT EXISTS (SELECT 1 FROM Doctors WHERE DoctorID = $1);", int(doctor_id))
+
+
+@metrics.timed("db")
+async def doctor_appointments(db, doctor_id, since):
+    # (AppointmentID, Date, Time, Duration) of the doctor's active bookings from `since` on
+    sql = (
+        "SELECT AppointmentID, Date, Time, Duration FROM Appointments "
+        "WHERE DoctorID = $1 AND Date >= $2 AND lower(Status) <> 'cancelled';"
+    )
+    return await db.fetch(sql, doctor_id, since)
+
+
+@metrics.timed("db")
+async def registered_patient_keys(db, emails, referral_nos):
+    # Emails and referral numbers from the batch that are already taken
+    query = (
+        "SELECT Email, Referral_No FROM PATIENTS "
+        "WHERE Email = ANY($1::text[]) OR Referral_No = ANY($2::text[]);"
+    )
+    rows = await db.fetch(query, emails, referral_nos)
+    return {row[0] for row in rows}, {row[1] for row in rows if row[1] is not None}
+
+
+@metrics.timed("db")
+async def registered_emails(db, table, emails):
+    rows = await db.fetch(f"SELECT Email FROM {table} WHERE Email = ANY($1::text[]);", emails)
+    return {row[0] for row in rows}
+
+
+@metrics.timed("db")
+async def bulk_insert(db, statement, instances):
+    # One COPY in one transaction; asyncpg quotes identifiers, and unquoted
+    # names are stored lower case by PostgreSQL
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            await conn.copy_records_to_table(
+                statement.table.lower(),
+                columns=[column.lower() for column in statement.columns],
+                records=[statement.params(instance) for instance in instances],
+            )
+    return len(instances)
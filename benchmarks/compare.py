@@ -0,0 +1,37 @@
+import json
+import sys
+
+# Side-by-side comparison of two benchmark result files:
+#   python benchmarks/compare.py results/<old>.json results/<new>.json
+
+METRICS = ["throughput_rps", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"]
+
+
+def change(old, new):
+    if not old or new is None:
+        return ""
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old.get("scale") != new.get("scale"):
+        print(f"warning: different data scale {old.get('scale')} vs {new.get('scale')}")
+
+    print(f"{'route':<24} {'metric':<15} {old['commit']:>12} {new['commit']:>12} {'change':>9}")
+    for route in new["routes"]:
+        if route not in old["routes"]:
+            continue
+        for metric in METRICS:
+            before = old["routes"][route].get(metric)
+            after = new["routes"][route].get(metric)
+            print(f"{route:<24} {metric:<15} {before!s:>12} {after!s:>12} {change(before, after):>9}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: compare.py OLD.json NEW.json")
+    main(sys.argv[1], sys.argv[2])
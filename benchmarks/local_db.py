@@ -0,0 +1,104 @@
+import os
+import subprocess
+import time
+import uuid
+
+import psycopg2
+
+# Disposable PostgreSQL for benchmarks. Starts a throw-away Docker container
+# unless BENCH_DB_HOST (and friends) point at an existing server.
+
+IMAGE = os.environ.get("BENCH_PG_IMAGE", "postgres:16")
+PASSWORD = "bench"
+
+
+class LocalDatabase:
+    def __init__(self, host=None, port=None, user=None, password=None, dbname=None):
+        self.external = host is not None
+        self.host = host or "127.0.0.1"
+        self.port = int(port or os.environ.get("BENCH_PG_PORT", 55432))
+        self.user = user or "postgres"
+        self.password = password if password is not None else PASSWORD
+        self.dbname = dbname or "postgres"
+        self.container = None
+
+    @classmethod
+    def from_env(cls):
+        # BENCH_DB_HOST selects an existing server instead of Docker
+        host = os.environ.get("BENCH_DB_HOST")
+        if host is None:
+            return cls()
+        return cls(
+            host=host,
+            port=os.environ.get("BENCH_DB_PORT", 5432),
+            user=os.environ.get("BENCH_DB_USER", "postgres"),
+            password=os.environ.get("BENCH_DB_PASSWORD", ""),
+            dbname=os.environ.get("BENCH_DB_NAME", "postgres"),
+        )
+
+    def start(self, timeout=60):
+        if not self.external:
+            self.container = f"bench-pg-{uuid.uuid4().hex[:8]}"
+            subprocess.run(
+                [
+                    "docker", "run", "-d", "--rm",
+                    "--name", self.container,
+                    "-e", f"POSTGRES_PASSWORD={self.password}",
+                    "-p", f"{self.port}:5432",
+                    IMAGE,
+                    # Roughly a small managed instance
+                    "-c", "max_connections=200",
+                    "-c", "shared_buffers=256MB",
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.connect().close()
+                return self
+            except psycopg2.OperationalError:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise
+                time.sleep(0.5)
+
+    def stop(self):
+        if self.container:
+            subprocess.run(["docker", "stop", self.container], stdout=subprocess.DEVNULL)
+            self.container = None
+
+    def connect(self):
+        cnxn = psycopg2.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            dbname=self.dbname,
+            sslmode="disable",
+        )
+        cnxn.autocommit = True
+        return cnxn
+
+    def app_env(self):
+        # Environment that points main/config.py at this database
+        return {
+            "DB_SERVER": self.host,
+            "DB_PORT": str(self.port),
+            "DB_USER": self.user,
+            "DB_PASSWORD": self.password,
+            "DB_NAME": self.dbname,
+            "DB_SSLMODE": "disable",
+            # Every request comes from 127.0.0.1 and logins cycle through a
+            # few accounts; keep the throttle out of the measurements
+            "RATE_LIMIT_PER_CLIENT": "100000000",
+            "RATE_LIMIT_PER_ACCOUNT": "100000000",
+            "RATE_LIMIT_BULK_ROWS": "100000000",
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
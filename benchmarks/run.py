@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+import seed
+from local_db import LocalDatabase
+
+# End-to-end benchmark: seeds a local database, starts the app against it in
+# a uvicorn subprocess and drives every route with a fixed concurrency.
+# Results (p50/p95/p99 latency, throughput, server RSS) are written to
+# benchmarks/results/<commit>.json so runs can be compared with compare.py.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def patient_body():
+    tag = uuid.uuid4().hex[:12]
+    return {
+        "name": f"bench {tag}", "location_address": "Kampala", "country": "Uganda", "tel": "0700",
+        "email": f"{tag}@new.bench.example.com", "referral_no": f"N{tag}", "access_no": f"A{tag}",
+        "age": 9, "sex": "M", "password": seed.PASSWORD,
+    }
+
+
+def hospital_body():
+    tag = uuid.uuid4().hex[:12]
+    return {
+        "HospitalName": f"Hospital {tag}", "Address": "Kampala", "Country": "Uganda", "Type": "public",
+        "EmergencyLine": "991", "HelpLine": "0300", "RegNumber": tag,
+        "Email": f"{tag}@new.bench.example.com", "Telephone": "0778", "Docs": "docs", "ContactNumber": "0700",
+    }
+
+
+def doctor_body():
+    tag = uuid.uuid4().hex[:12]
+    return {
+        "DoctorName": f"Doctor {tag}", "Specialty": "General", "AccessNumber": tag, "LicenseNumber": tag,
+        "Status": "Online", "Email": f"{tag}@new.bench.example.com", "Telephone": "0736", "Docs": "docs",
+        "Password": seed.PASSWORD, "ContactNumber": "0873",
+    }
+
+
+def scenarios(patients):
+    emails = itertools.cycle(seed.patient_email(i) for i in range(patients))
+    # name -> (method, path, body factory)
+    return {
+        "GET /": ("GET", "/", None),
+        "GET /patient_data": ("GET", "/patient_data", None),
+        "GET /lab_results": ("GET", "/lab_results?limit=100", None),
+        "POST /login": ("POST", "/login", lambda: {"email": next(emails), "password": seed.PASSWORD}),
+        "POST /patients/new": ("POST", "/patients/new", patient_body),
+        "POST /hospitals/new": ("POST", "/hospitals/new", hospital_body),
+        "POST /doctors/new": ("POST", "/doctors/new", doctor_body),
+    }
+
+
+def rss_bytes(pid):
+    # Resident set size of the server and its children (multi-worker mode)
+    total = 0
+    pids = [str(pid)]
+    try:
+        children = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True, text=True).stdout.split()
+        pids.extend(children)
+    except FileNotFoundError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def drive(client, method, path, body, requests, concurrency, server_pid):
+    latencies = []
+    errors = 0  # connection failures and 5xx
+    rejected = 0  # other non-2xx answers
+    throttled = 0  # 429s: the numbers would measure the rate limiter
+    peak_rss = rss_bytes(server_pid)
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors, rejected, throttled
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body() if body else None)
+                if response.status_code == 429:
+                    throttled += 1
+                elif response.status_code >= 500:
+                    errors += 1
+                elif not 200 <= response.status_code < 300:
+                    rejected += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, rss_bytes(server_pid))
+            await asyncio.sleep(0.2)
+
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "non_2xx": rejected,
+        "throttled": throttled,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "peak_rss_mb": round(peak_rss / 2**20, 1),
+    }
+
+
+def start_server(env, port, command):
+    process = subprocess.Popen(
+        command + ["--port", str(port)],
+        cwd=ROOT,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not become ready")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+async def staff_token(client):
+    # The verified doctor from seed.py; /lab_results needs a staff token
+    response = await client.post(
+        "/doctors/login", json={"Email": seed.doctor_email(seed.STAFF_DOCTOR), "Password": seed.PASSWORD}
+    )
+    response.raise_for_status()
+    return response.json()["data"]["access_token"]
+
+
+def check(name, result):
+    # Latencies of rejected requests would be reported as the route's numbers
+    if result["throttled"]:
+        raise SystemExit(
+            f"{name}: {result['throttled']} requests got 429; raise the "
+            "RATE_LIMIT_* settings in local_db.app_env for this load"
+        )
+    if result["errors"] or result["non_2xx"]:
+        raise SystemExit(
+            f"{name}: {result['errors']} errors and {result['non_2xx']} other non-2xx answers; "
+            "the benchmark only measures successful requests"
+        )
+
+
+async def run_all(args, port, server_pid):
+    results = {}
+    selected = scenarios(args.patients)
+    if args.only:
+        selected = {name: selected[name] for name in args.only}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        for name, (method, path, body) in selected.items():
+            # A fresh staff token per route, so it can't expire mid-run
+            client.headers["Authorization"] = f"Bearer {await staff_token(client)}"
+            # Short warm-up so first-use costs (lazy imports, PREPARE) don't skew p99
+            check(name, await drive(client, method, path, body, min(args.requests, 20), 1, server_pid))
+            results[name] = await drive(
+                client, method, path, body, args.requests, args.concurrency, server_pid
+            )
+            print(f"{name:<24} {json.dumps(results[name])}")
+            check(name, results[name])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every route against a local Postgres.")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--doctors", type=int, default=200)
+    parser.add_argument("--hospitals", type=int, default=50)
+    parser.add_argument("--lab-results", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--only", nargs="*", help='route names, e.g. "POST /login"')
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data already in the database")
+    parser.add_argument(
+        "--server",
+        default=f"{sys.executable} -m uvicorn main:app --host 127.0.0.1",
+        help="command that starts the app (the port is appended)",
+    )
+    parser.add_argument("--output", help="result file (default results/<commit>.json)")
+    args = parser.parse_args()
+
+    with LocalDatabase.from_env() as db:
+        if not args.no_seed:
+            cnxn = db.connect()
+            seed.seed(cnxn, args.patients, args.doctors, args.hospitals, args.lab_results)
+            cnxn.close()
+
+        server = start_server(db.app_env(), args.port, args.server.split())
+        try:
+            results = asyncio.run(run_all(args, args.port, server.pid))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": {
+            "patients": args.patients,
+            "doctors": args.doctors,
+            "hospitals": args.hospitals,
+            "lab_results": args.lab_results,
+        },
+        "routes": results,
+    }
+    os.makedirs(RESULTS, exist_ok=True)
+    output = args.output or os.path.join(RESULTS, f"{commit}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+-- Stand-in schema for local benchmarking; mirrors the columns the app reads
+-- and writes. Not a migration for the production database.
+
+DROP TABLE IF EXISTS Appointments, LabTestResults, Guardians, HospitalDoctors, Doctors, Hospitals, PATIENTS CASCADE;
+
+CREATE TABLE PATIENTS (
+    PatientID serial PRIMARY KEY,
+    name text NOT NULL,
+    location_address text,
+    country text,
+    tel text,
+    email text NOT NULL UNIQUE,
+    referral_no text UNIQUE,
+    access_no text,
+    age integer,
+    sex text,
+    password text NOT NULL
+);
+
+CREATE TABLE Guardians (
+    id serial PRIMARY KEY,
+    GuardianName text,
+    Relationship text,
+    ContactNumber text,
+    PatientID text
+);
+
+CREATE TABLE Hospitals (
+    HospitalID serial PRIMARY KEY,
+    HospitalName text NOT NULL,
+    Address text,
+    Country text,
+    Type text,
+    EmergencyLine text,
+    HelpLine text,
+    RegNumber text,
+    Email text NOT NULL UNIQUE,
+    Telephone text,
+    Docs text,
+    ContactNumber text,
+    Latitude double precision,
+    Longitude double precision
+);
+
+CREATE TABLE Doctors (
+    DoctorID serial PRIMARY KEY,
+    DoctorName text NOT NULL,
+    Specialty text,
+    AccessNumber text,
+    LicenseNumber text,
+    Status boolean,
+    Email text NOT NULL UNIQUE,
+    Telephone text,
+    Docs text,
+    Password text,
+    ContactNumber text,
+    Verified boolean NOT NULL DEFAULT false
+);
+
+CREATE TABLE HospitalDoctors (
+    HospitalID integer REFERENCES Hospitals,
+    DoctorID integer REFERENCES Doctors,
+    PRIMARY KEY (HospitalID, DoctorID)
+);
+
+CREATE TABLE LabTestResults (
+    ResultID bigserial PRIMARY KEY,
+    PatientID text NOT NULL,
+    TestType text NOT NULL,
+    TestDate timestamp NOT NULL,
+    ResultValue double precision,
+    Unit text,
+    ReferenceLow double precision,
+    ReferenceHigh double precision,
+    Notes text
+);
+
+CREATE INDEX labtestresults_patient_idx ON LabTestResults (PatientID, ResultID);
+CREATE INDEX labtestresults_test_idx ON LabTestResults (TestType, ResultID);
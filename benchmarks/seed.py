@@ -0,0 +1,156 @@
+import io
+import os
+import random
+from datetime import datetime, timedelta
+
+from argon2 import PasswordHasher
+
+# Synthetic data for the benchmark database. Every patient and doctor shares
+# one Argon2 hash of PASSWORD so seeding stays fast and logins can succeed.
+
+PASSWORD = "benchmark"
+SCHEMA = os.path.join(os.path.dirname(__file__), "schema.sql")
+NOTIFY_TRIGGER = os.path.join(os.path.dirname(__file__), "..", "sql", "labtestresults_notify.sql")
+APPOINTMENTS = os.path.join(os.path.dirname(__file__), "..", "sql", "appointments.sql")
+
+TEST_TYPES = {
+    # name: (mean, stddev, reference low, reference high, unit)
+    "Hemoglobin": (10.5, 2.0, 11.5, 16.5, "g/dL"),
+    "HbS": (60.0, 20.0, 0.0, 1.0, "%"),
+    "HbF": (8.0, 5.0, 0.0, 2.0, "%"),
+    "WBC": (9.0, 3.0, 4.0, 11.0, "10^9/L"),
+    "Platelets": (300.0, 80.0, 150.0, 450.0, "10^9/L"),
+    "Reticulocytes": (6.0, 3.0, 0.5, 2.5, "%"),
+}
+HOSPITAL_TYPES = ["public", "private", "clinic", "referral"]
+SPECIALTIES = ["Hematology", "Pediatrics", "General", "Cardiology", "Dentist"]
+
+
+def _copy(cnxn, table, columns, rows, chunk=50000):
+    # COPY in chunks so seeding millions of rows needs little memory
+    cursor = cnxn.cursor()
+    buffer = io.StringIO()
+    count = 0
+
+    def flush():
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        buffer.write(",".join("" if value is None else str(value) for value in row))
+        buffer.write("\n")
+        count += 1
+        if count % chunk == 0:
+            flush()
+    flush()
+    cursor.close()
+    return count
+
+
+def patient_email(i):
+    return f"patient{i}@bench.example.com"
+
+
+def doctor_email(i):
+    return f"doctor{i}@bench.example.com"
+
+
+# Seeded with Doctors.Verified set, so run.py can call the staff-only routes
+STAFF_DOCTOR = 0
+
+
+def seed(cnxn, patients=1000, doctors=200, hospitals=50, lab_results=100000, seed_value=42):
+    rng = random.Random(seed_value)
+    hashed = PasswordHasher().hash(PASSWORD)
+
+    cursor = cnxn.cursor()
+    for path in (SCHEMA, NOTIFY_TRIGGER, APPOINTMENTS):
+        with open(path) as f:
+            cursor.execute(f.read())
+    cursor.close()
+
+    _copy(
+        cnxn,
+        "PATIENTS",
+        ["name", "location_address", "country", "tel", "email", "referral_no", "access_no", "age", "sex", "password"],
+        (
+            (f"Patient {i}", "Kampala", "Uganda", f"0700{i:06d}", patient_email(i), f"R{i}", f"AA{i}",
+             rng.randint(1, 80), rng.choice("MF"), hashed)
+            for i in range(patients)
+        ),
+    )
+    _copy(
+        cnxn,
+        "Hospitals",
+        ["HospitalName", "Address", "Country", "Type", "EmergencyLine", "HelpLine", "RegNumber", "Email",
+         "Telephone", "Docs", "ContactNumber", "Latitude", "Longitude"],
+        (
+            (f"Hospital {i}", "Kampala", "Uganda", rng.choice(HOSPITAL_TYPES), "991", "0300", f"G{i:04d}",
+             f"hospital{i}@bench.example.com", "0778", "docs", "0700",
+             # Spread over Uganda's bounding box
+             round(rng.uniform(-1.5, 4.2), 6), round(rng.uniform(29.6, 35.0), 6))
+            for i in range(hospitals)
+        ),
+    )
+    _copy(
+        cnxn,
+        "Doctors",
+        ["DoctorName", "Specialty", "AccessNumber", "LicenseNumber", "Status", "Email", "Telephone", "Docs",
+         "Password", "ContactNumber", "Verified"],
+        (
+            (f"Doctor {i}", rng.choice(SPECIALTIES), f"Doc{i:05d}", f"UGD{i:05d}", rng.choice("tf"),
+             doctor_email(i), "0736", "docs", hashed, "0873", "t" if i == STAFF_DOCTOR else "f")
+            for i in range(doctors)
+        ),
+    )
+
+    start = datetime(2023, 1, 1)
+    names = list(TEST_TYPES)
+
+    def results():
+        for _ in range(lab_results):
+            name = rng.choice(names)
+            mean, stddev, low, high, unit = TEST_TYPES[name]
+            yield (
+                str(rng.randint(1, max(patients, 1))),
+                name,
+                (start + timedelta(minutes=rng.randint(0, 525600))).isoformat(sep=" "),
+                round(rng.gauss(mean, stddev), 2),
+                unit,
+                low,
+                high,
+                "",
+            )
+
+    _copy(
+        cnxn,
+        "LabTestResults",
+        ["PatientID", "TestType", "TestDate", "ResultValue", "Unit", "ReferenceLow", "ReferenceHigh", "Notes"],
+        results(),
+    )
+
+    cursor = cnxn.cursor()
+    cursor.execute("ANALYZE;")
+    cursor.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from local_db import LocalDatabase
+
+    parser = argparse.ArgumentParser(description="Seed a benchmark database (BENCH_DB_HOST etc.).")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--doctors", type=int, default=200)
+    parser.add_argument("--hospitals", type=int, default=50)
+    parser.add_argument("--lab-results", type=int, default=100000)
+    args = parser.parse_args()
+
+    db = LocalDatabase.from_env()
+    cnxn = db.connect()
+    seed(cnxn, args.patients, args.doctors, args.hospitals, args.lab_results)
+    cnxn.close()
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+import asyncpg
+
+import config
+
+# Read-through cache of encoded LabTestResults responses. Entries are the
+# final response bytes, so a hit skips both the query and the encoding.
+# The cache is bounded by total bytes (LRU eviction) and by a TTL, and every
+# entry is tagged with the data version it was built from; a change
+# notification bumps the version, which invalidates everything at once.
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=64 << 20, ttl=60.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict()  # key -> (body, version, expires)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> lock, so one caller loads while the rest wait
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key, count=True):
+        # count=False for a repeat lookup of a miss that was already counted
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if count:
+                    self._stats["misses"] += 1
+                return None
+            body, version, expires = entry
+            if version != self.version or expires < time.monotonic():
+                self._remove(key)
+                if count:
+                    self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            if count:
+                self._stats["hits"] += 1
+            return body
+
+    def put(self, key, body, version):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if version != self.version:
+                # The data changed while this body was being built
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, version, time.monotonic() + self.ttl)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def get_or_load(self, key, load):
+        # load() returns the encoded body; concurrent misses share one load
+        body = self.get(key)
+        if body is not None:
+            return body
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another caller may have loaded it meanwhile
+            body = self.get(key, count=False)
+            if body is None:
+                version = self.version
+                body = load()
+                self.put(key, body, version)
+        with self._lock:
+            if not key_lock.locked():
+                self._loading.pop(key, None)
+        return body
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._stats["invalidations"] += 1
+
+    def _remove(self, key):
+        body, _, _ = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "version": self.version,
+            }
+
+
+lab_results = ResponseCache(max_bytes=config.CACHE_MAX_BYTES, ttl=config.CACHE_TTL)
+
+
+async def listen_for_changes(cache, channel, retry=5.0, listeners=()):
+    # Keeps a dedicated connection LISTENing for change notifications (see
+    # sql/labtestresults_notify.sql). While it is down the TTL bounds staleness.
+    # `listeners` are further (channel, callback(payload)) pairs sharing the
+    # connection, so each worker still holds only one listening connection.
+    while True:
+        try:
+            conn = await asyncpg.connect(
+                host=config.SERVER_NAME,
+                database=config.DATABASE_NAME,
+                user=config.USER,
+                password=config.PASSWORD,
+                port=config.PORT,
+                ssl=config.SSLMODE,
+            )
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"Cache listener could not connect: {e}")
+            await asyncio.sleep(retry)
+            continue
+
+        try:
+            await conn.add_listener(channel, lambda *args: cache.invalidate())
+            for other_channel, callback in listeners:
+                await conn.add_listener(
+                    other_channel, lambda conn, pid, channel, payload, callback=callback: callback(payload)
+                )
+            # Anything may have changed while we were not listening
+            cache.invalidate()
+            while True:
+                await asyncio.sleep(retry)
+                # A cheap round trip notices a dead connection quickly
+                await conn.execute("SELECT 1;")
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            print(f"Cache listener lost its connection: {e}")
+        finally:
+            conn.terminate()
+        cache.invalidate()
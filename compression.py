@@ -0,0 +1,156 @@
+import asyncio
+import gzip
+import zlib
+
+import config
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional; without it only gzip is offered
+    brotli = None
+
+# Content-Encoding negotiation and compression for response bodies. Cached
+# bodies are compressed once per encoding (see main.conditional_lab_results);
+# everything else goes through CompressionMiddleware.
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# Server-sent events must reach the client one event at a time; proxies and
+# clients tend to buffer a compressed stream
+UNCOMPRESSIBLE_TYPES = ("text/event-stream",)
+OFFLOAD_SIZE = 256 << 10
+
+
+def available():
+    # Preferred first: brotli is smaller at a similar CPU cost
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding):
+    # Picks the best encoding the client accepts (q > 0), or None for identity
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    best = None
+    for encoding in available():
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+def compress(body, encoding):
+    with metrics.timer("compress", encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=config.BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=config.GZIP_LEVEL)
+
+
+def compressor(encoding):
+    # Incremental compressor for streamed bodies: (compress(chunk), finish())
+    if encoding == "br":
+        stream = brotli.Compressor(quality=config.BROTLI_QUALITY)
+        # Flush every chunk so streamed rows reach the client promptly
+        return (lambda chunk: stream.process(chunk) + stream.flush()), stream.finish
+    stream = zlib.compressobj(config.GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    return (lambda chunk: stream.compress(chunk) + stream.flush(zlib.Z_SYNC_FLUSH)), stream.flush
+
+
+def _is_compressible(headers):
+    content_type = ""
+    for name, value in headers:
+        name = name.lower()
+        if name == b"content-encoding":
+            return False
+        if name == b"content-type":
+            content_type = value.decode("latin-1")
+    return content_type.startswith(COMPRESSIBLE_TYPES) and not content_type.startswith(UNCOMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing JSON and text responses.
+
+    Like Starlette's GZipMiddleware but negotiates brotli too, and leaves
+    responses that already carry a Content-Encoding (pre-compressed cached
+    bodies) alone. Bodies under ``minimum_size`` are sent as they are.
+    """
+
+    def __init__(self, app, minimum_size=1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+        encoding = negotiate(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "compress": None, "finish": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Hold the headers until the first body chunk shows the size
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if state["compress"] is not None:
+                chunk = state["compress"](body)
+                if not more_body:
+                    chunk += state["finish"]()
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                return
+            if state["start"] is None:
+                # Already decided not to compress this response
+                await send(message)
+                return
+
+            start = state["start"]
+            state["start"] = None
+            headers = [(name, value) for name, value in start.get("headers", [])]
+            if not _is_compressible(headers) or (not more_body and len(body) < self.minimum_size):
+                await send(start)
+                await send(message)
+                return
+
+            headers = [(name, value) for name, value in headers if name.lower() != b"content-length"]
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers.append((b"vary", b"Accept-Encoding"))
+            if more_body:
+                state["compress"], state["finish"] = compressor(encoding)
+                chunk = state["compress"](body)
+                await send({**start, "headers": headers})
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                return
+
+            if len(body) >= OFFLOAD_SIZE:
+                # Large bodies are compressed off the event loop
+                body = await asyncio.to_thread(compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
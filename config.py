@@ -1,7 +1,129 @@
+import os
 
 DRIVER_NAME = 'PostgreSQL'  # This is usually not needed for psycopg2
-SERVER_NAME = 'sicklesightserver.postgres.database.azure.com'  # Replace with your server name
+# The DB_* environment variables point the app at another server (e.g. the
+# local Postgres used by benchmarks/)
+SERVER_NAME = os.environ.get('DB_SERVER', 'sicklesightserver.postgres.database.azure.com')  # Replace with your server name
 # DATABASE_NAME = 'Sickelsight01'
-DATABASE_NAME = 'sicklesight'  # Replace with your database name
-USER = 'SickleSightAdmin@sicklesightserver'  # Replace with your database username
-PASSWORD = 'SickleSight@23'  # Replace with your database password
+DATABASE_NAME = os.environ.get('DB_NAME', 'sicklesight')  # Replace with your database name
+USER = os.environ.get('DB_USER', 'SickleSightAdmin@sicklesightserver')  # Replace with your database username
+PASSWORD = os.environ.get('DB_PASSWORD', 'SickleSight@23')  # Replace with your database password
+PORT = int(os.environ.get('DB_PORT', 5432))
+SSLMODE = os.environ.get('DB_SSLMODE', 'require')
+
+# Connection pool settings (shared by every endpoint)
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', 5))  # seconds
+DB_POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30))  # ping connections idle longer than this
+
+# asyncpg pool used by the async endpoints
+ASYNC_DB_POOL_MIN_SIZE = int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', 2))
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', 20))
+
+# Argon2 worker pool ("thread" or "process"); 0 workers means one per CPU
+PASSWORD_EXECUTOR = os.environ.get('PASSWORD_EXECUTOR', 'thread')
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 0))
+PASSWORD_MAX_PENDING = int(os.environ.get('PASSWORD_MAX_PENDING', 64))  # queued + running before 503
+# Argon2 parameters picked by `python hashing.py calibrate` on the deployment host
+ARGON2_PARAMS_FILE = os.environ.get('ARGON2_PARAMS_FILE', 'argon2_params.json')
+
+# Rows fetched per round trip when streaming LabTestResults
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 1000))
+
+# LabTestResults columns used for keyset pagination and filtering
+LAB_RESULTS_KEY_COLUMN = os.environ.get('LAB_RESULTS_KEY_COLUMN', 'ResultID')  # unique, indexed
+LAB_RESULTS_PATIENT_COLUMN = os.environ.get('LAB_RESULTS_PATIENT_COLUMN', 'PatientID')
+LAB_RESULTS_TEST_COLUMN = os.environ.get('LAB_RESULTS_TEST_COLUMN', 'TestType')
+LAB_RESULTS_DATE_COLUMN = os.environ.get('LAB_RESULTS_DATE_COLUMN', 'TestDate')
+LAB_RESULTS_VALUE_COLUMN = os.environ.get('LAB_RESULTS_VALUE_COLUMN', 'ResultValue')
+LAB_RESULTS_LOW_COLUMN = os.environ.get('LAB_RESULTS_LOW_COLUMN', 'ReferenceLow')
+LAB_RESULTS_HIGH_COLUMN = os.environ.get('LAB_RESULTS_HIGH_COLUMN', 'ReferenceHigh')
+LAB_RESULTS_PAGE_SIZE = int(os.environ.get('LAB_RESULTS_PAGE_SIZE', 100))
+LAB_RESULTS_MAX_PAGE_SIZE = int(os.environ.get('LAB_RESULTS_MAX_PAGE_SIZE', 1000))
+
+# Bytes of CSV parsed per Arrow/Parquet batch in /lab_results/export
+EXPORT_BLOCK_SIZE = int(os.environ.get('EXPORT_BLOCK_SIZE', 8 << 20))
+
+# How often the in-memory duplicate-check indexes are rebuilt from the DB
+MEMBERSHIP_REFRESH_INTERVAL = float(os.environ.get('MEMBERSHIP_REFRESH_INTERVAL', 300))  # seconds
+
+# Largest batch accepted by the /*/bulk registration endpoints
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', 5000))
+
+# Send per-request phase timings back in a Server-Timing header
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0').lower() in ('1', 'true', 'yes')
+
+# Directory where gunicorn workers share their metrics (gunicorn_conf.py sets
+# it); unset for a single process
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_SNAPSHOT_INTERVAL = float(os.environ.get('METRICS_SNAPSHOT_INTERVAL', 5))  # seconds
+
+# Read-through cache for the LabTestResults read endpoints
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 64 << 20))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 60))  # seconds; upper bound on staleness
+CACHE_NOTIFY_CHANNEL = os.environ.get('CACHE_NOTIFY_CHANNEL', 'labtestresults_changed')
+
+# Response compression (gzip, and brotli when installed)
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))  # bytes
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))  # 4-5 compresses well and stays fast
+
+# Signed session tokens; set TOKEN_SECRET to the same value on every worker
+TOKEN_SECRET = os.environ.get('TOKEN_SECRET', '')
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', 15 * 60))  # seconds
+REFRESH_TOKEN_TTL = int(os.environ.get('REFRESH_TOKEN_TTL', 14 * 24 * 3600))  # seconds
+
+# Login/auth throttling: "memory" (per worker) or a redis:// URL shared by all workers
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_WINDOW = float(os.environ.get('RATE_LIMIT_WINDOW', 60))  # seconds
+RATE_LIMIT_PER_ACCOUNT = int(os.environ.get('RATE_LIMIT_PER_ACCOUNT', 10))  # login attempts per email
+RATE_LIMIT_PER_CLIENT = int(os.environ.get('RATE_LIMIT_PER_CLIENT', 60))  # auth requests per IP
+# Rows per IP for the bulk routes; each row may cost an Argon2 hash
+RATE_LIMIT_BULK_ROWS = int(os.environ.get('RATE_LIMIT_BULK_ROWS', BULK_MAX_ROWS))
+# Behind a proxy (e.g. the Heroku router) take the client IP from X-Forwarded-For
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', '0').lower() in ('1', 'true', 'yes')
+
+# Transactional email: "sendgrid" (needs SENDGRID_API_KEY), "console" or "local" (kept in memory)
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'sendgrid')
+SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY', '')
+EMAIL_FROM = os.environ.get('EMAIL_FROM', 'your-email@example.com')
+EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', 2))
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 100))  # recipients per API request
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 5))
+EMAIL_QUEUE_SIZE = int(os.environ.get('EMAIL_QUEUE_SIZE', 10000))
+
+# Appointment scheduling
+APPOINTMENT_MINUTES = int(os.environ.get('APPOINTMENT_MINUTES', 30))  # default length, also the slot grid
+APPOINTMENT_DAY_START = os.environ.get('APPOINTMENT_DAY_START', '08:00')
+APPOINTMENT_DAY_END = os.environ.get('APPOINTMENT_DAY_END', '17:00')
+APPOINTMENT_HORIZON_DAYS = int(os.environ.get('APPOINTMENT_HORIZON_DAYS', 60))  # how far availability looks
+APPOINTMENT_INDEX_TTL = float(os.environ.get('APPOINTMENT_INDEX_TTL', 60))  # seconds before a doctor is reloaded
+
+# Nearest-hospital index: grid cell size (0.25 degrees is about 28 km at the equator)
+HOSPITAL_GRID_DEGREES = float(os.environ.get('HOSPITAL_GRID_DEGREES', 0.25))
+HOSPITAL_INDEX_REFRESH_INTERVAL = float(os.environ.get('HOSPITAL_INDEX_REFRESH_INTERVAL', 300))  # seconds
+
+# Lab result analytics: new rows are folded in every ANALYTICS_REFRESH_INTERVAL
+# seconds; a full rebuild every ANALYTICS_REBUILD_INTERVAL picks up updates and deletes
+ANALYTICS_REFRESH_INTERVAL = float(os.environ.get('ANALYTICS_REFRESH_INTERVAL', 5))
+ANALYTICS_REBUILD_INTERVAL = float(os.environ.get('ANALYTICS_REBUILD_INTERVAL', 3600))
+ANALYTICS_BLOCK_SIZE = int(os.environ.get('ANALYTICS_BLOCK_SIZE', 20000))  # rows per NumPy block
+ANALYTICS_HISTOGRAM_BINS = int(os.environ.get('ANALYTICS_HISTOGRAM_BINS', 20))
+
+# Typeahead search index; rebuilt every SEARCH_REFRESH_INTERVAL seconds to
+# pick up other workers' writes. A query scores at most SEARCH_MAX_CANDIDATES records.
+SEARCH_REFRESH_INTERVAL = float(os.environ.get('SEARCH_REFRESH_INTERVAL', 300))
+SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', 5000))
+SEARCH_LIMIT = int(os.environ.get('SEARCH_LIMIT', 10))
+SEARCH_MAX_LIMIT = int(os.environ.get('SEARCH_MAX_LIMIT', 50))
+
+# Doctor presence: online while heartbeats arrive at least every PRESENCE_TTL
+# seconds; other workers hear of changes every PRESENCE_BROADCAST_INTERVAL and
+# Doctors.Status is written back every PRESENCE_WRITE_INTERVAL
+PRESENCE_TTL = float(os.environ.get('PRESENCE_TTL', 45))
+PRESENCE_BROADCAST_INTERVAL = float(os.environ.get('PRESENCE_BROADCAST_INTERVAL', 0.25))
+PRESENCE_WRITE_INTERVAL = float(os.environ.get('PRESENCE_WRITE_INTERVAL', 5))
+PRESENCE_NOTIFY_CHANNEL = os.environ.get('PRESENCE_NOTIFY_CHANNEL', 'doctor_presence')
+PRESENCE_SUBSCRIBER_QUEUE = int(os.environ.get('PRESENCE_SUBSCRIBER_QUEUE', 256))  # deltas a slow client may lag
+PRESENCE_KEEPALIVE = float(os.environ.get('PRESENCE_KEEPALIVE', 15))  # seconds between SSE keepalives
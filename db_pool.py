@@ -0,0 +1,228 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    # Raised when no connection could be handed out within the acquire timeout
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+class Lease:
+    # A checked-out connection whose release is idempotent, for callers
+    # (like streaming responses) that may try to give it back more than once
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._lock = threading.Lock()
+        self.conn = conn
+
+    def release(self, discard=False):
+        with self._lock:
+            conn, self.conn = self.conn, None
+        if conn is not None:
+            self._pool.putconn(conn, discard=discard)
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Connections are created lazily up to ``max_size`` and kept idle down to
+    ``min_size``. On checkout a connection that has been idle for longer than
+    ``check_interval`` seconds is pinged first; broken connections are thrown
+    away and replaced so callers never see a dead socket.
+    """
+
+    def __init__(
+        self,
+        connect,
+        min_size=1,
+        max_size=10,
+        acquire_timeout=5.0,
+        check_interval=30.0,
+        on_wait=None,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size, max_size >= 1")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.check_interval = check_interval
+        self._on_wait = on_wait  # called with the seconds each checkout waited
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, last_returned) pairs, most recent on the right
+        self._size = 0  # connections currently open, idle or checked out
+        self._waiting = 0
+        self._closed = False
+
+        # Statistics exposed through stats()
+        self._acquired = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def open(self):
+        # Pre-open the minimum number of connections
+        for _ in range(self.min_size):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def getconn(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        conn = None
+        last_used = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosed("Connection pool is closed.")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve a slot; the connection itself is opened outside the lock
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"Timed out after {timeout:.1f}s waiting for a database connection."
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_alive(conn, last_used):
+                self._close_quietly(conn)
+                conn = self._connect()
+                with self._cond:
+                    self._reconnects += 1
+        except Exception:
+            # Give the reserved slot back so other callers can try again
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._acquired += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        if self._on_wait is not None:
+            self._on_wait(waited)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard:
+            discard = not self._reset(conn)
+        if discard:
+            self._close_quietly(conn)
+
+        with self._cond:
+            if discard or self._closed:
+                if not discard:
+                    self._close_quietly(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The socket is likely gone; don't hand it to the next caller
+            self.putconn(conn, discard=True)
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def lease(self, timeout=None):
+        return Lease(self, self.getconn(timeout))
+
+    def stats(self):
+        with self._cond:
+            in_use = self._size - len(self._idle)
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "waiting": self._waiting,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "acquired": self._acquired,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+                "wait_seconds_total": self._wait_total,
+                "wait_seconds_max": self._wait_max,
+                "wait_seconds_avg": self._wait_total / self._acquired if self._acquired else 0.0,
+            }
+
+    def _is_alive(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reset(self, conn):
+        # Roll back anything a helper left open so the next borrower starts clean
+        if conn.closed:
+            return False
+        try:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
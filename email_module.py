@@ -1,23 +1,257 @@
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+import asyncio
+import html
+import random
+from collections import OrderedDict
+from itertools import count
 
-class Email:
-    def __init__(self, recipient_email, subject):
-        self.recipient_email = recipient_email
+import config
+import metrics
+
+# Transactional email outbox. Request handlers enqueue and return at once;
+# a few background workers drain the queue in batches through one shared
+# HTTP client, retry failures with exponential backoff and record each
+# message's delivery status. Nothing is persisted: messages still queued
+# when the process stops are lost (they are best-effort notifications).
+
+SENDGRID_URL = "https://api.sendgrid.com/v3/mail/send"
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+
+EMAILS = metrics.Counter("emails_total", "Outbox messages by final status.")
+
+_ids = count(1)
+
+
+class Message:
+    # html may contain placeholders (e.g. "-name-") filled per recipient from
+    # substitutions, so messages built from one template share a batch
+    def __init__(self, to, subject, html, substitutions=None):
+        self.id = next(_ids)
+        self.to = to
         self.subject = subject
-        self.sendgrid_client = SendGridAPIClient('your-sendgrid-api-key')
-
-    async def send_welcome(self, full_name):
-        message = Mail(
-            from_email='your-email@example.com',
-            to_emails=self.recipient_email,
-            subject=self.subject,
-            html_content=f"<strong>Welcome {full_name}!</strong>"
+        self.html = html
+        self.substitutions = substitutions or {}
+        self.attempts = 0
+        self.status = "queued"
+        self.error = None
+
+    def rendered(self):
+        body = self.html
+        for placeholder, value in self.substitutions.items():
+            body = body.replace(placeholder, value)
+        return body
+
+
+class DeliveryError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def welcome(recipient_email, full_name):
+    return Message(
+        recipient_email,
+        "Welcome",
+        "<strong>Welcome -name-!</strong>",
+        {"-name-": html.escape(full_name)},
+    )
+
+
+class SendGridSink:
+    """Sends through the SendGrid v3 API. Messages that share a subject and
+    template go out in one request, one personalization per recipient."""
+
+    def __init__(self, api_key, from_email, timeout=10.0):
+        import httpx
+
+        self.from_email = from_email
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
         )
+        self._errors = (httpx.HTTPError,)
+
+    async def send(self, messages):
+        first = messages[0]
+        payload = {
+            "from": {"email": self.from_email},
+            "subject": first.subject,
+            "content": [{"type": "text/html", "value": first.html}],
+            "personalizations": [
+                {"to": [{"email": message.to}], "substitutions": message.substitutions}
+                if message.substitutions
+                else {"to": [{"email": message.to}]}
+                for message in messages
+            ],
+        }
         try:
-            response = await self.sendgrid_client.send(message)
-            print(response.status_code)
-            print(response.body)
-            print(response.headers)
+            response = await self._client.post(SENDGRID_URL, json=payload)
+        except self._errors as e:
+            raise DeliveryError(f"SendGrid request failed: {e}")
+        if response.status_code == 429 or response.status_code >= 500:
+            raise DeliveryError(f"SendGrid returned {response.status_code}")
+        if response.status_code >= 400:
+            # Bad address, bad key, ...: retrying will not help
+            raise DeliveryError(f"SendGrid rejected the batch: {response.text[:200]}", retryable=False)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class LocalSink:
+    """Keeps delivered messages in memory (and optionally prints them) for
+    tests and local development."""
+
+    def __init__(self, echo=False):
+        self.echo = echo
+        self.sent = []
+
+    async def send(self, messages):
+        for message in messages:
+            self.sent.append(message)
+            if self.echo:
+                print(f"[email] to={message.to} subject={message.subject!r} {message.rendered()}")
+
+    async def close(self):
+        pass
+
+
+class Outbox:
+    def __init__(self, sink, workers=2, batch_size=100, max_attempts=5, max_queue=10000,
+                 base_delay=1.0, max_delay=60.0, keep_statuses=10000):
+        self.sink = sink
+        self.workers = workers
+        self.batch_size = min(batch_size, SENDGRID_MAX_PERSONALIZATIONS)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.keep_statuses = keep_statuses
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._tasks = []
+        self._retrying = set()
+        self._statuses = OrderedDict()  # message id -> Message, newest last
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def enqueue(self, message):
+        # Never blocks the caller; a full queue drops the message
+        self._track(message)
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._finish(message, "dropped", "Outbox queue is full.")
+        return message.id
+
+    def status(self, message_id):
+        message = self._statuses.get(message_id)
+        if message is None:
+            return None
+        return {"id": message.id, "to": message.to, "status": message.status,
+                "attempts": message.attempts, "error": message.error}
+
+    def _track(self, message):
+        self._statuses[message.id] = message
+        while len(self._statuses) > self.keep_statuses:
+            self._statuses.popitem(last=False)
+
+    def _finish(self, message, status, error=None):
+        message.status = status
+        message.error = error
+        EMAILS.inc(status=status)
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            groups = {}
+            for message in batch:
+                groups.setdefault((message.subject, message.html), []).append(message)
+            for messages in groups.values():
+                await self._deliver(messages)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _deliver(self, messages):
+        for message in messages:
+            message.attempts += 1
+            message.status = "sending"
+        try:
+            with metrics.timer("email", "send"):
+                await self.sink.send(messages)
+        except DeliveryError as e:
+            if not e.retryable and len(messages) > 1:
+                # One bad address rejects the whole request; find it by
+                # sending the batch one by one
+                for message in messages:
+                    await self._deliver([message])
+                return
+            for message in messages:
+                if e.retryable and message.attempts < self.max_attempts:
+                    self._retry_later(message, str(e))
+                else:
+                    self._finish(message, "failed", str(e))
+            return
         except Exception as e:
-            print(e.message)
+            # A bug in a sink must not kill the worker
+            for message in messages:
+                self._finish(message, "failed", repr(e))
+            return
+        for message in messages:
+            self._finish(message, "sent")
+
+    def _retry_later(self, message, error):
+        # Exponential backoff with full jitter, off the worker so it keeps draining
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (message.attempts - 1)))
+        message.status = "retrying"
+        message.error = error
+
+        async def requeue():
+            await asyncio.sleep(delay)
+            try:
+                self._queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._finish(message, "dropped", "Outbox queue is full.")
+
+        task = asyncio.create_task(requeue())
+        self._retrying.add(task)
+        task.add_done_callback(self._retrying.discard)
+
+    async def stop(self, timeout=5.0):
+        # Gives queued messages a moment to go out, then shuts down
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Outbox stopped with {self._queue.qsize()} messages undelivered")
+        for task in self._tasks + list(self._retrying):
+            task.cancel()
+        await self.sink.close()
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "retrying": len(self._retrying),
+            "workers": self.workers,
+        }
+
+
+def create_outbox():
+    if config.EMAIL_BACKEND == "sendgrid" and config.SENDGRID_API_KEY:
+        sink = SendGridSink(config.SENDGRID_API_KEY, config.EMAIL_FROM)
+    else:
+        if config.EMAIL_BACKEND == "sendgrid":
+            print("SENDGRID_API_KEY is not set; emails are only kept in memory")
+        sink = LocalSink(echo=config.EMAIL_BACKEND == "console")
+    return Outbox(
+        sink,
+        workers=config.EMAIL_WORKERS,
+        batch_size=config.EMAIL_BATCH_SIZE,
+        max_attempts=config.EMAIL_MAX_ATTEMPTS,
+        max_queue=config.EMAIL_QUEUE_SIZE,
+    )
+
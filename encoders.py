@@ -0,0 +1,66 @@
+import datetime
+import decimal
+import uuid
+
+import orjson
+
+# JSON encoding for raw database rows. orjson handles datetimes, UUIDs and
+# NaN/inf (sent as null) natively; the rest of what psycopg2 and pandas hand
+# back goes through json_default.
+
+_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        # Subclasses such as pandas.Timestamp; NaT is not equal to itself
+        if value != value:
+            return None
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        # Same as FastAPI's encoder: integral values stay integers
+        if not value.is_finite():
+            return None
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if hasattr(value, "item"):
+        # numpy scalars orjson does not know (float16, ...)
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def row_to_dict(columns, record):
+    return dict(zip(columns, record))
+
+
+def dumps(obj):
+    # Returns bytes, ready to be used as a response body
+    return orjson.dumps(obj, default=json_default, option=_OPTIONS)
+
+
+def dumps_rows(columns, rows):
+    return dumps([dict(zip(columns, record)) for record in rows])
+
+
+def iter_json_array(batches):
+    # Emits one chunk per batch so the client sees rows as they are read
+    yield b"["
+    first = True
+    for columns, rows in batches:
+        if not rows:
+            continue
+        chunk = dumps_rows(columns, rows)[1:-1]
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]"
+
+
+def iter_ndjson(batches):
+    for columns, rows in batches:
+        if rows:
+            yield b"\n".join(dumps(dict(zip(columns, record))) for record in rows) + b"\n"
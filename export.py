@@ -0,0 +1,212 @@
+import os
+import threading
+
+import psycopg2
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from psycopg2 import sql as pgsql
+
+import py_functions
+
+# Bulk export of LabTestResults. Rows never become Python objects: the
+# server streams `COPY ... TO STDOUT` CSV into a pipe and pyarrow parses
+# that pipe block by block into record batches.
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "csv": "text/csv",
+}
+EXTENSIONS = {"arrow": "arrows", "parquet": "parquet", "csv": "csv"}
+
+# PostgreSQL type OIDs -> Arrow types; anything else is read as text
+_ARROW_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1700: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp("us"),
+    1184: pa.timestamp("us", tz="UTC"),
+}
+
+
+def negotiate(accept, requested=None):
+    # An explicit ?format= wins, otherwise the best entry of the Accept header
+    if requested:
+        return requested if requested in MEDIA_TYPES else None
+    by_media_type = {media_type: name for name, media_type in MEDIA_TYPES.items()}
+    by_media_type["application/x-parquet"] = "parquet"
+    by_media_type["application/vnd.apache.arrow.file"] = "arrow"
+
+    choices = []
+    for position, part in enumerate((accept or "*/*").split(",")):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        choices.append((-quality, position, media_type.lower()))
+
+    for negative_quality, _, media_type in sorted(choices):
+        if negative_quality == 0:
+            break
+        if media_type in by_media_type:
+            return by_media_type[media_type]
+        if media_type in ("*/*", "text/*"):
+            return "csv"
+    return None
+
+
+class _ChunkSink:
+    # File-like object pyarrow writers write into; drained after every batch
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _CopyPipe:
+    # Runs COPY TO STDOUT on a helper thread and exposes the output as a pipe
+    def __init__(self, cnxn, query):
+        self._cnxn = cnxn
+        read_fd, write_fd = os.pipe()
+        self.reader = os.fdopen(read_fd, "rb")
+        self._writer = os.fdopen(write_fd, "wb")
+        self.error = None
+        self._thread = threading.Thread(target=self._run, args=(query,), daemon=True)
+        self._thread.start()
+
+    def _run(self, query):
+        cursor = self._cnxn.cursor()
+        try:
+            cursor.copy_expert(query, self._writer)
+        except Exception as e:
+            self.error = e
+        finally:
+            cursor.close()
+            try:
+                self._writer.close()
+            except OSError:
+                pass
+
+    def close(self):
+        # Must finish before the connection is released: until the thread is
+        # joined it is still inside copy_expert on this connection
+        try:
+            if self._thread.is_alive():
+                # The consumer went away early; stop the server from sending more
+                self._cnxn.cancel()
+        except psycopg2.Error:
+            pass  # closing the reader below still unblocks the writer
+        finally:
+            # A write into a pipe nobody reads fails now instead of blocking
+            self.reader.close()
+            self._thread.join()
+
+
+def _describe(cnxn, fields):
+    columns = py_functions.lab_result_columns(cnxn)
+    if fields:
+        selected = [py_functions.lab_result_column(columns, name) for name in fields]
+    else:
+        selected = list(columns)
+
+    query = pgsql.SQL("SELECT {} FROM LabTestResults").format(
+        pgsql.SQL(", ").join([pgsql.Identifier(column) for column in selected])
+    )
+    cursor = cnxn.cursor()
+    cursor.execute(query + pgsql.SQL(" LIMIT 0"))
+    schema = pa.schema(
+        [pa.field(desc[0], _ARROW_TYPES.get(desc[1], pa.string())) for desc in cursor.description]
+    )
+    cursor.close()
+    return query, schema
+
+
+def iter_export(cnxn, fmt, fields=None, block_size=8 << 20):
+    query, schema = _describe(cnxn, fields)
+    copy_sql = pgsql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)").format(query)
+    copy_sql = copy_sql.as_string(cnxn)
+
+    cursor = cnxn.cursor()
+    # Keep timestamps unambiguous for the CSV parser
+    cursor.execute("SET TimeZone TO 'UTC'; SET DateStyle TO 'ISO';")
+    cursor.close()
+
+    pipe = _CopyPipe(cnxn, copy_sql)
+    try:
+        if fmt == "csv":
+            while True:
+                chunk = pipe.reader.read(1 << 16)
+                if not chunk:
+                    break
+                yield chunk
+        else:
+            reader = pa_csv.open_csv(
+                pipe.reader,
+                read_options=pa_csv.ReadOptions(block_size=block_size),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=schema,
+                    null_values=[""],
+                    # COPY writes NULL unquoted and empty strings as ""
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                    true_values=["t"],
+                    false_values=["f"],
+                ),
+            )
+            sink = _ChunkSink()
+            if fmt == "arrow":
+                writer = pa.ipc.new_stream(sink, schema)
+            else:
+                writer = pq.ParquetWriter(sink, schema)
+            for batch in reader:
+                writer.write_batch(batch)
+                data = sink.drain()
+                if data:
+                    yield data
+            writer.close()
+            yield sink.drain()
+    finally:
+        # Runs when the response closes this generator, before the lease is
+        # released (main.streaming_from_pool), also after a disconnect
+        pipe.close()
+        try:
+            cursor = cnxn.cursor()
+            cursor.execute("RESET TimeZone; RESET DateStyle;")
+            cursor.close()
+        except psycopg2.Error:
+            # Broken by the cancel; the pool replaces it on release
+            pass
+
+    if pipe.error is not None:
+        raise pipe.error
@@ -0,0 +1,93 @@
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Production launcher: gunicorn managing uvicorn workers.
+#
+#   gunicorn main:app -c gunicorn_conf.py
+#
+# The app is imported once in the master (preload) and warmed there, so the
+# workers fork with every heavy module already loaded and share those pages.
+# DB_CONNECTION_BUDGET, when set, is the number of Postgres connections this
+# deployment may use in total; it is split across the workers so their pools
+# can never exceed max_connections together.
+
+cpus = multiprocessing.cpu_count()
+workers = int(os.environ.get("WEB_CONCURRENCY", cpus))
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+preload_app = True
+
+# Recycle workers now and then so slow leaks can't build up; the jitter keeps
+# them from all restarting at once
+max_requests = int(os.environ.get("MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", max_requests // 10))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+timeout = int(os.environ.get("WORKER_TIMEOUT", 60))
+keepalive = 5
+
+
+def pool_sizes(budget, workers, sync_share=0.3):
+    # Per-worker (sync pool max, async pool max); one connection per worker
+    # is kept back for the cache invalidation listener
+    per_worker = budget // workers - 1
+    if per_worker < 2:
+        raise ValueError(
+            f"DB_CONNECTION_BUDGET={budget} is too small for {workers} workers "
+            f"(each needs at least 3 connections)"
+        )
+    sync_max = max(1, round(per_worker * sync_share))
+    return sync_max, per_worker - sync_max
+
+
+budget = int(os.environ.get("DB_CONNECTION_BUDGET", 0))
+if budget:
+    sync_max, async_max = pool_sizes(budget, workers, float(os.environ.get("DB_POOL_SYNC_SHARE", 0.3)))
+    # config.py reads these when the app is imported below
+    os.environ["DB_POOL_MAX_SIZE"] = str(sync_max)
+    os.environ["DB_POOL_MIN_SIZE"] = str(min(int(os.environ.get("DB_POOL_MIN_SIZE", 1)), sync_max))
+    os.environ["ASYNC_DB_POOL_MAX_SIZE"] = str(async_max)
+    os.environ["ASYNC_DB_POOL_MIN_SIZE"] = str(
+        min(int(os.environ.get("ASYNC_DB_POOL_MIN_SIZE", 2)), async_max)
+    )
+
+# Argon2 threads per worker, so all workers together use about one per core
+os.environ.setdefault("PASSWORD_WORKERS", str(max(1, cpus // workers)))
+
+# Workers share their metrics here so any of them can answer /metrics for
+# all (see metrics.py). Unless METRICS_DIR is given, a fresh directory per
+# master, removed when it exits.
+own_metrics_dir = "METRICS_DIR" not in os.environ
+metrics_dir = os.environ.setdefault(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), f"app-metrics-{os.getpid()}")
+)
+
+
+def when_ready(server):
+    # Runs in the master after main is imported and before any worker forks
+    import main
+
+    main.warm_for_fork()
+    # Keep the warmed objects out of the collector's generations; a GC pass
+    # in a worker would otherwise touch (and copy) every shared page
+    gc.freeze()
+    server.log.info(
+        "Warmed before fork: %s workers, db pool %s + asyncpg %s connections each",
+        workers,
+        os.environ.get("DB_POOL_MAX_SIZE", "default"),
+        os.environ.get("ASYNC_DB_POOL_MAX_SIZE", "default"),
+    )
+
+
+def child_exit(server, worker):
+    # Keeps the exited worker's counters in the totals, so /metrics never goes backwards
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if own_metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
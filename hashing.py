@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+import platform
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+import py_functions
+
+
+class PasswordPoolBusy(Exception):
+    # Raised when the password queue is full; callers should answer 503
+    def __init__(self, retry_after=1):
+        super().__init__("Too many password operations in flight.")
+        self.retry_after = retry_after
+
+
+def _timed_call(fn, *args):
+    # Runs inside the worker so we can split queue wait from hashing time
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class PasswordWorkerPool:
+    """Runs Argon2 hashing/verification off the event loop.
+
+    At most ``max_pending`` operations may be queued or running at once;
+    anything beyond that is rejected straight away with PasswordPoolBusy so a
+    login burst turns into fast 503s instead of ever-growing latency.
+    """
+
+    def __init__(self, workers=None, max_pending=64, kind="thread", retry_after=1):
+        if kind not in ("thread", "process"):
+            raise ValueError('kind must be "thread" or "process"')
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.kind = kind
+        self.retry_after = retry_after
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        # op -> [count, total seconds, service seconds, max seconds]
+        self._latency = {"hash": [0, 0.0, 0.0, 0.0], "verify": [0, 0.0, 0.0, 0.0]}
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == "process":
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.workers, thread_name_prefix="argon2"
+                        )
+        return self._executor
+
+    async def _run(self, op, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise PasswordPoolBusy(self.retry_after)
+            self._pending += 1
+
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, service = await loop.run_in_executor(
+                self._get_executor(), _timed_call, fn, *args
+            )
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+        elapsed = time.perf_counter() - started
+        metrics.record("password", op, elapsed)
+        with self._lock:
+            stats = self._latency[op]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += service
+            stats[3] = max(stats[3], elapsed)
+        return result
+
+    async def hash(self, password):
+        return await self._run("hash", py_functions.hash_password, password)
+
+    async def verify(self, hash, password):
+        return await self._run("verify", py_functions.verify_password, hash, password)
+
+    async def verify_and_check(self, hash, password):
+        # (matches, needs_rehash), see py_functions.verify_password_and_check
+        return await self._run("verify", py_functions.verify_password_and_check, hash, password)
+
+    async def hash_many(self, passwords):
+        # Keeps at most one hash per worker in flight so a large batch can't
+        # fill the whole queue and starve interactive logins
+        limit = asyncio.Semaphore(self.workers)
+
+        async def one(password):
+            async with limit:
+                return await self.hash(password)
+
+        return await asyncio.gather(*(one(password) for password in passwords))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        with self._lock:
+            result = {
+                "workers": self.workers,
+                "kind": self.kind,
+                "queue_depth": self._pending,
+                "max_pending": self.max_pending,
+                "rejected": self._rejected,
+            }
+            for op, (count, total, service, worst) in self._latency.items():
+                result[f"{op}_count"] = count
+                result[f"{op}_seconds_avg"] = total / count if count else 0.0
+                result[f"{op}_seconds_max"] = worst
+                # Time spent queued rather than hashing
+                result[f"{op}_wait_seconds_avg"] = (total - service) / count if count else 0.0
+            return result
+
+
+def calibrate(target=0.25, max_memory_kib=64 * 1024, min_memory_kib=8 * 1024, parallelism=None, max_time_cost=16):
+    # Picks Argon2 parameters whose verify takes about `target` seconds on this
+    # machine. Memory is preferred over passes (it is what makes Argon2 costly
+    # for attackers), so memory only shrinks when one pass is already too slow.
+    from argon2 import PasswordHasher
+
+    parallelism = parallelism or PasswordHasher().parallelism
+
+    def measure(time_cost, memory_cost):
+        hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        hashed = hasher.hash("calibration")
+        samples = []
+        for _ in range(3):
+            started = time.perf_counter()
+            hasher.verify(hashed, "calibration")
+            samples.append(time.perf_counter() - started)
+        return sorted(samples)[1]
+
+    memory_cost = max_memory_kib
+    elapsed = measure(1, memory_cost)
+    while elapsed > target and memory_cost // 2 >= min_memory_kib:
+        memory_cost //= 2
+        elapsed = measure(1, memory_cost)
+
+    time_cost = 1
+    while time_cost < max_time_cost:
+        slower = measure(time_cost + 1, memory_cost)
+        if slower > target:
+            break
+        time_cost += 1
+        elapsed = slower
+
+    return {
+        "time_cost": time_cost,
+        "memory_cost": memory_cost,
+        "parallelism": parallelism,
+        "verify_ms": round(elapsed * 1000, 1),
+    }
+
+
+def save_parameters(parameters, path):
+    saved = {**parameters, "host": platform.node(), "calibrated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+    with open(path, "w") as f:
+        json.dump(saved, f, indent=2)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import config
+
+    parser = argparse.ArgumentParser(description="Calibrate Argon2 parameters for this host.")
+    parser.add_argument("command", choices=["calibrate"])
+    parser.add_argument("--target-ms", type=float, default=250, help="verify latency to aim for")
+    parser.add_argument("--max-memory-mib", type=int, default=64, help="per-hash memory ceiling")
+    parser.add_argument("--parallelism", type=int, default=None)
+    parser.add_argument("--output", default=config.ARGON2_PARAMS_FILE)
+    args = parser.parse_args()
+
+    parameters = calibrate(
+        target=args.target_ms / 1000,
+        max_memory_kib=args.max_memory_mib * 1024,
+        parallelism=args.parallelism,
+    )
+    save_parameters(parameters, args.output)
+    print(json.dumps(parameters, indent=2))
+    # Every worker thread/process can hold one hash in memory at a time
+    workers = config.PASSWORD_WORKERS or os.cpu_count() or 1
+    print(
+        f"Wrote {args.output}. Peak Argon2 memory per app worker: "
+        f"{workers} x {parameters['memory_cost'] // 1024} MiB = {workers * parameters['memory_cost'] // 1024} MiB"
+    )
@@ -1,16 +1,43 @@
-from fastapi import FastAPI, HTTPException
+import startup  # first, so the cold-start clock covers every import below
+
+import asyncio
+import importlib
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional
+
+from fastapi import BackgroundTasks, Body, Depends, FastAPI, HTTPException, Query, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 import psycopg2
-import pandas as pd
-from sqlalchemy import create_engine
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 
 # import bcrypt
 # from bcrypt import hashpw, gensalt, checkpw
-import numpy as np
+# pandas, numpy and pyarrow (and analytics, which needs numpy) are imported
+# lazily by the endpoints that use them
 
-# from email_module import Email
-# from fastapi import BackgroundTasks
 import config
+import db_pool
+import email_module
+import async_db
+import cache
+import compression
+import hashing
+import encoders
+import membership
+import metrics
+import presence
+import ratelimit
+import schedule
+import search
+import spatial
+import statements
+import tokens
 from fastapi.middleware.cors import CORSMiddleware
 from py_functions import (
     Patient,
@@ -19,24 +46,153 @@ from py_functions import (
     Doctor,
     DoctorLoginData,
     HospitalDoctor,
-    hash_password,
-    verify_password,
+    RefreshData,
+    PresenceData,
+    Appointment,
+    RescheduleData,
+    Emergency,
 )
 
+from pydantic import ValidationError
+
 import py_functions
 
-app = FastAPI()
+startup.mark("imports")
+
+# asyncpg pool for the async endpoints, opened in the lifespan hook
+adb = None
+
+# Background email delivery, started in the lifespan hook
+outbox = email_module.create_outbox()
+
+# Argon2 work runs here instead of on the event loop
+passwords = hashing.PasswordWorkerPool(
+    workers=config.PASSWORD_WORKERS or None,
+    max_pending=config.PASSWORD_MAX_PENDING,
+    kind=config.PASSWORD_EXECUTOR,
+)
+
+
+def warm_for_fork():
+    # Called by the gunicorn master (gunicorn_conf.py) before forking: does
+    # the one-time work the endpoints would otherwise do on first use, so
+    # every worker starts with it done and shares the memory
+    with startup.phase("prefork:imports"):
+        import numpy  # noqa: F401
+        import pandas  # noqa: F401
+        import export  # noqa: F401  (pyarrow)
+        import analytics  # noqa: F401
+    with startup.phase("prefork:argon2"):
+        py_functions.verify_password(py_functions.hash_password("warm-up"), "warm-up")
+    with startup.phase("prefork:openapi"):
+        # Builds the Pydantic schemas for every route
+        app.openapi()
+
+
+async def warm_up():
+    # Opens database connections after the worker is already serving; until
+    # this finishes requests just open connections on demand
+    try:
+        with startup.phase("connect:psycopg2 pool"):
+            await asyncio.to_thread(pool.open)
+        with startup.phase("connect:asyncpg pool"):
+            await async_db.warm_pool(adb, config.ASYNC_DB_POOL_MIN_SIZE)
+    except Exception as e:
+        # Stay "not ready"; requests still connect on demand
+        print(f"Database warm-up failed: {e}")
+        return
+    startup.set_ready()
+
+
+async def refresh_analytics():
+    # Imported in a thread: loading numpy would otherwise hold up the event
+    # loop while the worker is already serving (gunicorn preloads it instead)
+    analytics = await asyncio.to_thread(importlib.import_module, "analytics")
+    await analytics.keep_fresh(adb, config.ANALYTICS_REFRESH_INTERVAL, config.ANALYTICS_REBUILD_INTERVAL)
+
+
+def analytics_stats():
+    # Not imported on the event loop just for a scrape; empty until refresh_analytics loads it
+    analytics = sys.modules.get("analytics")
+    return analytics.lab_results.stats() if analytics is not None else {}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global adb
+    # No connections are opened here, so the worker starts taking traffic at once
+    with startup.phase("lifespan:asyncpg pool"):
+        adb = await async_db.create_pool(min_size=0)
+    background = [
+        asyncio.create_task(warm_up()),
+        # Until the duplicate-check indexes are ready every check falls
+        # through to the database
+        asyncio.create_task(membership.keep_fresh(adb, config.MEMBERSHIP_REFRESH_INTERVAL)),
+        # Dispatch falls back to an empty answer until the first load finishes
+        asyncio.create_task(
+            spatial.keep_fresh(adb, spatial.hospitals, config.HOSPITAL_INDEX_REFRESH_INTERVAL)
+        ),
+        # Typeahead answers from whatever has been written here until the first load finishes
+        asyncio.create_task(search.keep_fresh(adb, search.index, config.SEARCH_REFRESH_INTERVAL)),
+        # Drops cached LabTestResults responses as soon as the table changes
+        # Also hears other workers' doctor presence changes, on the same connection
+        asyncio.create_task(
+            cache.listen_for_changes(
+                cache.lab_results,
+                config.CACHE_NOTIFY_CHANNEL,
+                listeners=[(config.PRESENCE_NOTIFY_CHANNEL, presence.doctors.receive)],
+            )
+        ),
+        asyncio.create_task(
+            presence.keep_fresh(
+                adb,
+                presence.doctors,
+                config.PRESENCE_NOTIFY_CHANNEL,
+                config.PRESENCE_BROADCAST_INTERVAL,
+                config.PRESENCE_WRITE_INTERVAL,
+            )
+        ),
+        # Lab result aggregates for /analytics, caught up block by block
+        asyncio.create_task(refresh_analytics()),
+    ]
+    if config.METRICS_DIR:
+        # Lets a scrape of any worker report the totals of all of them
+        background.append(asyncio.create_task(metrics.keep_snapshot(config.METRICS_SNAPSHOT_INTERVAL)))
+    outbox.start()
+    yield
+    for task in background:
+        task.cancel()
+    if config.METRICS_DIR:
+        metrics.write_snapshot()
+    await outbox.stop()
+    try:
+        await presence.write_back(adb, presence.doctors)
+    except Exception as e:
+        print(f"Final presence write-back failed: {e}")
+    await adb.close()
+    await asyncio.to_thread(pool.close)
+    passwords.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 # origins = (["*"],)
 # app.add_middleware(
 #     CORSMiddleware, allow_origins=origins, allow_methods=["*"], allow_headers=["*"]
 # )
 
+# Innermost, so request timings include compression
+app.add_middleware(compression.CompressionMiddleware, minimum_size=config.COMPRESSION_MIN_SIZE)
+app.add_middleware(metrics.MetricsMiddleware, server_timing=config.SERVER_TIMING)
+if config.METRICS_DIR:
+    metrics.enable_multiprocess(config.METRICS_DIR)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Browser clients need these to revalidate /, /patient_data
+    expose_headers=["ETag", "Last-Modified"],
 )
 
 
@@ -45,51 +201,478 @@ def connect_db():
     database = config.DATABASE_NAME
     user = config.USER
     password = config.PASSWORD
-    con_string = f"dbname='{database}' user='{user}' host='{server}' password='{password}' sslmode='require'"
+    con_string = f"dbname='{database}' user='{user}' host='{server}' port='{config.PORT}' password='{password}' sslmode='{config.SSLMODE}'"
 
-    cnxn = psycopg2.connect(con_string)
+    # PreparedConnection tracks the INSERTs already PREPAREd on this connection
+    cnxn = psycopg2.connect(con_string, connection_factory=statements.PreparedConnection)
     cnxn.autocommit = True
     cursor = cnxn.cursor()
     print("Connected to database")
     return cnxn
 
 
-cnxn = connect_db()
+pool = db_pool.ConnectionPool(
+    connect_db,
+    min_size=config.DB_POOL_MIN_SIZE,
+    max_size=config.DB_POOL_MAX_SIZE,
+    acquire_timeout=config.DB_POOL_ACQUIRE_TIMEOUT,
+    check_interval=config.DB_POOL_CHECK_INTERVAL,
+    on_wait=lambda seconds: metrics.record("db", "pool_wait", seconds),
+)
+
+
+def asyncpg_pool_stats():
+    if adb is None:
+        return {}
+    return {"size": adb.get_size(), "idle": adb.get_idle_size(), "max_size": adb.get_max_size()}
+
+
+metrics.register_collector(metrics.stats_collector("db_pool", "psycopg2 pool statistics.", pool.stats))
+metrics.register_collector(
+    metrics.stats_collector("asyncpg_pool", "asyncpg pool statistics.", asyncpg_pool_stats)
+)
+metrics.register_collector(
+    metrics.stats_collector("password_pool", "Argon2 worker pool statistics.", passwords.stats)
+)
+metrics.register_collector(
+    metrics.stats_collector("hospital_index", "Nearest-hospital index.", spatial.hospitals.stats)
+)
+metrics.register_collector(
+    metrics.stats_collector("appointment_index", "Appointment schedule index.", schedule.appointments.stats)
+)
+metrics.register_collector(metrics.stats_collector("email_outbox", "Email outbox state.", outbox.stats))
+metrics.register_collector(metrics.stats_collector("tokens", "Token revocation list.", tokens.revoked.stats))
+metrics.register_collector(
+    metrics.stats_collector("response_cache", "LabTestResults response cache.", cache.lab_results.stats)
+)
+metrics.register_collector(metrics.stats_collector("presence", "Doctor presence registry.", presence.doctors.stats))
+metrics.register_collector(metrics.stats_collector("search_index", "Typeahead search index.", search.index.stats))
+metrics.register_collector(
+    metrics.stats_collector("lab_analytics", "Lab result aggregates.", analytics_stats)
+)
+for index in (membership.patients, membership.hospitals, membership.doctors):
+    metrics.register_collector(
+        metrics.stats_collector(
+            "membership_index", "Duplicate-check index statistics.", index.stats, index=index.name
+        )
+    )
+
+
+@app.exception_handler(db_pool.PoolTimeout)
+async def pool_timeout_handler(request, exc):
+    # Every connection is busy; tell the client to back off instead of hanging
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database is busy, please retry."},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(hashing.PasswordPoolBusy)
+async def password_pool_busy_handler(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please retry."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(tokens.TokenError)
+async def token_error_handler(request, exc):
+    return JSONResponse(
+        status_code=401,
+        content={"detail": str(exc)},
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+@app.exception_handler(tokens.Forbidden)
+async def forbidden_handler(request, exc):
+    return JSONResponse(status_code=403, content={"detail": str(exc)})
+
+
+@app.exception_handler(ratelimit.RateLimited)
+async def rate_limited_handler(request, exc):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+limiter = ratelimit.RateLimiter(
+    ratelimit.create_backend(config.RATE_LIMIT_BACKEND),
+    {
+        "account": (config.RATE_LIMIT_PER_ACCOUNT, config.RATE_LIMIT_WINDOW),
+        "client": (config.RATE_LIMIT_PER_CLIENT, config.RATE_LIMIT_WINDOW),
+        "bulk_rows": (config.RATE_LIMIT_BULK_ROWS, config.RATE_LIMIT_WINDOW),
+    },
+)
+metrics.register_collector(metrics.stats_collector("rate_limiter", "Rate limiter state.", limiter.stats))
+
+
+def client_ip(request):
+    if config.RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            # The last hop is the one our proxy added; earlier ones are client-supplied
+            return forwarded.rsplit(",", 1)[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def throttle(request, email=None, rows=0):
+    # Runs before any DB lookup or Argon2 work, so a flood costs a dict update
+    await limiter.check("client", client_ip(request))
+    if email is not None:
+        await limiter.check("account", email.lower())
+    if rows:
+        if rows > limiter.limit("bulk_rows"):
+            raise HTTPException(
+                status_code=413,
+                detail=f"At most {limiter.limit('bulk_rows')} rows per window; split the batch.",
+            )
+        await limiter.check("bulk_rows", client_ip(request), cost=rows)
+
+
+bearer = HTTPBearer(auto_error=False)
+
+
+async def current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer)):
+    # Validates the access token by its signature alone: no DB, no Argon2.
+    # Async so FastAPI doesn't hand it to the threadpool.
+    if credentials is None:
+        raise tokens.TokenError("Missing bearer token.")
+    return tokens.verify(credentials.credentials)
+
+
+async def staff_user(user: dict = Depends(current_user)):
+    # Patients and self-registered doctors may only see their own records
+    return tokens.require_staff(user)
+
+
+def streaming_from_pool(produce, media_type, headers=None):
+    # Borrow the connection up front so a busy pool still answers 503;
+    # produce(cnxn) returns the iterator of body chunks
+    lease = pool.lease()
+    reading = threading.Lock()  # held while a chunk is read in the threadpool
+
+    def body():
+        try:
+            yield from produce(lease.conn)
+        except Exception:
+            lease.release(discard=True)
+            raise
+        finally:
+            lease.release()
+
+    chunks = body()
+    done = object()
+
+    def locked():
+        while True:
+            with reading:
+                chunk = next(chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+
+    def close():
+        # Runs after the response, also when the client went away mid-stream.
+        # Waits for a chunk still being read, then closes the generator so
+        # produce()'s cleanup (cursor, COPY thread) is done before the
+        # connection goes back to the pool. Also covers a body never iterated.
+        with reading:
+            chunks.close()
+        lease.release()
+
+    return StreamingResponse(
+        locked(),
+        media_type=media_type,
+        headers=headers,
+        background=BackgroundTask(close),
+    )
+
+
+# When this worker first saw each LabTestResults version, in whole seconds.
+# Postgres keeps no modification times, so Last-Modified is approximate;
+# ETag is authoritative.
+version_seen = {}
+
+
+def version_time(version):
+    # Last-Modified only has one-second resolution: a version gets a later
+    # second than every version before it, so two versions seen within the
+    # same second never share a date and If-Modified-Since can't 304 stale data
+    seen = version_seen.get(version)
+    if seen is None:
+        latest = max(version_seen.values(), default=0)
+        if len(version_seen) > 64:
+            version_seen.clear()
+        seen = version_seen[version] = max(int(time.time()), latest + 1)
+    return seen
+
+
+def load_version():
+    with pool.connection() as cnxn:
+        return py_functions.lab_results_version(cnxn)
+
+
+def not_modified(request, etag, modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return modified <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_lab_results(request, name, load):
+    # Checks the data version before touching any rows; an unchanged version
+    # is answered with 304 and neither the query nor the encoding runs
+    version = cache.lab_results.get_or_load("version", load_version)
+    modified = version_time(version)
+    etag = f'"{name}-{version}"'
+    headers = {
+        # Weak, so one tag covers every Content-Encoding of the same data
+        "ETag": "W/" + etag,
+        "Last-Modified": formatdate(modified, usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if not_modified(request, etag, modified):
+        return Response(status_code=304, headers=headers)
+
+    # Keyed by version so a cached body never outlives the ETag it is sent with
+    body = cache.lab_results.get_or_load((name, version), load)
+    encoding = compression.negotiate(request.headers.get("accept-encoding"))
+    if encoding and len(body) >= config.COMPRESSION_MIN_SIZE:
+        # Compressed once per encoding and cached next to the plain body
+        body = cache.lab_results.get_or_load(
+            (name, version, encoding), lambda: compression.compress(body, encoding)
+        )
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def stream_lab_results(batch_size, ndjson=False):
+    encode = encoders.iter_ndjson if ndjson else encoders.iter_json_array
+    return streaming_from_pool(
+        lambda cnxn: encode(py_functions.stream_data(cnxn, batch_size)),
+        "application/x-ndjson" if ndjson else "application/json",
+    )
+
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+def readiness():
+    # For load balancers: 503 until the connection pools are warm
+    report = startup.report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
+
+@app.get("/startup")
+def startup_report():
+    return startup.report()
 
 
 @app.get("/")
-def get_data():
-    data, columns = py_functions.fetch_data(cnxn)
-    # Convert list of tuples to list of dictionaries
-    return [dict(zip(columns, record)) for record in data]
+def get_data(
+    request: Request,
+    stream: bool = False,
+    batch_size: int = Query(config.STREAM_BATCH_SIZE, ge=1, le=50000),
+):
+    # NDJSON is always streamed; a JSON array is streamed on ?stream=true
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return stream_lab_results(batch_size, ndjson=True)
+    if stream:
+        return stream_lab_results(batch_size)
+
+    return conditional_lab_results(request, "get_data", load_data)
+
+
+def load_data():
+    with pool.connection() as cnxn:
+        data, columns = py_functions.fetch_data(cnxn)
+    with metrics.timer("encode", "get_data"):
+        return encoders.dumps_rows(columns, data)
+
+
+async def rehash_password(table, email, password, old_hash):
+    # Runs after the login response: moves a hash made with older Argon2
+    # parameters to the current ones. Best effort, the next login retries.
+    try:
+        new_hash = await passwords.hash(password)
+        await async_db.update_password(adb, table, email, new_hash, old_hash=old_hash)
+    except (hashing.PasswordPoolBusy, async_db.DatabaseError) as e:
+        print(f"Password rehash skipped: {e}")
 
 
 @app.post("/login")
-async def login(login_data: LoginData):
-    patient = py_functions.fetch_patient_by_email(cnxn, login_data.email)
+async def login(login_data: LoginData, request: Request, background_tasks: BackgroundTasks):
+    await throttle(request, login_data.email)
+    patient = await async_db.fetch_patient_by_email(adb, login_data.email)
     if not patient:
         raise HTTPException(status_code=401, detail="Invalid email or password.")
 
     # The 'password' field in the patient record should contain the hashed password
-    if not verify_password(patient["password"], login_data.password):
+    matches, needs_rehash = await passwords.verify_and_check(patient["password"], login_data.password)
+    if not matches:
+        raise HTTPException(status_code=401, detail="Invalid email or password.")
+    if needs_rehash:
+        background_tasks.add_task(
+            rehash_password, "PATIENTS", login_data.email, login_data.password, patient["password"]
+        )
+
+    # The client sends the access token from now on instead of the password
+    return {
+        "success": True,
+        "message": "Login successful.",
+        "data": {"name": patient["name"], **tokens.issue(login_data.email, "patient", patient["name"])},
+    }
+
+
+@app.post("/doctors/login")
+async def doctor_login(login_data: DoctorLoginData, request: Request, background_tasks: BackgroundTasks):
+    await throttle(request, login_data.Email)
+    doctor = await async_db.fetch_doctor_by_email(adb, login_data.Email)
+    if not doctor:
         raise HTTPException(status_code=401, detail="Invalid email or password.")
+    matches, needs_rehash = await passwords.verify_and_check(doctor["Password"], login_data.Password)
+    if not matches:
+        raise HTTPException(status_code=401, detail="Invalid email or password.")
+    if needs_rehash:
+        background_tasks.add_task(
+            rehash_password, "Doctors", login_data.Email, login_data.Password, doctor["Password"]
+        )
+
+    return {
+        "success": True,
+        "message": "Login successful.",
+        "data": {
+            "name": doctor["DoctorName"],
+            # Doctors.Verified is set out of band, never through the API
+            **tokens.issue(login_data.Email, "doctor", doctor["DoctorName"], staff=doctor["Verified"]),
+        },
+    }
+
+
+@app.post("/token/refresh")
+async def refresh_token(refresh_data: RefreshData, request: Request):
+    await throttle(request)
+    return {"success": True, "message": "Token refreshed.", "data": tokens.refresh(refresh_data.refresh_token)}
+
+
+@app.post("/logout")
+async def logout(refresh_data: Optional[RefreshData] = None, user: dict = Depends(current_user)):
+    tokens.revoked.revoke(user)
+    if refresh_data is not None:
+        try:
+            refresh_claims = tokens.verify(refresh_data.refresh_token, tokens.REFRESH)
+        except tokens.TokenError:
+            pass  # already unusable
+        else:
+            if refresh_claims["sub"] == user["sub"] and refresh_claims["role"] == user["role"]:
+                tokens.revoked.revoke(refresh_claims)
+    return {"success": True, "message": "Logged out."}
+
+
+@app.get("/me")
+async def me(user: dict = Depends(current_user)):
+    return {"success": True, "data": {"email": user["sub"], "role": user["role"], "name": user.get("name")}}
+
+
+async def current_doctor_id(user: dict = Depends(current_user)):
+    if user["role"] != "doctor":
+        raise HTTPException(status_code=403, detail="Only doctors have a presence status.")
+    doctor_id = await presence.doctors.doctor_id(adb, user["sub"])
+    if doctor_id is None:
+        raise HTTPException(status_code=404, detail="Doctor not found.")
+    return doctor_id
 
-    # If the password is correct, proceed with login success logic
-    return {"success": True, "message": "Login successful."}
+
+@app.post("/doctors/me/heartbeat")
+async def doctor_heartbeat(doctor_id: int = Depends(current_doctor_id)):
+    # Clients call this well within PRESENCE_TTL to stay online
+    presence.doctors.seen(doctor_id)
+    return {"success": True, "data": {"doctor_id": doctor_id, "status": "Online", "ttl": config.PRESENCE_TTL}}
+
+
+@app.put("/doctors/me/status")
+async def set_doctor_status(presence_data: PresenceData, doctor_id: int = Depends(current_doctor_id)):
+    online = py_functions.doctor_status(presence_data.Status)
+    presence.doctors.seen(doctor_id, online)
+    return {"success": True, "data": {"doctor_id": doctor_id, "status": presence.status_name(online)}}
+
+
+@app.get("/doctors/presence")
+async def doctor_presence(doctor_id: Optional[List[int]] = Query(None)):
+    if doctor_id:
+        return {
+            "success": True,
+            "data": {str(id): presence.status_name(presence.doctors.is_online(id)) for id in doctor_id},
+        }
+    return {"success": True, "data": {"online": presence.doctors.snapshot()}}
+
+
+@app.get("/doctors/presence/stream")
+async def doctor_presence_stream():
+    # Server-sent events: a snapshot, then batches of {"doctor_id", "status"} deltas
+    return StreamingResponse(
+        presence.events(presence.doctors, config.PRESENCE_KEEPALIVE),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/search")
+async def search_records(
+    q: str = Query(..., min_length=1, max_length=100),
+    kind: Optional[str] = Query(None, pattern="^(patient|doctor|hospital)$"),
+    limit: int = Query(config.SEARCH_LIMIT, ge=1, le=config.SEARCH_MAX_LIMIT),
+    user: dict = Depends(staff_user),
+):
+    # Staff lookup by partial name, email, access number, specialty or
+    # hospital name; answered from memory, no query per keystroke
+    with metrics.timer("search", "query"):
+        results = search.index.search(q, limit, kind)
+    return {"success": True, "data": results, "ready": search.index.ready}
 
 
 @app.post("/patients/new")
-async def create_patient(patient_data: Patient):
-    existing_patient = py_functions.existing_patient(
-        cnxn, patient_data.email, patient_data.referral_no
+async def create_patient(patient_data: Patient, request: Request):
+    # Signups hash a password too
+    await throttle(request)
+    existing_patient = await membership.patients.exists(
+        membership.patient_keys(patient_data.email, patient_data.referral_no),
+        lambda: async_db.existing_patient(adb, patient_data.email, patient_data.referral_no),
     )
     if existing_patient:
         raise HTTPException(status_code=400, detail="User already exists.")
 
-    hashed_password = hash_password(patient_data.password)
+    hashed_password = await passwords.hash(patient_data.password)
     patient_data.password = hashed_password
 
-    py_functions.store_patient(cnxn, patient_data)
+    try:
+        patient_id = await async_db.store_patient(adb, patient_data)
+    except async_db.AlreadyExists:
+        raise HTTPException(status_code=400, detail="User already exists.")
+    if patient_id is None:
+        raise HTTPException(status_code=500, detail="Could not add the user.")
+    membership.patients.add(*membership.patient_keys(patient_data.email, patient_data.referral_no))
+    search.index.add(search.patient_document(patient_id, patient_data.model_dump()))
+    # Send welcome email; queued, so the provider never holds up the response
+    if patient_data.name:
+        outbox.enqueue(email_module.welcome(patient_data.email, patient_data.name))
 
     return {"success": True, "message": "User added successfully."}
 
@@ -161,15 +744,34 @@ async def create_patient(patient_data: Patient):
 @app.post("/hospitals/new")
 async def create_hospital(hospital: Hospital):
     # Check if the user exists
-    existing_client = py_functions.existing_hospital(cnxn, hospital.Email)
+    existing_client = await membership.hospitals.exists(
+        [membership.email_key(hospital.Email)],
+        lambda: async_db.existing_hospital(adb, hospital.Email),
+    )
     if existing_client:
         raise HTTPException(status_code=400, detail="Hospital already exists.")
 
-    py_functions.add_hospital(cnxn, hospital)
+    try:
+        hospital_id = await async_db.add_hospital(adb, hospital)
+    except async_db.AlreadyExists:
+        raise HTTPException(status_code=400, detail="Hospital already exists.")
+    if hospital_id is None:
+        raise HTTPException(status_code=500, detail="Could not add the hospital.")
+    membership.hospitals.add(membership.email_key(hospital.Email))
+    spatial.hospitals.add(
+        spatial.hospital_record(
+            hospital_id,
+            hospital.HospitalName,
+            hospital.Type,
+            hospital.Latitude,
+            hospital.Longitude,
+            hospital.EmergencyLine,
+        )
+    )
+    search.index.add(search.hospital_document(hospital_id, hospital.model_dump()))
 
     # Send welcome email
-    # if patient.name:
-    #     await Email(patient.email, "Welcome").send_welcome(patient.name)
+    outbox.enqueue(email_module.welcome(hospital.Email, hospital.HospitalName))
 
     return JSONResponse(
         status_code=200,
@@ -182,22 +784,32 @@ async def create_hospital(hospital: Hospital):
 
 
 @app.post("/doctors/new")
-async def create_doctor(doctor: Doctor):
+async def create_doctor(doctor: Doctor, request: Request):
+    await throttle(request)
     # Check if the user exists
-    existing_client = py_functions.existing_doctor(cnxn, doctor.Email)
+    existing_client = await membership.doctors.exists(
+        [membership.email_key(doctor.Email)],
+        lambda: async_db.existing_doctor(adb, doctor.Email),
+    )
     if existing_client:
         raise HTTPException(status_code=400, detail="doctor already exists.")
 
-    salt_rounds = 12
-    hashed_password = ""
-    # hashed_password = hashpw(doctor.Password.encode("utf-8"), gensalt(salt_rounds))
-    doctor.Password = hashed_password
+    # Hashed like patient passwords so /doctors/login can verify it
+    doctor.Password = await passwords.hash(doctor.Password)
 
-    py_functions.add_doctor(cnxn, doctor)
+    try:
+        doctor_id = await async_db.add_doctor(adb, doctor)
+    except async_db.AlreadyExists:
+        raise HTTPException(status_code=400, detail="doctor already exists.")
+    if doctor_id is None:
+        raise HTTPException(status_code=500, detail="Could not add the doctor.")
+    membership.doctors.add(membership.email_key(doctor.Email))
+    search.index.add(search.doctor_document(doctor_id, doctor.model_dump()))
+    if py_functions.doctor_status(doctor.Status):
+        presence.doctors.seen(doctor_id)
 
     # Send welcome email
-    # if patient.name:
-    #     await Email(patient.email, "Welcome").send_welcome(patient.name)
+    outbox.enqueue(email_module.welcome(doctor.Email, doctor.DoctorName))
 
     return JSONResponse(
         status_code=200,
@@ -209,6 +821,131 @@ async def create_doctor(doctor: Doctor):
     )
 
 
+def validate_bulk(rows, model):
+    # Validate every row, collecting per-row errors instead of failing the batch
+    if len(rows) > config.BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {config.BULK_MAX_ROWS} rows per request."
+        )
+    valid = []
+    errors = []
+    for position, row in enumerate(rows):
+        try:
+            valid.append((position, model.model_validate(row)))
+        except ValidationError as e:
+            errors.append(
+                {
+                    "row": position,
+                    "errors": [
+                        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}"
+                        for err in e.errors()
+                    ],
+                }
+            )
+    return valid, errors
+
+
+async def register_bulk(valid, errors, statement, index, keys_of, taken, password_field=None):
+    # Drop rows that clash with existing records or with earlier rows of the
+    # same batch, hash passwords in parallel and COPY the rest in one go
+    accepted = []
+    seen = set(taken)
+    for position, item in valid:
+        keys = [key for key in keys_of(item) if key]
+        if any(key in seen for key in keys):
+            errors.append({"row": position, "errors": ["Already exists."]})
+            continue
+        seen.update(keys)
+        accepted.append(item)
+
+    if password_field:
+        hashed = await passwords.hash_many([getattr(item, password_field) for item in accepted])
+        for item, hashed_password in zip(accepted, hashed):
+            setattr(item, password_field, hashed_password)
+
+    if accepted:
+        try:
+            await async_db.bulk_insert(adb, statement, accepted)
+        except async_db.DatabaseError as e:
+            # The batch is one transaction, so nothing was written
+            raise HTTPException(status_code=409, detail=f"Bulk insert failed: {e}")
+        for item in accepted:
+            index.add(*keys_of(item))
+
+    errors.sort(key=lambda error: error["row"])
+    return JSONResponse(
+        status_code=200,
+        content={
+            "success": not errors,
+            "message": f"{len(accepted)} added, {len(errors)} rejected.",
+            "data": {"added": len(accepted), "errors": errors},
+        },
+    )
+
+
+@app.post("/patients/bulk")
+async def create_patients_bulk(
+    request: Request, rows: List[dict] = Body(...), user: dict = Depends(staff_user)
+):
+    await throttle(request, rows=len(rows))
+    valid, errors = validate_bulk(rows, Patient)
+    taken_emails, taken_referrals = await async_db.registered_patient_keys(
+        adb,
+        [patient.email for _, patient in valid],
+        [patient.referral_no for _, patient in valid if patient.referral_no],
+    )
+    taken = {membership.email_key(email) for email in taken_emails}
+    taken.update(membership.referral_key(referral_no) for referral_no in taken_referrals)
+    return await register_bulk(
+        valid,
+        errors,
+        py_functions.PATIENT_INSERT,
+        membership.patients,
+        lambda patient: membership.patient_keys(patient.email, patient.referral_no),
+        taken,
+        password_field="password",
+    )
+
+
+@app.post("/hospitals/bulk")
+async def create_hospitals_bulk(
+    request: Request, rows: List[dict] = Body(...), user: dict = Depends(staff_user)
+):
+    await throttle(request, rows=len(rows))
+    valid, errors = validate_bulk(rows, Hospital)
+    taken_emails = await async_db.registered_emails(
+        adb, "Hospitals", [hospital.Email for _, hospital in valid]
+    )
+    return await register_bulk(
+        valid,
+        errors,
+        py_functions.HOSPITAL_INSERT,
+        membership.hospitals,
+        lambda hospital: [membership.email_key(hospital.Email)],
+        {membership.email_key(email) for email in taken_emails},
+    )
+
+
+@app.post("/doctors/bulk")
+async def create_doctors_bulk(
+    request: Request, rows: List[dict] = Body(...), user: dict = Depends(staff_user)
+):
+    await throttle(request, rows=len(rows))
+    valid, errors = validate_bulk(rows, Doctor)
+    taken_emails = await async_db.registered_emails(
+        adb, "Doctors", [doctor.Email for _, doctor in valid]
+    )
+    return await register_bulk(
+        valid,
+        errors,
+        py_functions.DOCTOR_INSERT,
+        membership.doctors,
+        lambda doctor: [membership.email_key(doctor.Email)],
+        {membership.email_key(email) for email in taken_emails},
+        password_field="Password",
+    )
+
+
 # @app.post("/doctors/login")
 # async def doctor_login(login_data: DoctorLoginData):
 #     # Fetch the patient data from the database using the provided email
@@ -237,12 +974,272 @@ async def create_doctor(doctor: Doctor):
 # #         raise HTTPException(status_code=400, detail=str(e))
 
 
+async def check_appointment_owner(user, patient_id, doctor_id):
+    # Staff handle anyone's appointments; a patient or doctor only their own
+    if user.get("staff"):
+        return
+    if user["role"] == "patient":
+        own_id = await async_db.fetch_patient_id(adb, user["sub"])
+        if own_id is not None and str(own_id) == str(patient_id):
+            return
+    elif user["role"] == "doctor":
+        own_id = await presence.doctors.doctor_id(adb, user["sub"])
+        if own_id is not None and str(own_id) == str(doctor_id):
+            return
+    raise tokens.Forbidden("Not your appointment.")
+
+
+@app.post("/appointments")
+async def book_appointment(appointment: Appointment, user: dict = Depends(current_user)):
+    await check_appointment_owner(user, appointment.PatientID, appointment.DoctorID)
+    start, end = schedule.interval(appointment.Date, appointment.Time, appointment.Duration)
+    if start < datetime.now():
+        raise HTTPException(status_code=400, detail="Appointments must be in the future.")
+    active = appointment.Status.lower() != "cancelled"
+
+    # One booking at a time per doctor, so the check and the insert can't interleave
+    async with schedule.appointments.lock(appointment.DoctorID):
+        doctor_schedule = await schedule.appointments.get(adb, appointment.DoctorID)
+        if doctor_schedule is None:
+            raise HTTPException(status_code=404, detail="Doctor not found.")
+        if active and doctor_schedule.conflict(start, end) is not None:
+            schedule.appointments.record_conflict()
+            raise HTTPException(status_code=409, detail="The doctor is already booked at that time.")
+        try:
+            appointment_id = await async_db.book_appointment(adb, appointment)
+        except async_db.SlotTaken:
+            # Booked through another worker since this one loaded the schedule
+            schedule.appointments.record_conflict(in_database=True)
+            await schedule.appointments.get(adb, appointment.DoctorID, reload=True)
+            raise HTTPException(status_code=409, detail="The doctor is already booked at that time.")
+        if active:
+            doctor_schedule.add(start, end, appointment_id)
+
+    return JSONResponse(
+        status_code=200,
+        content={
+            "success": True,
+            "message": "Appointment booked.",
+            "data": {"AppointmentID": appointment_id},
+        },
+    )
+
+
+@app.put("/appointments/{appointment_id}")
+async def reschedule_appointment(
+    appointment_id: int, change: RescheduleData, user: dict = Depends(current_user)
+):
+    current = await async_db.fetch_appointment(adb, appointment_id)
+    if not current:
+        raise HTTPException(status_code=404, detail="Appointment not found.")
+    await check_appointment_owner(user, current["PatientID"], current["DoctorID"])
+    doctor_id = current["DoctorID"]
+
+    async with schedule.appointments.lock(doctor_id):
+        # Read again under the lock: a concurrent reschedule may have moved it
+        current = await async_db.fetch_appointment(adb, appointment_id)
+        if not current:
+            raise HTTPException(status_code=404, detail="Appointment not found.")
+        minutes = change.Duration or current["Duration"]
+        start, end = schedule.interval(change.Date, change.Time, minutes)
+        if start < datetime.now():
+            raise HTTPException(status_code=400, detail="Appointments must be in the future.")
+        doctor_schedule = await schedule.appointments.get(adb, doctor_id)
+        if doctor_schedule is None:
+            raise HTTPException(status_code=404, detail="Doctor not found.")
+        if doctor_schedule.conflict(start, end, ignore=appointment_id) is not None:
+            schedule.appointments.record_conflict()
+            raise HTTPException(status_code=409, detail="The doctor is already booked at that time.")
+        try:
+            updated = await async_db.reschedule_appointment(
+                adb, appointment_id, start.date(), start.time(), minutes
+            )
+        except async_db.SlotTaken:
+            schedule.appointments.record_conflict(in_database=True)
+            await schedule.appointments.get(adb, doctor_id, reload=True)
+            raise HTTPException(status_code=409, detail="The doctor is already booked at that time.")
+        if not updated:
+            raise HTTPException(status_code=404, detail="Appointment not found.")
+        doctor_schedule.remove(datetime.combine(current["Date"], current["Time"]), appointment_id)
+        if current["Status"].lower() != "cancelled":
+            doctor_schedule.add(start, end, appointment_id)
+
+    return {"success": True, "message": "Appointment rescheduled.", "data": {"AppointmentID": appointment_id}}
+
+
+@app.get("/doctors/{doctor_id}/availability")
+async def doctor_availability(
+    doctor_id: str,
+    after: Optional[datetime] = None,
+    count: int = Query(5, ge=1, le=100),
+    duration: int = Query(config.APPOINTMENT_MINUTES, ge=1, le=24 * 60),
+):
+    doctor_id = schedule.doctor_key(doctor_id)
+    if doctor_id is None:
+        raise HTTPException(status_code=404, detail="Doctor not found.")
+    async with schedule.appointments.lock(doctor_id):
+        doctor_schedule = await schedule.appointments.get(adb, doctor_id)
+    if doctor_schedule is None:
+        raise HTTPException(status_code=404, detail="Doctor not found.")
+    now = datetime.now()
+    if after is not None and after.tzinfo is not None:
+        # Bookings are naive server-local times
+        after = after.astimezone().replace(tzinfo=None)
+    slots = doctor_schedule.free_slots(
+        max(after, now) if after else now,
+        count,
+        duration,
+        schedule.DAY_START,
+        schedule.DAY_END,
+        schedule.HORIZON,
+    )
+    return {
+        "success": True,
+        "data": [{"Date": slot.date().isoformat(), "Time": slot.strftime("%H:%M")} for slot in slots],
+    }
+
+
+@app.post("/emergencies/intake")
+async def emergency_intake(
+    emergency: Emergency,
+    k: int = Query(3, ge=1, le=20),
+    hospital_type: Optional[str] = Query(None, description="Only hospitals of this Type"),
+):
+    # Answered from the in-memory grid, never by scanning Hospitals
+    if not -90 <= emergency.latitude <= 90 or not -180 <= emergency.Logitude <= 180:
+        raise HTTPException(status_code=400, detail="Invalid coordinates.")
+    with metrics.timer("dispatch", "nearest_hospitals"):
+        nearest = spatial.hospitals.nearest(emergency.latitude, emergency.Logitude, k, hospital_type)
+    if not nearest and not spatial.hospitals.ready:
+        raise HTTPException(
+            status_code=503, detail="Hospital index is loading, please retry.", headers={"Retry-After": "1"}
+        )
+    if emergency.HospitalID is None and nearest:
+        emergency.HospitalID = str(nearest[0][1]["HospitalID"])
+
+    return {
+        "success": True,
+        "message": f"{len(nearest)} hospitals found.",
+        "data": {
+            "emergency": emergency.model_dump(),
+            "hospitals": [
+                {**hospital, "distance_km": round(distance, 3)} for distance, hospital in nearest
+            ],
+        },
+    }
+
+
+@app.get("/lab_results")
+def get_lab_results(
+    cursor: Optional[str] = None,
+    limit: int = Query(config.LAB_RESULTS_PAGE_SIZE, ge=1, le=config.LAB_RESULTS_MAX_PAGE_SIZE),
+    patient_id: Optional[str] = None,
+    test_type: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    user: dict = Depends(staff_user),
+):
+    field_list = [name.strip() for name in fields.split(",") if name.strip()] if fields else None
+    try:
+        with pool.connection() as cnxn:
+            rows, columns, next_cursor = py_functions.fetch_lab_results_page(
+                cnxn,
+                limit,
+                cursor_token=cursor,
+                patient_id=patient_id,
+                test_type=test_type,
+                date_from=date_from,
+                date_to=date_to,
+                fields=field_list,
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with metrics.timer("encode", "get_lab_results"):
+        body = encoders.dumps(
+            {
+                "data": [encoders.row_to_dict(columns, record) for record in rows],
+                "next_cursor": next_cursor,
+            }
+        )
+    return Response(body, media_type="application/json")
+
+
+@app.get("/lab_results/export")
+def export_lab_results(
+    request: Request,
+    format: Optional[str] = Query(None, description="arrow, parquet or csv; overrides Accept"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to export"),
+    user: dict = Depends(staff_user),
+):
+    import export
+
+    fmt = export.negotiate(request.headers.get("accept"), format)
+    if fmt is None:
+        raise HTTPException(
+            status_code=406,
+            detail="Supported formats: " + ", ".join(export.MEDIA_TYPES.values()),
+        )
+    field_list = [name.strip() for name in fields.split(",") if name.strip()] if fields else None
+    if field_list:
+        # Validate the projection before the response starts
+        with pool.connection() as cnxn:
+            columns = py_functions.lab_result_columns(cnxn)
+        try:
+            for name in field_list:
+                py_functions.lab_result_column(columns, name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return streaming_from_pool(
+        lambda cnxn: export.iter_export(
+            cnxn, fmt, fields=field_list, block_size=config.EXPORT_BLOCK_SIZE
+        ),
+        export.MEDIA_TYPES[fmt],
+        headers={
+            "Content-Disposition": f'attachment; filename="lab_results.{export.EXTENSIONS[fmt]}"'
+        },
+    )
+
+
+@app.get("/analytics/tests")
+def get_test_analytics(user: dict = Depends(staff_user)):
+    import analytics
+
+    return Response(encoders.dumps(analytics.lab_results.tests()), media_type="application/json")
+
+
+@app.get("/analytics/tests/{test_type}")
+def get_test_type_analytics(test_type: str, user: dict = Depends(staff_user)):
+    import analytics
+
+    result = analytics.lab_results.tests(test_type)
+    if not result:
+        raise HTTPException(status_code=404, detail="No results for this test type.")
+    return Response(encoders.dumps(result[0]), media_type="application/json")
+
+
+@app.get("/analytics/patients/{patient_id}")
+def get_patient_analytics(patient_id: str, user: dict = Depends(staff_user)):
+    import analytics
+
+    result = analytics.lab_results.patient(patient_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="No results for this patient.")
+    return Response(encoders.dumps({"patient_id": patient_id, "tests": result}), media_type="application/json")
+
+
 @app.get("/patient_data")
-def get_patient_data():
-    df = py_functions.fetch_patient_data(cnxn)
-    df.replace([np.inf, -np.inf], None, inplace=True)  # Replace infinities with None
-    df = df.where(pd.notnull(df), None)  # Replace NaNs with None
-    return df.to_dict(orient="records")
+def get_patient_data(request: Request):
+    return conditional_lab_results(request, "patient_data", load_patient_data)
+
+
+def load_patient_data():
+    with pool.connection() as cnxn:
+        data, columns = py_functions.fetch_patient_data(cnxn)
+    with metrics.timer("encode", "get_patient_data"):
+        return encoders.dumps_rows(columns, data)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import math
+
+import async_db
+
+# Process-local index of already-registered emails / referral numbers so most
+# signups can skip the existence query. A Bloom filter answers "definitely
+# not registered"; an exact set holds what this process inserted since the
+# last rebuild. Anything else ("maybe") still goes to the database.
+#
+# Other workers' inserts only show up after the next rebuild, so the
+# database's unique constraints remain the final word on duplicates.
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 64)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: h1 + i*h2 from one 128-bit digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class MembershipIndex:
+    def __init__(self, name, error_rate=0.01, min_capacity=10000):
+        self.name = name
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.ready = False
+        self._bloom = BloomFilter(min_capacity, error_rate)
+        self._recent = set()
+        self._pending = None  # keys added while a rebuild is running
+        self._stats = {"skipped": 0, "queried": 0, "false_positives": 0, "rebuilds": 0}
+
+    def add(self, *keys):
+        for key in keys:
+            if key is None:
+                continue
+            self._recent.add(key)
+            if self._pending is not None:
+                self._pending.append(key)
+
+    def lookup(self, *keys):
+        # True: registered, False: definitely not, None: ask the database
+        keys = [key for key in keys if key is not None]
+        if not self.ready:
+            return None
+        if any(key in self._recent for key in keys):
+            return True
+        if any(key in self._bloom for key in keys):
+            return None
+        return False
+
+    async def exists(self, keys, query):
+        known = self.lookup(*keys)
+        if known is not None:
+            self._stats["skipped"] += 1
+            return known
+        self._stats["queried"] += 1
+        result = await query()
+        if result:
+            self.add(*keys)
+        elif self.ready:
+            self._stats["false_positives"] += 1
+        return result
+
+    async def rebuild(self, load, expected=0):
+        # `load` is an async iterator over every registered key
+        self._pending = []
+        try:
+            bloom = BloomFilter(max(expected * 2, self.min_capacity), self.error_rate)
+            async for key in load():
+                if key is not None:
+                    bloom.add(key)
+            recent = set(self._pending)
+            for key in recent:
+                bloom.add(key)
+        finally:
+            self._pending = None
+        self._bloom = bloom
+        self._recent = recent
+        self.ready = True
+        self._stats["rebuilds"] += 1
+
+    def stats(self):
+        return {
+            **self._stats,
+            "ready": self.ready,
+            "keys": self._bloom.count,
+            "recent": len(self._recent),
+            "bloom_bits": self._bloom.size,
+        }
+
+
+def email_key(email):
+    return f"email:{email}"
+
+
+def referral_key(referral_no):
+    return f"referral:{referral_no}" if referral_no else None
+
+
+def patient_keys(email, referral_no):
+    return (email_key(email), referral_key(referral_no))
+
+
+patients = MembershipIndex("patients")
+hospitals = MembershipIndex("hospitals")
+doctors = MembershipIndex("doctors")
+
+
+async def refresh_all(db):
+    async def patient_rows():
+        async for email, referral_no in async_db.iter_rows(db, "SELECT Email, Referral_No FROM PATIENTS"):
+            for key in patient_keys(email, referral_no):
+                yield key
+
+    def email_rows(table):
+        async def load():
+            async for (email,) in async_db.iter_rows(db, f"SELECT Email FROM {table}"):
+                yield email_key(email)
+
+        return load
+
+    await patients.rebuild(patient_rows, 2 * await async_db.estimate_rows(db, "PATIENTS"))
+    await hospitals.rebuild(email_rows("Hospitals"), await async_db.estimate_rows(db, "Hospitals"))
+    await doctors.rebuild(email_rows("Doctors"), await async_db.estimate_rows(db, "Doctors"))
+
+
+async def keep_fresh(db, interval):
+    # Warm once at startup, then rebuild periodically to pick up rows
+    # inserted by other workers
+    while True:
+        try:
+            await refresh_all(db)
+        except Exception as e:
+            print(f"Membership index refresh failed: {e}")
+        await asyncio.sleep(interval)
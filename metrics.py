@@ -0,0 +1,448 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import os
+import secrets
+import threading
+import time
+
+# Minimal Prometheus-style instrumentation: counters, gauges and histograms
+# kept in process memory and rendered in the text exposition format on
+# /metrics. Updates are a lock plus a couple of additions, cheap enough to
+# leave on permanently.
+#
+# Under gunicorn every worker has its own values and a scrape reaches just
+# one of them. With a shared directory (enable_multiprocess), each worker
+# writes a snapshot of its values there and /metrics adds up the counters
+# and histograms of every worker. Gauges describe one process, so they are
+# reported per live worker with a `worker` label. When a worker exits, the
+# master folds its last snapshot into dead.json (mark_process_dead), so
+# recycling a worker never makes a counter go backwards.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_collectors = []
+
+_directory = None  # shared snapshot directory, None in single-process mode
+_worker = None  # this worker's snapshot name
+DEAD = "dead.json"
+
+# Per-request phase timings, reported in the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in self.values().items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # label key -> [bucket counts..., +Inf count, sum]
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[position] += 1
+            counts[-1] += value
+
+    def values(self):
+        with self._lock:
+            return {key: list(counts) for key, counts in self._values.items()}
+
+    def samples(self):
+        return _histogram_samples(self.name, self.buckets, self.values())
+
+
+def _histogram_samples(name, buckets, values):
+    result = []
+    for key, counts in values.items():
+        cumulative = 0
+        for bound, count in zip(tuple(buckets) + (float("inf"),), counts[:-1]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            result.append((f"{name}_bucket", key, cumulative, (("le", le),)))
+        result.append((f"{name}_count", key, cumulative))
+        result.append((f"{name}_sum", key, counts[-1]))
+    return result
+
+
+def register_collector(collect):
+    # collect() returns [(name, kind, help, {labels}, value), ...] at scrape time,
+    # for stats owned by other components (pools, caches, ...)
+    _collectors.append(collect)
+
+
+def stats_collector(prefix, help, stats, **labels):
+    # Turns a component's stats() dict into gauges named <prefix>_<key>
+    def collect():
+        samples = []
+        for key, value in stats().items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                samples.append((f"{prefix}_{key}", "gauge", help, labels, value))
+        return samples
+
+    return collect
+
+
+def render():
+    if _directory is not None:
+        return _render_shared()
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for sample in metric.samples():
+            name, key, value = sample[:3]
+            extra = sample[3] if len(sample) > 3 else None
+            lines.append(f"{name}{_format_labels(key, extra)} {value}")
+
+    seen = set()
+    for collect in _collectors:
+        for name, kind, help, labels, value in collect():
+            if name not in seen:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(_label_key(labels))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def enable_multiprocess(directory):
+    global _directory
+    os.makedirs(directory, exist_ok=True)
+    _directory = directory
+
+
+def _worker_name():
+    # Decided after the fork: the pid, plus a tag because pids get reused
+    global _worker
+    if _worker is None or not _worker.startswith(f"{os.getpid()}-"):
+        _worker = f"{os.getpid()}-{secrets.token_hex(4)}"
+    return _worker
+
+
+def _snapshot():
+    # This process's values: {name: {"kind", "help", "buckets", "values": {label key: value}}}
+    families = {}
+    for metric in _metrics:
+        families[metric.name] = {
+            "kind": metric.kind,
+            "help": metric.help,
+            "buckets": list(getattr(metric, "buckets", ())),
+            "values": metric.values(),
+        }
+    for collect in _collectors:
+        for name, kind, help, labels, value in collect():
+            family = families.setdefault(name, {"kind": kind, "help": help, "buckets": [], "values": {}})
+            family["values"][_label_key(labels)] = value
+    return families
+
+
+def _dump(path, families, **extra):
+    # Written aside and renamed, so a reader never sees half a file
+    data = {
+        "families": {
+            name: {**family, "values": [[list(key), value] for key, value in family["values"].items()]}
+            for name, family in families.items()
+        },
+        **extra,
+    }
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    for family in data["families"].values():
+        family["values"] = {tuple(tuple(item) for item in key): value for key, value in family["values"]}
+    return data
+
+
+def _add(totals, families, worker=None):
+    # Sums counters and histograms into totals; gauges only for a live worker, labelled with it
+    for name, family in families.items():
+        if family["kind"] == "gauge" and worker is None:
+            continue
+        total = totals.setdefault(name, {**family, "values": {}})
+        for key, value in family["values"].items():
+            if family["kind"] == "gauge":
+                total["values"][key + (("worker", worker),)] = value
+            elif family["kind"] == "histogram":
+                current = total["values"].get(key)
+                total["values"][key] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                total["values"][key] = total["values"].get(key, 0) + value
+
+
+def write_snapshot():
+    if _directory is not None:
+        _dump(os.path.join(_directory, f"{_worker_name()}.json"), _snapshot())
+
+
+async def keep_snapshot(interval):
+    # Runs in every worker; other workers' scrapes see values at most this old
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(write_snapshot)
+        except OSError as e:
+            print(f"Metrics snapshot failed: {e}")
+
+
+def mark_process_dead(pid):
+    # gunicorn child_exit hook, in the master: keeps an exited worker's
+    # counters and histograms in dead.json and drops its gauges
+    if _directory is None:
+        return
+    dead_path = os.path.join(_directory, DEAD)
+    dead = _load(dead_path) or {"families": {}, "merged": []}
+    totals = {}
+    _add(totals, dead["families"])
+    # Names only matter while their file may still be read (see _render_shared)
+    merged = {name for name in dead["merged"] if os.path.exists(os.path.join(_directory, f"{name}.json"))}
+    exited = [entry[:-5] for entry in os.listdir(_directory) if entry.startswith(f"{pid}-") and entry.endswith(".json")]
+    for name in exited:
+        snapshot = _load(os.path.join(_directory, f"{name}.json"))
+        if snapshot is not None:
+            _add(totals, snapshot["families"])
+        merged.add(name)
+    _dump(dead_path, totals, merged=sorted(merged))
+    for name in exited:
+        try:
+            os.remove(os.path.join(_directory, f"{name}.json"))
+        except FileNotFoundError:
+            pass
+
+
+def _render_shared():
+    write_snapshot()
+    # Live snapshots before dead.json: a worker folded in meanwhile is then
+    # listed in "merged" and counted once, from dead.json
+    live = {}
+    for entry in os.listdir(_directory):
+        if entry.endswith(".json") and entry != DEAD:
+            snapshot = _load(os.path.join(_directory, entry))
+            if snapshot is not None:
+                live[entry[:-5]] = snapshot
+    dead = _load(os.path.join(_directory, DEAD)) or {"families": {}, "merged": []}
+    totals = {}
+    _add(totals, dead["families"])
+    for name, snapshot in live.items():
+        if name not in dead["merged"]:
+            _add(totals, snapshot["families"], worker=name)
+
+    lines = []
+    for name, family in totals.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        if family["kind"] == "histogram":
+            samples = _histogram_samples(name, family["buckets"], family["values"])
+        else:
+            samples = [(name, key, value) for key, value in family["values"].items()]
+        for sample in samples:
+            sample_name, key, value = sample[:3]
+            extra = sample[3] if len(sample) > 3 else None
+            lines.append(f"{sample_name}{_format_labels(key, extra)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Shared instruments
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route.")
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being served.")
+OPERATION_SECONDS = Histogram("operation_duration_seconds", "Time spent in hot-path operations.")
+DB_ERRORS = Counter("db_errors_total", "Database helper calls that raised.")
+
+
+def start_request():
+    # Call at the start of a request; returns the dict timings are added to
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record(kind, name, seconds):
+    OPERATION_SECONDS.observe(seconds, kind=kind, operation=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        label = f"{kind}-{name}"
+        timings[label] = timings.get(label, 0.0) + seconds
+
+
+def timed(kind, name=None):
+    # Decorator for sync and async functions; DB helpers also count errors
+    def decorate(fn):
+        operation = name or fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    if kind == "db":
+                        DB_ERRORS.inc(operation=operation)
+                    raise
+                finally:
+                    record(kind, operation, time.perf_counter() - started)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if kind == "db":
+                    DB_ERRORS.inc(operation=operation)
+                raise
+            finally:
+                record(kind, operation, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorate
+
+
+class timer:
+    # Context manager form of timed(), for code that isn't its own function
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.kind, self.name, time.perf_counter() - self.started)
+
+
+def server_timing(timings):
+    # Server-Timing header value, durations in milliseconds
+    return ", ".join(f"{label};dur={seconds * 1000:.2f}" for label, seconds in timings.items())
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests.
+
+    Written against raw ASGI rather than BaseHTTPMiddleware so streaming
+    responses pass through untouched. With ``server_timing`` the collected
+    phase timings are sent back in a Server-Timing header.
+    """
+
+    def __init__(self, app, server_timing=False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = start_request()
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if self.server_timing:
+                    timings["total"] = time.perf_counter() - started
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(timings).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=_route_name(scope),
+                status=status["code"],
+            )
+
+
+def _route_name(scope):
+    # Use the route template, never the raw path, to keep label cardinality bounded
+    route = scope.get("route")
+    if route is not None and hasattr(route, "path"):
+        return route.path
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        return getattr(endpoint, "__name__", "unknown")
+    return "unmatched"
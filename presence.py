@@ -0,0 +1,223 @@
+import asyncio
+import secrets
+import time
+from collections import OrderedDict
+
+import orjson
+
+import async_db
+import config
+import metrics
+
+# In-memory registry of which doctors are online. A doctor is online while
+# heartbeats (or an explicit "Online") keep arriving, and goes offline on an
+# explicit "Offline" or when no heartbeat has been seen for `ttl` seconds.
+#
+# Every change becomes a delta that is pushed to the server-sent event
+# subscribers of this process. Heartbeats and status changes received here
+# are also published on a Postgres NOTIFY channel a few times a second, so
+# every worker keeps the same picture (and expires doctors at about the
+# same moment) without polling anything. Doctors.Status is brought up to
+# date in batches.
+
+PRESENCE_CHANGES = metrics.Counter("presence_changes_total", "Doctor presence changes by new status.")
+
+NOTIFY_PAYLOAD_ENTRIES = 500  # keeps a payload well under Postgres' 8000 byte limit
+
+
+def status_name(online):
+    return "Online" if online else "Offline"
+
+
+class Subscriber:
+    def __init__(self, max_queue):
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = False  # fell too far behind; the stream ends and the client reconnects
+
+
+class PresenceRegistry:
+    def __init__(self, ttl=45.0, max_queue=256):
+        self.ttl = ttl
+        self.max_queue = max_queue
+        self.origin = None  # this worker's id in published messages, set after fork
+        self._online = OrderedDict()  # doctor id -> last heartbeat (monotonic), oldest first
+        self._subscribers = set()
+        self._outgoing = {}  # doctor id -> online, waiting to be published
+        self._dirty = {}  # doctor id -> online, waiting to be written back
+        self._doctor_ids = {}  # email -> DoctorID
+        self._stats = {"heartbeats": 0, "remote": 0, "expired": 0, "dropped_subscribers": 0, "written": 0}
+
+    def seen(self, doctor_id, online=True, local=True):
+        # A heartbeat is seen(doctor_id); local=False for what other workers published
+        self._stats["heartbeats" if local else "remote"] += 1
+        if online:
+            was_online = doctor_id in self._online
+            self._online[doctor_id] = time.monotonic()
+            self._online.move_to_end(doctor_id)
+            if not was_online:
+                self._changed(doctor_id, True)
+        elif self._online.pop(doctor_id, None) is not None:
+            self._changed(doctor_id, False)
+        if local:
+            self._outgoing[doctor_id] = online
+
+    def restore(self, doctor_ids):
+        # Doctors the database says are online; they get one ttl to check in
+        now = time.monotonic()
+        for doctor_id in doctor_ids:
+            if doctor_id not in self._online:
+                self._online[doctor_id] = now
+
+    def expire(self):
+        # Heartbeats are kept in arrival order, so only the expired ones are touched
+        deadline = time.monotonic() - self.ttl
+        while self._online:
+            doctor_id, last_seen = next(iter(self._online.items()))
+            if last_seen > deadline:
+                break
+            del self._online[doctor_id]
+            self._stats["expired"] += 1
+            self._changed(doctor_id, False)
+
+    def is_online(self, doctor_id):
+        return doctor_id in self._online
+
+    def snapshot(self):
+        return list(self._online)
+
+    def _changed(self, doctor_id, online):
+        PRESENCE_CHANGES.inc(status=status_name(online))
+        self._dirty[doctor_id] = online
+        delta = {"doctor_id": doctor_id, "status": status_name(online)}
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(delta)
+            except asyncio.QueueFull:
+                subscriber.dropped = True
+                self._subscribers.discard(subscriber)
+                self._stats["dropped_subscribers"] += 1
+
+    def subscribe(self):
+        subscriber = Subscriber(self.max_queue)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def take_outgoing(self):
+        outgoing, self._outgoing = self._outgoing, {}
+        return outgoing
+
+    def take_dirty(self):
+        dirty, self._dirty = self._dirty, {}
+        return dirty
+
+    def return_dirty(self, dirty):
+        # A write failed: keep the changes unless something newer came in meanwhile
+        for doctor_id, online in dirty.items():
+            self._dirty.setdefault(doctor_id, online)
+
+    def record_written(self, count):
+        self._stats["written"] += count
+
+    def receive(self, payload):
+        # Listener callback for messages published by publish()
+        try:
+            message = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            return
+        if message.get("origin") == self.origin:
+            return
+        for doctor_id, online in message.get("seen", ()):
+            self.seen(doctor_id, bool(online), local=False)
+
+    async def doctor_id(self, db, email):
+        doctor_id = self._doctor_ids.get(email)
+        if doctor_id is None:
+            doctor_id = await async_db.fetch_doctor_id(db, email)
+            if doctor_id is not None:
+                self._doctor_ids[email] = doctor_id
+        return doctor_id
+
+    def stats(self):
+        return {
+            **self._stats,
+            "online": len(self._online),
+            "subscribers": len(self._subscribers),
+            "pending_writes": len(self._dirty),
+        }
+
+
+doctors = PresenceRegistry(config.PRESENCE_TTL, config.PRESENCE_SUBSCRIBER_QUEUE)
+
+
+def _event(name, data):
+    return b"event: " + name.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+async def events(registry, keepalive=15.0):
+    # Server-sent event stream: the online doctors first, then deltas.
+    # Deltas that arrive together go out as one event.
+    subscriber = registry.subscribe()
+    try:
+        yield _event("snapshot", {"online": registry.snapshot()})
+        while True:
+            try:
+                delta = await asyncio.wait_for(subscriber.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                if subscriber.dropped:
+                    return
+                # A comment line keeps proxies from closing an idle stream
+                yield b": keepalive\n\n"
+                continue
+            deltas = [delta]
+            while not subscriber.queue.empty():
+                deltas.append(subscriber.queue.get_nowait())
+            yield _event("presence", deltas)
+            if subscriber.dropped:
+                return
+    finally:
+        registry.unsubscribe(subscriber)
+
+
+async def publish(db, registry, channel):
+    outgoing = list(registry.take_outgoing().items())
+    for start in range(0, len(outgoing), NOTIFY_PAYLOAD_ENTRIES):
+        payload = orjson.dumps(
+            {"origin": registry.origin, "seen": outgoing[start:start + NOTIFY_PAYLOAD_ENTRIES]}
+        ).decode()
+        await db.execute("SELECT pg_notify($1, $2);", channel, payload)
+
+
+async def write_back(db, registry):
+    dirty = registry.take_dirty()
+    if not dirty:
+        return
+    try:
+        await async_db.update_doctor_statuses(db, list(dirty), list(dirty.values()))
+    except Exception:
+        registry.return_dirty(dirty)
+        raise
+    registry.record_written(len(dirty))
+
+
+async def keep_fresh(db, registry, channel, broadcast_interval, write_interval):
+    # Runs in every worker: expiry, publishing this worker's heartbeats and
+    # the batched write-back to Doctors.Status
+    registry.origin = secrets.token_hex(8)
+    try:
+        registry.restore(await async_db.online_doctors(db))
+    except Exception as e:
+        print(f"Could not load doctor presence: {e}")
+    written_at = time.monotonic()
+    while True:
+        await asyncio.sleep(broadcast_interval)
+        try:
+            registry.expire()
+            await publish(db, registry, channel)
+            if time.monotonic() - written_at >= write_interval:
+                written_at = time.monotonic()
+                await write_back(db, registry)
+        except Exception as e:
+            print(f"Presence update failed: {e}")
@@ -1,18 +1,36 @@
 import argon2
 from pydantic import BaseModel, EmailStr, validator
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
 from base64 import urlsafe_b64encode, urlsafe_b64decode
 from os import urandom
+from uuid import uuid4
+from datetime import date, time, timedelta
+import json
 
 # from bcrypt import checkpw
 from typing import Optional
-import pandas as pd
 from argon2 import PasswordHasher
+from psycopg2 import sql as pgsql
+
+import config
+import metrics
+import statements
+
+ARGON2_PARAMETER_NAMES = ("time_cost", "memory_cost", "parallelism", "hash_len", "salt_len")
+
+
+def load_argon2_parameters(path=None):
+    # Parameters written by `python hashing.py calibrate`; library defaults if absent
+    path = path or config.ARGON2_PARAMS_FILE
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {name: int(saved[name]) for name in ARGON2_PARAMETER_NAMES if name in saved}
+
 
 # Creating an instance of PasswordHasher
-ph = PasswordHasher()
+ph = PasswordHasher(**load_argon2_parameters())
 
 # def fetch_data(cnxn):
 #     query = "SELECT TOP 10* FROM PATIENTS"
@@ -20,10 +38,14 @@ ph = PasswordHasher()
 #     return df
 
 
+@metrics.timed("db")
 def fetch_patient_data(cnxn):
-    query = "SELECT * FROM LabTestResults LIMIT 10;"
-    df = pd.read_sql(query, cnxn)
-    return df
+    cursor = cnxn.cursor()
+    cursor.execute("SELECT * FROM LabTestResults LIMIT 10;")
+    result = cursor.fetchall()
+    columns = [desc[0] for desc in cursor.description]
+    cursor.close()
+    return result, columns
 
 
 # Defining Pydantic models for the request body
@@ -57,6 +79,10 @@ class DoctorLoginData(BaseModel):
     Password: str
 
 
+class RefreshData(BaseModel):
+    refresh_token: str
+
+
 class Hospital(BaseModel):
     HospitalName: str
     Address: str
@@ -69,8 +95,23 @@ class Hospital(BaseModel):
     Telephone: str
     Docs: str
     ContactNumber: str
+    # Used to find the nearest hospitals for an emergency
+    Latitude: Optional[float] = None
+    Longitude: Optional[float] = None
     # Password: str/
 
+    @validator("Latitude")
+    def check_latitude(cls, value):
+        if value is not None and not -90 <= value <= 90:
+            raise ValueError("Latitude must be between -90 and 90")
+        return value
+
+    @validator("Longitude")
+    def check_longitude(cls, value):
+        if value is not None and not -180 <= value <= 180:
+            raise ValueError("Longitude must be between -180 and 180")
+        return value
+
 
 class Doctor(BaseModel):
     DoctorName: str
@@ -92,25 +133,41 @@ class Doctor(BaseModel):
         return value
 
 
+class PresenceData(BaseModel):
+    Status: str
+
+    @validator("Status")
+    def check_status(cls, value):
+        if value.lower() not in ["online", "offline"]:
+            raise ValueError('Status must be "Online" or "Offline"')
+        return value
+
+
 def hash_password(password):
     # Hashes the password
     return ph.hash(password)
 
 
 def verify_password(hash, password):
+    return verify_password_and_check(hash, password)[0]
+
+
+def verify_password_and_check(hash, password):
+    # Returns (matches, needs_rehash). A hash made with older parameters still
+    # matches; the caller re-hashes it instead of locking the user out.
     try:
         # Verifies the password against the hash
         ph.verify(hash, password)
         # If password is correct, it will return True
         # If password is incorrect, it will raise an exception
-        return ph.check_needs_rehash(hash) == False
+        return True, ph.check_needs_rehash(hash)
     except argon2.exceptions.VerifyMismatchError:
         # If the verification fails because the password is incorrect
-        return False
+        return False, False
     except argon2.exceptions.InvalidHashError:
         # If the verification fails because the hash is not a valid Argon2 hash
         # Log this error or handle it as needed
-        return False
+        return False, False
 
 
 class HospitalDoctor(BaseModel):
@@ -129,8 +186,54 @@ class Appointment(BaseModel):
     Payment_mode: str
     Meeting_type: str
     Notes: str
+    Duration: int = config.APPOINTMENT_MINUTES  # minutes
     # Password: str
 
+    @validator("DoctorID")
+    def check_doctor_id(cls, value):
+        # Canonical form, as schedule.doctor_key: "007" books doctor "7"
+        if not (value.isascii() and value.isdigit()):
+            raise ValueError("DoctorID must be a number")
+        return str(int(value))
+
+    @validator("Date")
+    def check_date(cls, value):
+        date.fromisoformat(value)  # YYYY-MM-DD
+        return value
+
+    @validator("Time")
+    def check_time(cls, value):
+        time.fromisoformat(value)  # HH:MM
+        return value
+
+    @validator("Duration")
+    def check_duration(cls, value):
+        if not 0 < value <= 24 * 60:
+            raise ValueError("Duration must be between 1 and 1440 minutes")
+        return value
+
+
+class RescheduleData(BaseModel):
+    Date: str
+    Time: str
+    Duration: Optional[int] = None
+
+    @validator("Date")
+    def check_date(cls, value):
+        date.fromisoformat(value)
+        return value
+
+    @validator("Time")
+    def check_time(cls, value):
+        time.fromisoformat(value)
+        return value
+
+    @validator("Duration")
+    def check_duration(cls, value):
+        if value is not None and not 0 < value <= 24 * 60:
+            raise ValueError("Duration must be between 1 and 1440 minutes")
+        return value
+
 
 class Consultations(BaseModel):
     PatientID: str
@@ -143,7 +246,7 @@ class Consultations(BaseModel):
 
 class Emergency(BaseModel):
     PatientID: str
-    HospitalID: str
+    HospitalID: Optional[str] = None  # filled in by dispatch when not given
     Time: str
     Type: str
     Logitude: float
@@ -153,6 +256,26 @@ class Emergency(BaseModel):
     # Password: str
 
 
+def doctor_status(value):
+    # The Status field is a boolean in the database
+    return value.lower() == "online"
+
+
+# INSERT statements for the write helpers, built once from the model fields
+PATIENT_INSERT = statements.register(Patient, "PATIENTS", returning="PatientID")
+GUARDIAN_INSERT = statements.register(Guardian, "Guardians", returning="id")
+HOSPITAL_INSERT = statements.register(Hospital, "Hospitals", returning="HospitalID")
+DOCTOR_INSERT = statements.register(
+    Doctor, "Doctors", converters={"Status": doctor_status}, returning="DoctorID"
+)
+APPOINTMENT_INSERT = statements.register(
+    Appointment,
+    "Appointments",
+    converters={"Date": date.fromisoformat, "Time": time.fromisoformat},
+    returning="AppointmentID",
+)
+
+
 ## check if the user exists
 # def existing_patient(cnxn, email, referral_no):
 #     query = "SELECT COUNT(1) FROM PATIENTS WHERE Email = ? OR Referral_No = ?;"
@@ -165,7 +288,10 @@ class Emergency(BaseModel):
 #         return False
 
 
+@metrics.timed("db")
 def existing_patient(cnxn, email, referral_no):
+    import pandas as pd
+
     query = "SELECT COUNT(1) FROM PATIENTS WHERE Email = %s OR Referral_No = %s;"
     params = (email, referral_no)
     df = pd.read_sql(query, cnxn, params=params)
@@ -200,21 +326,14 @@ def existing_patient(cnxn, email, referral_no):
 #     return True
 
 
+@metrics.timed("db")
 def store_patient(cnxn, new_patient):
-    # Assuming new_patient is a Pydantic model, convert it to a dictionary
-    new_patient_data = new_patient.dict()
-
     # Create a cursor object using the connection
     cursor = cnxn.cursor()
 
-    # Construct the SQL query with placeholders for parameters
-    placeholders = ", ".join(["%s"] * len(new_patient_data))  # Use %s for PostgreSQL
-    columns = ", ".join(new_patient_data.keys())
-    sql = f"INSERT INTO PATIENTS ({columns}) VALUES ({placeholders})"
-
     try:
-        # Execute the SQL query with the provided parameters
-        cursor.execute(sql, tuple(new_patient_data.values()))  # Pass values as a tuple
+        # Execute the prepared INSERT with the model's values
+        PATIENT_INSERT.execute(cursor, new_patient)
 
         # Commit the changes to the database
         cnxn.commit()
@@ -256,27 +375,19 @@ def store_patient(cnxn, new_patient):
 #     cursor.close()
 
 
+@metrics.timed("db")
 def store_guardian(cnxn, guardian_data):
-    # Convert the Pydantic model to a dictionary if it's not already one
-    if not isinstance(guardian_data, dict):
-        guardian_data = guardian_data.dict()
+    # Accept a plain dictionary as well as the Pydantic model
+    if isinstance(guardian_data, dict):
+        guardian_data = Guardian(**guardian_data)
 
     # Create a cursor object using the connection
     cursor = cnxn.cursor()
 
-    # Construct the SQL insert statement with placeholders for parameters
-    placeholders = ", ".join(["%s"] * len(guardian_data))
-    columns = ", ".join(guardian_data.keys())
-    values = tuple(guardian_data.values())
-
-    # PostgreSQL uses RETURNING to get the last inserted id
-    sql_insert = (
-        f"INSERT INTO Guardians ({columns}) VALUES ({placeholders}) RETURNING id;"
-    )
-
     # Try to execute the SQL insert statement and commit changes
+    # (the statement uses RETURNING to get the inserted id)
     try:
-        cursor.execute(sql_insert, values)
+        GUARDIAN_INSERT.execute(cursor, guardian_data)
         guardian_id = cursor.fetchone()[0]
         cnxn.commit()
         return guardian_id
@@ -335,6 +446,7 @@ def store_guardian(cnxn, guardian_data):
 #         }
 #     else:
 #         return None
+@metrics.timed("db")
 def fetch_patient_by_email(cnxn, email):
     cursor = cnxn.cursor()
     # Prepare the SQL query to fetch the patient
@@ -381,7 +493,10 @@ def fetch_patient_by_email(cnxn, email):
 #     return True
 
 
+@metrics.timed("db")
 def existing_hospital(cnxn, email):
+    import pandas as pd
+
     query = "SELECT COUNT(1) FROM Hospitals WHERE Email = %s;"
     params = (email,)
     df = pd.read_sql(query, cnxn, params=params)
@@ -392,19 +507,10 @@ def existing_hospital(cnxn, email):
         return False
 
 
+@metrics.timed("db")
 def add_hospital(cnxn, new_hospital):
-    new_hospital_data = new_hospital.dict()
-
     cursor = cnxn.cursor()
-    # Use %s as placeholder for PostgreSQL
-    placeholders = ", ".join(["%s"] * len(new_hospital_data))
-    columns = ", ".join(new_hospital_data.keys())
-    sql = f"INSERT INTO Hospitals ({columns}) VALUES ({placeholders})"
-
-    # Convert the values to a tuple
-    values = tuple(new_hospital_data.values())
-
-    cursor.execute(sql, values)
+    HOSPITAL_INSERT.execute(cursor, new_hospital)
     cnxn.commit()
     cursor.close()
     return True
@@ -458,7 +564,10 @@ def add_hospital(cnxn, new_hospital):
 #         return None
 
 
+@metrics.timed("db")
 def existing_doctor(cnxn, email):
+    import pandas as pd
+
     query = "SELECT COUNT(1) FROM Doctors WHERE Email = %s;"
     params = (email,)
     df = pd.read_sql(query, cnxn, params=params)
@@ -469,27 +578,17 @@ def existing_doctor(cnxn, email):
         return False
 
 
+@metrics.timed("db")
 def add_doctor(cnxn, new_doctor):
-    new_doctor_data = new_doctor.dict()
-
-    # Assuming the Status field is a boolean in your database
-    new_doctor_data["Status"] = new_doctor_data["Status"].lower() == "online"
-
+    # Status is converted to a boolean by the registered statement
     cursor = cnxn.cursor()
-    # Use %s as placeholder for PostgreSQL
-    placeholders = ", ".join(["%s"] * len(new_doctor_data))
-    columns = ", ".join(new_doctor_data.keys())
-    sql = f"INSERT INTO Doctors ({columns}) VALUES ({placeholders})"
-
-    # Convert the values to a tuple
-    values = tuple(new_doctor_data.values())
-
-    cursor.execute(sql, values)
+    DOCTOR_INSERT.execute(cursor, new_doctor)
     cnxn.commit()
     cursor.close()
     return True
 
 
+@metrics.timed("db")
 def fetch_data(cnxn):
     cursor = cnxn.cursor()
     query = "SELECT * FROM LabTestResults"
@@ -501,6 +600,147 @@ def fetch_data(cnxn):
     return result, columns
 
 
+@metrics.timed("db")
+def lab_results_version(cnxn):
+    # Cheap validator for LabTestResults: the row count catches deletes and
+    # the newest xmin (transaction id) catches inserts and updates. It scans
+    # the table but reads no column data, and skips all of the encoding.
+    cursor = cnxn.cursor()
+    cursor.execute("SELECT COUNT(*), COALESCE(MAX(xmin::text::bigint), 0) FROM LabTestResults;")
+    count, newest = cursor.fetchone()
+    cursor.close()
+    return f"{count}-{newest}"
+
+
+def stream_data(cnxn, batch_size=1000):
+    # Reads LabTestResults through a named (server-side) cursor and yields
+    # (columns, rows) one batch at a time, so memory stays flat
+    # Named cursors only live inside a transaction
+    autocommit = cnxn.autocommit
+    cnxn.autocommit = False
+    cursor = cnxn.cursor(name=f"labtestresults_{uuid4().hex}")
+    cursor.itersize = batch_size
+    try:
+        cursor.execute("SELECT * FROM LabTestResults")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            columns = [desc[0] for desc in cursor.description]
+            yield columns, rows
+    finally:
+        try:
+            cursor.close()
+            cnxn.rollback()
+            cnxn.autocommit = autocommit
+        except Exception:
+            # The connection is broken; the pool will replace it
+            pass
+
+
+# Column names of LabTestResults, read once from the table itself
+_lab_result_columns = None
+
+
+def lab_result_columns(cnxn):
+    global _lab_result_columns
+    if _lab_result_columns is None:
+        cursor = cnxn.cursor()
+        cursor.execute("SELECT * FROM LabTestResults LIMIT 0;")
+        _lab_result_columns = [desc[0] for desc in cursor.description]
+        cursor.close()
+    return _lab_result_columns
+
+
+def lab_result_column(columns, name):
+    # Unquoted identifiers are folded to lower case by PostgreSQL
+    by_lower = {column.lower(): column for column in columns}
+    try:
+        return by_lower[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown LabTestResults field: {name}")
+
+
+def encode_page_cursor(last_key):
+    return urlsafe_b64encode(json.dumps([last_key]).encode()).decode().rstrip("=")
+
+
+def decode_page_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return json.loads(urlsafe_b64decode(padded.encode()))[0]
+    except (ValueError, TypeError, IndexError):
+        raise ValueError("Invalid page cursor.")
+
+
+@metrics.timed("db")
+def fetch_lab_results_page(
+    cnxn,
+    limit,
+    cursor_token=None,
+    patient_id=None,
+    test_type=None,
+    date_from=None,
+    date_to=None,
+    fields=None,
+):
+    # Keyset pagination: WHERE key > last_key ORDER BY key LIMIT n, so every
+    # page is an index range scan no matter how deep the client has paged
+    columns = lab_result_columns(cnxn)
+    key = lab_result_column(columns, config.LAB_RESULTS_KEY_COLUMN)
+
+    if fields:
+        selected = [lab_result_column(columns, name) for name in fields]
+        # The key is needed to build the next cursor
+        if key not in selected:
+            selected.insert(0, key)
+    else:
+        selected = list(columns)
+
+    conditions = []
+    params = []
+    if cursor_token:
+        conditions.append(pgsql.SQL("{} > %s").format(pgsql.Identifier(key)))
+        params.append(decode_page_cursor(cursor_token))
+    if patient_id is not None:
+        column = lab_result_column(columns, config.LAB_RESULTS_PATIENT_COLUMN)
+        conditions.append(pgsql.SQL("{} = %s").format(pgsql.Identifier(column)))
+        params.append(patient_id)
+    if test_type is not None:
+        column = lab_result_column(columns, config.LAB_RESULTS_TEST_COLUMN)
+        conditions.append(pgsql.SQL("{} = %s").format(pgsql.Identifier(column)))
+        params.append(test_type)
+    if date_from is not None:
+        column = lab_result_column(columns, config.LAB_RESULTS_DATE_COLUMN)
+        conditions.append(pgsql.SQL("{} >= %s").format(pgsql.Identifier(column)))
+        params.append(date_from)
+    if date_to is not None:
+        # date_to is inclusive, also for timestamp columns
+        column = lab_result_column(columns, config.LAB_RESULTS_DATE_COLUMN)
+        conditions.append(pgsql.SQL("{} < %s").format(pgsql.Identifier(column)))
+        params.append(date_to + timedelta(days=1))
+
+    query = pgsql.SQL("SELECT {fields} FROM LabTestResults {where} ORDER BY {key} LIMIT %s").format(
+        fields=pgsql.SQL(", ").join([pgsql.Identifier(column) for column in selected]),
+        where=pgsql.SQL("WHERE ") + pgsql.SQL(" AND ").join(conditions) if conditions else pgsql.SQL(""),
+        key=pgsql.Identifier(key),
+    )
+    # Fetch one extra row to know whether there is a next page
+    params.append(limit + 1)
+
+    cursor = cnxn.cursor()
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_page_cursor(rows[-1][selected.index(key)])
+    return rows, selected, next_cursor
+
+
+@metrics.timed("db")
 def fetch_doctor_by_email(cnxn, email):
     cursor = cnxn.cursor()
     # Use %s as placeholder for PostgreSQL
@@ -0,0 +1,144 @@
+import math
+import threading
+import time
+import zlib
+
+import metrics
+
+# Sliding-window rate limiting for the auth routes. Each key keeps two
+# counters, the current fixed window and the previous one, and the rate is
+# estimated as previous * (share of it still inside the sliding window) +
+# current. That is O(1) memory per key and close to an exact sliding log.
+# Rejected attempts are not counted, so a client that backs off recovers.
+# Bulk routes charge one attempt per row rather than per request.
+
+REJECTED = metrics.Counter("rate_limited_total", "Requests rejected by the rate limiter.")
+
+
+class RateLimited(Exception):
+    # Callers should answer 429 with Retry-After
+    def __init__(self, retry_after):
+        super().__init__("Too many attempts, please retry later.")
+        self.retry_after = retry_after
+
+
+def _estimate(previous, current, elapsed, window):
+    return previous * (1 - elapsed / window) + current
+
+
+def _retry_after(previous, current, elapsed, window, limit, cost):
+    # Seconds until _estimate(...) + cost fits the limit again
+    room = limit - cost
+    if current <= room:
+        # Later in this window, once enough of the previous one has slid out
+        wait = window * (1 - (room - current) / previous) - elapsed if previous else 0
+    else:
+        # In the next window, where this window's count is the one sliding out
+        wait = window - elapsed + window * (1 - room / current)
+    return max(1, math.ceil(wait))
+
+
+class MemoryBackend:
+    """Per-process counters, split over shards so concurrent threads rarely
+    contend on the same lock."""
+
+    def __init__(self, shards=16, max_keys_per_shard=10000):
+        self.max_keys_per_shard = max_keys_per_shard
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+
+    def _shard(self, key):
+        return self._shards[zlib.crc32(key.encode("utf-8")) % len(self._shards)]
+
+    async def hit(self, key, limit, window, cost=1):
+        # Returns 0 if the attempt is allowed, else seconds until it would be
+        now = time.time()
+        start = now - now % window
+        lock, counters = self._shard(key)
+        with lock:
+            entry = counters.get(key)
+            if entry is None or entry[0] < start - window:
+                entry = [start, 0, 0]  # window start, previous count, current count
+            elif entry[0] < start:
+                entry = [start, entry[2], 0]
+            elapsed = now - start
+            if _estimate(entry[1], entry[2], elapsed, window) + cost > limit:
+                counters[key] = entry
+                return _retry_after(entry[1], entry[2], elapsed, window, limit, cost)
+            entry[2] += cost
+            counters[key] = entry
+            if len(counters) > self.max_keys_per_shard:
+                # Keys idle for two windows carry no information any more
+                for stale in [k for k, value in counters.items() if value[0] < start - window]:
+                    del counters[stale]
+        return 0
+
+    def stats(self):
+        keys = 0
+        for lock, counters in self._shards:
+            with lock:
+                keys += len(counters)
+        return {"backend_keys": keys, "shards": len(self._shards)}
+
+
+class RedisBackend:
+    """Counters shared by every worker through Redis (needs the redis package).
+
+    Not atomic across the read and the increment, so a burst racing on one
+    key can overshoot the limit by a few attempts; fine for throttling.
+    """
+
+    def __init__(self, url, prefix="ratelimit"):
+        import redis.asyncio
+
+        self.prefix = prefix
+        self._redis = redis.asyncio.from_url(url)
+
+    async def hit(self, key, limit, window, cost=1):
+        now = time.time()
+        index = int(now // window)
+        current_key = f"{self.prefix}:{key}:{index}"
+        previous_key = f"{self.prefix}:{key}:{index - 1}"
+        previous, current = await self._redis.mget(previous_key, current_key)
+        previous, current = int(previous or 0), int(current or 0)
+        elapsed = now - index * window
+        if _estimate(previous, current, elapsed, window) + cost > limit:
+            return _retry_after(previous, current, elapsed, window, limit, cost)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.incrby(current_key, cost)
+            pipe.expire(current_key, int(window * 2) + 1)
+            await pipe.execute()
+        return 0
+
+    def stats(self):
+        return {}
+
+
+def create_backend(spec):
+    # "memory" or a redis:// URL
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(spec)
+    return MemoryBackend()
+
+
+class RateLimiter:
+    """Named rules of (limit, window seconds), checked against one backend."""
+
+    def __init__(self, backend, rules):
+        self.backend = backend
+        self.rules = rules
+
+    def limit(self, rule):
+        return self.rules[rule][0]
+
+    async def check(self, rule, key, cost=1):
+        # `cost` charges one request as several attempts, e.g. one per bulk row
+        limit, window = self.rules[rule]
+        if cost > limit:
+            raise ValueError(f"A cost of {cost} can never fit the {rule} limit of {limit}")
+        retry_after = await self.backend.hit(f"{rule}:{key}", limit, window, cost)
+        if retry_after:
+            REJECTED.inc(rule=rule)
+            raise RateLimited(retry_after)
+
+    def stats(self):
+        return self.backend.stats()
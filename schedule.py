@@ -0,0 +1,178 @@
+import asyncio
+import time as clock
+from bisect import bisect_left, bisect_right
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time, timedelta
+
+import async_db
+import config
+
+# Per-doctor in-memory appointment index. A doctor's bookings never overlap,
+# so kept sorted by start time their ends are sorted too, and both the
+# double-booking check and each step of the free-slot search are a bisect.
+#
+# A doctor's schedule is loaded from the database the first time it is
+# needed and reloaded after APPOINTMENT_INDEX_TTL, to pick up bookings made
+# by other workers. The Appointments exclusion constraint stays the final
+# word (see sql/appointments.sql); a violation reloads the doctor.
+#
+# Memory stays bounded: a doctor's lock only exists while someone holds or
+# waits for it, expired schedules are swept out, and ids that are not in
+# Doctors are never cached.
+
+
+def doctor_key(doctor_id):
+    # Appointments.DoctorID is text: "007" must be the same doctor as "7", or
+    # the two would get separate locks and slip past the exclusion constraint
+    doctor_id = str(doctor_id)
+    if not (doctor_id.isascii() and doctor_id.isdigit()):
+        return None
+    return str(int(doctor_id))
+
+
+def span(day, start, minutes):
+    start = datetime.combine(day, start)
+    return start, start + timedelta(minutes=minutes)
+
+
+def interval(date_value, time_value, minutes):
+    # From the API's "YYYY-MM-DD" and "HH:MM" strings
+    return span(date.fromisoformat(date_value), time.fromisoformat(time_value), minutes)
+
+
+class DoctorSchedule:
+    def __init__(self, bookings=()):
+        # bookings: (start, end, appointment_id), non-overlapping
+        self._items = sorted(bookings)
+        self._starts = [item[0] for item in self._items]
+        self.loaded_at = clock.monotonic()
+
+    def __len__(self):
+        return len(self._items)
+
+    def conflict(self, start, end, ignore=None):
+        # The only booking that can overlap [start, end) is the last one
+        # starting before `end`: it has the latest end of all of them
+        position = bisect_left(self._starts, end) - 1
+        while position >= 0:
+            booked_start, booked_end, appointment_id = self._items[position]
+            if appointment_id == ignore:
+                position -= 1
+                continue
+            return appointment_id if booked_end > start else None
+        return None
+
+    def add(self, start, end, appointment_id):
+        position = bisect_right(self._starts, start)
+        self._starts.insert(position, start)
+        self._items.insert(position, (start, end, appointment_id))
+
+    def remove(self, start, appointment_id):
+        position = bisect_left(self._starts, start)
+        while position < len(self._items) and self._starts[position] == start:
+            if self._items[position][2] == appointment_id:
+                del self._starts[position]
+                del self._items[position]
+                return True
+            position += 1
+        return False
+
+    def free_slots(self, after, count, minutes, day_start, day_end, horizon):
+        # Next `count` free [start, start + minutes) slots on the slot grid
+        # within working hours. Each step jumps past a whole booking, so the
+        # cost is O((count + bookings skipped) * log n).
+        length = timedelta(minutes=minutes)
+        grid = timedelta(minutes=config.APPOINTMENT_MINUTES)
+        limit = after + horizon
+        slots = []
+        candidate = after
+        while len(slots) < count and candidate < limit:
+            opening = datetime.combine(candidate.date(), day_start)
+            closing = datetime.combine(candidate.date(), day_end)
+            if candidate < opening:
+                candidate = opening
+            # Align to the slot grid counted from the opening time
+            offset = (candidate - opening) % grid
+            if offset:
+                candidate += grid - offset
+            if candidate + length > closing:
+                candidate = opening + timedelta(days=1)
+                continue
+
+            position = bisect_right(self._starts, candidate)
+            if position and self._items[position - 1][1] > candidate:
+                candidate = self._items[position - 1][1]
+                continue
+            if position < len(self._items) and self._starts[position] < candidate + length:
+                candidate = self._items[position][1]
+                continue
+            slots.append(candidate)
+            candidate += length
+        return slots
+
+
+class ScheduleIndex:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._schedules = {}  # doctor id -> DoctorSchedule
+        self._locks = {}  # doctor id -> [asyncio.Lock, holders and waiters]
+        self._swept_at = clock.monotonic()
+        self._stats = {"loads": 0, "conflicts": 0, "db_conflicts": 0, "evictions": 0}
+
+    @asynccontextmanager
+    async def lock(self, doctor_id):
+        # Bookings for one doctor run one at a time; other doctors are unaffected
+        entry = self._locks.get(doctor_id)
+        if entry is None:
+            entry = self._locks[doctor_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[doctor_id]
+
+    async def get(self, db, doctor_id, reload=False):
+        # Call with the doctor's lock held; None if there is no such doctor
+        schedule = self._schedules.get(doctor_id)
+        if schedule is None and not await async_db.doctor_exists(db, doctor_id):
+            return None
+        if reload or schedule is None or clock.monotonic() - schedule.loaded_at > self.ttl:
+            self._sweep()
+            # Only bookings that are still running or ahead matter
+            since = datetime.now() - timedelta(days=1)
+            rows = await async_db.doctor_appointments(db, doctor_id, since.date())
+            schedule = self._schedules[doctor_id] = DoctorSchedule(
+                (*span(day, start, minutes), appointment_id)
+                for appointment_id, day, start, minutes in rows
+            )
+            self._stats["loads"] += 1
+        return schedule
+
+    def _sweep(self):
+        # Expired schedules would be reloaded anyway; drop them, at most once per ttl
+        now = clock.monotonic()
+        if now - self._swept_at < self.ttl:
+            return
+        self._swept_at = now
+        for doctor_id in [d for d, schedule in self._schedules.items() if now - schedule.loaded_at > self.ttl]:
+            del self._schedules[doctor_id]
+            self._stats["evictions"] += 1
+
+    def record_conflict(self, in_database=False):
+        self._stats["db_conflicts" if in_database else "conflicts"] += 1
+
+    def stats(self):
+        return {
+            **self._stats,
+            "doctors": len(self._schedules),
+            "bookings": sum(len(schedule) for schedule in self._schedules.values()),
+        }
+
+
+appointments = ScheduleIndex(config.APPOINTMENT_INDEX_TTL)
+DAY_START = time.fromisoformat(config.APPOINTMENT_DAY_START)
+DAY_END = time.fromisoformat(config.APPOINTMENT_DAY_END)
+HORIZON = timedelta(days=config.APPOINTMENT_HORIZON_DAYS)
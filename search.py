@@ -0,0 +1,306 @@
+import asyncio
+import re
+from array import array
+from bisect import bisect_left, insort
+
+import async_db
+import config
+
+# In-process typeahead index over patients, doctors and hospitals.
+#
+# Every searchable field is lowercased and split into alphanumeric tokens.
+# Each distinct token keeps posting lists of document numbers (compact
+# arrays of unsigned ints), one per field weight. A query term finds its
+# tokens as an exact hit, a prefix range of the sorted vocabulary, or,
+# through a trigram index over the vocabulary, a match inside a token.
+# Postings are read best score first and the scan stops once enough
+# records have matched, so a query touches at most max_candidates records
+# however large the tables are.
+#
+# Writes through this process are added at once. A periodic rebuild picks
+# up rows written by other workers and bulk imports, and compacts away
+# documents that were replaced.
+
+TOKEN = re.compile(r"[0-9a-z]+")
+MAX_TOKEN_LENGTH = 32  # longer tokens are cut, bounding the trigrams per token
+
+# Field weights (1 to 3, kept in two bits): a hit in a name outranks one in
+# an email or a code
+PATIENT_FIELDS = (("name", 3), ("email", 2), ("access_no", 2))
+DOCTOR_FIELDS = (("DoctorName", 3), ("Specialty", 2), ("Email", 2), ("AccessNumber", 2))
+HOSPITAL_FIELDS = (("HospitalName", 3), ("Type", 1), ("Email", 2))
+
+# How well one token matches one query term
+EXACT, PREFIX, INFIX = 3, 2, 1
+
+# (score, match, field weight), best first: the order postings are visited in
+GROUPS = sorted(
+    (
+        (match * weight, match, weight)
+        for match in (EXACT, PREFIX, INFIX)
+        for weight in {weight for fields in (PATIENT_FIELDS, DOCTOR_FIELDS, HOSPITAL_FIELDS) for _, weight in fields}
+    ),
+    reverse=True,
+)
+
+
+def tokens(value):
+    if value is None:
+        return ()
+    return tuple(token[:MAX_TOKEN_LENGTH] for token in TOKEN.findall(str(value).lower()))
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class Document:
+    __slots__ = ("kind", "id", "label", "email", "text", "weights")
+
+    def __init__(self, kind, id, label, email, tokens, weights):
+        self.kind = kind
+        self.id = id
+        self.label = label
+        self.email = email
+        # Flat, so a record costs two objects rather than one per field; the
+        # joined text also rejects most non-matches with one substring test
+        self.text = " ".join(tokens)
+        self.weights = weights  # bytes: field weight of each token
+
+    @property
+    def tokens(self):
+        return self.text.split(" ") if self.text else []
+
+    def score(self, term):
+        if term not in self.text:
+            return 0
+        best = 0
+        for token, weight in zip(self.tokens, self.weights):
+            if token == term:
+                match = EXACT
+            elif token.startswith(term):
+                match = PREFIX
+            elif term in token:
+                match = INFIX
+            else:
+                continue
+            best = max(best, weight * match)
+        return best
+
+
+def document(kind, id, record, fields, label_field, email_field):
+    all_tokens, weights = [], []
+    for name, weight in fields:
+        field_tokens = tokens(record.get(name))
+        all_tokens.extend(field_tokens)
+        weights.extend([weight] * len(field_tokens))
+    return Document(kind, id, record.get(label_field), record.get(email_field), tuple(all_tokens), bytes(weights))
+
+
+def patient_document(id, record):
+    return document("patient", id, record, PATIENT_FIELDS, "name", "email")
+
+
+def doctor_document(id, record):
+    return document("doctor", id, record, DOCTOR_FIELDS, "DoctorName", "Email")
+
+
+def hospital_document(id, record):
+    return document("hospital", id, record, HOSPITAL_FIELDS, "HospitalName", "Email")
+
+
+class Postings:
+    # The index proper; rebuilt on the side and swapped in whole
+    def __init__(self):
+        self.documents = []  # document number -> Document, None once replaced
+        self.numbers = {}  # (kind, id) -> document number
+        self.token_ids = {}  # token -> token id
+        self.tokens = []  # token id -> token
+        # token id << 2 | field weight -> document number, or an array of them
+        # once there are several (most tokens, e.g. emails, occur only once)
+        self.postings = {}
+        self.vocabulary = []  # every token, sorted, for prefix ranges
+        self.grams = {}  # trigram -> array of token ids, for matches inside a token
+        self.entries = 0
+
+    def _token_id(self, token, keep_sorted):
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = self.token_ids[token] = len(self.tokens)
+            self.tokens.append(token)
+            if keep_sorted:
+                insort(self.vocabulary, token)
+            for gram in trigrams(token):
+                posting = self.grams.get(gram)
+                if posting is None:
+                    posting = self.grams[gram] = array("I")
+                posting.append(token_id)
+        return token_id
+
+    def add(self, doc, keep_sorted=True):
+        old = self.numbers.get((doc.kind, doc.id))
+        if old is not None:
+            # Replaced; the stale postings are skipped until the next rebuild
+            self.documents[old] = None
+        number = len(self.documents)
+        self.documents.append(doc)
+        self.numbers[(doc.kind, doc.id)] = number
+        best = {}  # token id -> highest field weight it appears in
+        for token, weight in zip(doc.tokens, doc.weights):
+            token_id = self._token_id(token, keep_sorted)
+            if best.get(token_id, 0) < weight:
+                best[token_id] = weight
+        for token_id, weight in best.items():
+            key = token_id << 2 | weight
+            posting = self.postings.get(key)
+            if posting is None:
+                self.postings[key] = number
+            elif isinstance(posting, int):
+                self.postings[key] = array("I", (posting, number))
+            else:
+                posting.append(number)
+        self.entries += len(best)
+
+    def documents_for(self, token_id, weight):
+        posting = self.postings.get(token_id << 2 | weight, ())
+        return (posting,) if isinstance(posting, int) else posting
+
+    def finish(self):
+        # After bulk adds with keep_sorted=False
+        self.vocabulary = sorted(self.token_ids)
+
+    def matching_tokens(self, term, match):
+        # Token ids that match `term` as EXACT, PREFIX or INFIX
+        if match == EXACT:
+            token_id = self.token_ids.get(term)
+            if token_id is not None:
+                yield token_id
+        elif match == PREFIX:
+            position = bisect_left(self.vocabulary, term)
+            while position < len(self.vocabulary) and self.vocabulary[position].startswith(term):
+                if self.vocabulary[position] != term:
+                    yield self.token_ids[self.vocabulary[position]]
+                position += 1
+        elif len(term) >= 3:
+            lists = [self.grams.get(gram, ()) for gram in trigrams(term)]
+            for token_id in min(lists, key=len):
+                token = self.tokens[token_id]
+                if term in token and not token.startswith(term):
+                    yield token_id
+
+
+class SearchIndex:
+    def __init__(self, max_candidates=5000):
+        self.max_candidates = max_candidates
+        self.ready = False
+        self._postings = Postings()
+        self._pending = None  # documents added while a rebuild is running
+        self._stats = {"queries": 0, "truncated": 0, "rebuilds": 0}
+
+    def add(self, doc):
+        if doc.id is None:
+            return
+        self._postings.add(doc)
+        if self._pending is not None:
+            self._pending.append(doc)
+
+    def search(self, query, limit=10, kind=None):
+        self._stats["queries"] += 1
+        terms = sorted(set(tokens(query)), key=len, reverse=True)
+        if not terms:
+            return []
+        postings = self._postings
+        # The longest term drives the scan and the others only filter.
+        # Its postings are visited best score first (match x field weight),
+        # so the scan stops as soon as `limit` records have matched.
+        driver, others = terms[0], terms[1:]
+        found = {}  # document number -> (score, Document)
+        examined = 0
+        for score, match, weight in GROUPS:
+            for token_id in postings.matching_tokens(driver, match):
+                for number in postings.documents_for(token_id, weight):
+                    if number in found:
+                        continue
+                    examined += 1
+                    doc = postings.documents[number]
+                    if doc is None or (kind is not None and doc.kind != kind):
+                        continue
+                    total = score
+                    for term in others:
+                        other = doc.score(term)
+                        if not other:
+                            break
+                        total += other
+                    else:
+                        found[number] = (total, doc)
+                        # Several terms: look a little further for better totals
+                        if len(found) >= (limit if not others else 4 * limit):
+                            break
+                    if examined >= self.max_candidates:
+                        self._stats["truncated"] += 1
+                        break
+                if len(found) >= (limit if not others else 4 * limit) or examined >= self.max_candidates:
+                    break
+            if len(found) >= limit or examined >= self.max_candidates:
+                break
+
+        # Shorter labels first among equal scores: "Ann" before "Annabelle"
+        ranked = sorted(found.values(), key=lambda item: (-item[0], len(item[1].label or "")))
+        return [
+            {"kind": doc.kind, "id": doc.id, "label": doc.label, "email": doc.email, "score": score}
+            for score, doc in ranked[:limit]
+        ]
+
+    async def rebuild(self, load):
+        # `load` is an async iterator over Documents
+        self._pending = []
+        try:
+            postings = Postings()
+            async for doc in load():
+                if doc.id is not None:
+                    postings.add(doc, keep_sorted=False)
+                    if len(postings.documents) % 1000 == 0:
+                        # Let requests in; rows arrive in large prefetched chunks
+                        await asyncio.sleep(0)
+            for doc in self._pending:
+                postings.add(doc, keep_sorted=False)
+            postings.finish()
+        finally:
+            self._pending = None
+        self._postings = postings
+        self.ready = True
+        self._stats["rebuilds"] += 1
+
+    def stats(self):
+        postings = self._postings
+        return {
+            **self._stats,
+            "ready": self.ready,
+            "documents": len(postings.numbers),
+            "tokens": len(postings.token_ids),
+            "posting_entries": postings.entries,
+        }
+
+
+index = SearchIndex(config.SEARCH_MAX_CANDIDATES)
+
+
+async def keep_fresh(db, index, interval):
+    async def load():
+        async for row in async_db.iter_rows(db, "SELECT PatientID, name, email, access_no FROM PATIENTS"):
+            yield patient_document(row[0], dict(zip(("name", "email", "access_no"), row[1:])))
+        doctor_columns = ("DoctorName", "Specialty", "Email", "AccessNumber")
+        query = f"SELECT DoctorID, {', '.join(doctor_columns)} FROM Doctors"
+        async for row in async_db.iter_rows(db, query):
+            yield doctor_document(row[0], dict(zip(doctor_columns, row[1:])))
+        hospital_columns = ("HospitalName", "Type", "Email")
+        query = f"SELECT HospitalID, {', '.join(hospital_columns)} FROM Hospitals"
+        async for row in async_db.iter_rows(db, query):
+            yield hospital_document(row[0], dict(zip(hospital_columns, row[1:])))
+
+    while True:
+        try:
+            await index.rebuild(load)
+        except Exception as e:
+            print(f"Search index refresh failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import math
+
+import async_db
+import config
+
+# In-memory nearest-hospital index. Hospitals are bucketed into a grid of
+# cell_degrees x cell_degrees cells, one grid per hospital Type plus one for
+# all of them. A k-nearest query searches rings of cells outward from the
+# query point and stops as soon as nothing outside the searched rings can be
+# closer than the k-th hit, so it touches a handful of cells instead of
+# every hospital. New hospitals go in with one dict append; a periodic
+# rebuild picks up rows written by other workers and bulk loads.
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Grid:
+    def __init__(self, cell_degrees):
+        self.cell_degrees = cell_degrees
+        self._cells = {}  # (row, column) -> [hospital, ...]
+        self._bounds = None  # (min row, max row, min column, max column)
+        self.count = 0
+
+    def cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def add(self, hospital):
+        row, column = self.cell(hospital["Latitude"], hospital["Longitude"])
+        self._cells.setdefault((row, column), []).append(hospital)
+        if self._bounds is None:
+            self._bounds = (row, row, column, column)
+        else:
+            low_row, high_row, low_column, high_column = self._bounds
+            self._bounds = (min(low_row, row), max(high_row, row), min(low_column, column), max(high_column, column))
+        self.count += 1
+
+    def _ring(self, row, column, radius):
+        if radius == 0:
+            yield row, column
+            return
+        for c in range(column - radius, column + radius + 1):
+            yield row - radius, c
+            yield row + radius, c
+        for r in range(row - radius + 1, row + radius):
+            yield r, column - radius
+            yield r, column + radius
+
+    def _scan(self, lat, lon, k):
+        # Every hospital; cheaper than the ring search when there are few or
+        # they are spread far apart (a rare type, a small table)
+        distances = (
+            (haversine_km(lat, lon, hospital["Latitude"], hospital["Longitude"]), hospital["HospitalID"], hospital)
+            for hospitals in self._cells.values()
+            for hospital in hospitals
+        )
+        return [(distance, hospital) for distance, _, hospital in heapq.nsmallest(k, distances)]
+
+    def nearest(self, lat, lon, k):
+        if not self.count:
+            return []
+        if self.count <= k:
+            return self._scan(lat, lon, k)
+        row, column = self.cell(lat, lon)
+        low_row, high_row, low_column, high_column = self._bounds
+        max_radius = max(row - low_row, high_row - row, column - low_column, high_column - column)
+        heap = []  # max-heap of the best k: (-distance, id, hospital)
+        cells = 0
+        for radius in range(max_radius + 1):
+            # Ring `radius` has 8 * radius cells; past as many cells as there
+            # are hospitals, looking at every hospital is the cheaper way
+            cells += max(1, 8 * radius)
+            if cells > self.count:
+                return self._scan(lat, lon, k)
+            for key in self._ring(row, column, radius):
+                for hospital in self._cells.get(key, ()):
+                    distance = haversine_km(lat, lon, hospital["Latitude"], hospital["Longitude"])
+                    item = (-distance, hospital["HospitalID"], hospital)
+                    if len(heap) < k:
+                        heapq.heappush(heap, item)
+                    elif distance < -heap[0][0]:
+                        heapq.heapreplace(heap, item)
+            # Everything within `radius` cells of the query cell is searched.
+            # East-west cells shrink towards the poles, so measure the
+            # narrowest one in the searched square.
+            furthest_lat = min(89.9, abs(lat) + (radius + 1) * self.cell_degrees)
+            cell_km = self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(furthest_lat))
+            if len(heap) == k and -heap[0][0] <= radius * cell_km:
+                break
+        return [(-distance, hospital) for distance, _, hospital in sorted(heap, reverse=True)]
+
+
+class HospitalIndex:
+    def __init__(self, cell_degrees=0.25):
+        self.cell_degrees = cell_degrees
+        self.ready = False
+        self._all = Grid(cell_degrees)
+        self._by_type = {}
+        self._pending = None  # hospitals added while a rebuild is running
+        self._stats = {"queries": 0, "rebuilds": 0}
+
+    def add(self, hospital):
+        # hospital: dict with HospitalID, HospitalName, Type, Latitude, Longitude, EmergencyLine
+        if hospital.get("Latitude") is None or hospital.get("Longitude") is None:
+            return
+        self._insert(self._all, self._by_type, hospital)
+        if self._pending is not None:
+            self._pending.append(hospital)
+
+    def _insert(self, grid, by_type, hospital):
+        grid.add(hospital)
+        kind = (hospital.get("Type") or "").lower()
+        if kind not in by_type:
+            by_type[kind] = Grid(self.cell_degrees)
+        by_type[kind].add(hospital)
+
+    def nearest(self, lat, lon, k=3, kind=None):
+        self._stats["queries"] += 1
+        grid = self._all if kind is None else self._by_type.get(kind.lower())
+        if grid is None:
+            return []
+        return grid.nearest(lat, lon, k)
+
+    async def rebuild(self, load):
+        # `load` is an async iterator over hospital dicts; the grids are
+        # swapped in at the end so queries never see a half-built index
+        self._pending = []
+        try:
+            grid, by_type, seen = Grid(self.cell_degrees), {}, set()
+            async for hospital in load():
+                self._insert(grid, by_type, hospital)
+                seen.add(hospital["HospitalID"])
+            for hospital in self._pending:
+                if hospital["HospitalID"] not in seen:
+                    self._insert(grid, by_type, hospital)
+        finally:
+            self._pending = None
+        self._all, self._by_type = grid, by_type
+        self.ready = True
+        self._stats["rebuilds"] += 1
+
+    def stats(self):
+        return {**self._stats, "ready": self.ready, "hospitals": self._all.count, "types": len(self._by_type)}
+
+
+hospitals = HospitalIndex(config.HOSPITAL_GRID_DEGREES)
+
+
+def hospital_record(hospital_id, name, kind, latitude, longitude, emergency_line):
+    return {
+        "HospitalID": hospital_id,
+        "HospitalName": name,
+        "Type": kind,
+        "Latitude": latitude,
+        "Longitude": longitude,
+        "EmergencyLine": emergency_line,
+    }
+
+
+async def keep_fresh(db, index, interval):
+    async def load():
+        query = (
+            "SELECT HospitalID, HospitalName, Type, Latitude, Longitude, EmergencyLine "
+            "FROM Hospitals WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL"
+        )
+        async for row in async_db.iter_rows(db, query):
+            yield hospital_record(*row)
+
+    while True:
+        try:
+            await index.rebuild(load)
+        except Exception as e:
+            print(f"Hospital index refresh failed: {e}")
+        await asyncio.sleep(interval)
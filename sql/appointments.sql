@@ -0,0 +1,32 @@
+-- Appointments, as written by POST /appointments. The exclusion constraint is
+-- the final guard against double-booking: the in-process schedule index
+-- (schedule.py) only sees bookings made by its own worker between refreshes.
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE TABLE IF NOT EXISTS Appointments (
+    AppointmentID bigserial PRIMARY KEY,
+    PatientID text NOT NULL,
+    DoctorID text NOT NULL,
+    Date date NOT NULL,
+    Time time NOT NULL,
+    Duration integer NOT NULL DEFAULT 30 CHECK (Duration > 0),
+    Purpose text,
+    Status text NOT NULL,
+    Payment_mode text,
+    Meeting_type text,
+    Notes text,
+    CONSTRAINT appointments_no_overlap EXCLUDE USING gist (
+        DoctorID WITH =,
+        tsrange(Date + Time, Date + Time + Duration * interval '1 minute') WITH &&
+    ) WHERE (lower(Status) <> 'cancelled')
+);
+
+CREATE INDEX IF NOT EXISTS appointments_doctor_idx ON Appointments (DoctorID, Date);
+
+-- DoctorID holds Doctors.DoctorID as canonical text ("7", never "007"), so the
+-- exclusion constraint above sees every booking of a doctor as equal. NOT
+-- VALID keeps this runnable on an existing table; new and updated rows are checked.
+ALTER TABLE Appointments DROP CONSTRAINT IF EXISTS appointments_doctor_canonical;
+ALTER TABLE Appointments ADD CONSTRAINT appointments_doctor_canonical
+    CHECK (DoctorID ~ '^(0|[1-9][0-9]*)$') NOT VALID;
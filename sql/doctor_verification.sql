@@ -0,0 +1,9 @@
+-- Verified doctors get staff access (search, bulk registration, lab results
+-- and analytics). Self-registration through /doctors/new never sets it; an
+-- administrator does, once the license has been checked:
+--
+--   UPDATE Doctors SET Verified = true WHERE Email = '...';
+--
+-- Tokens issued before the change keep their old access until they expire.
+
+ALTER TABLE Doctors ADD COLUMN IF NOT EXISTS Verified boolean NOT NULL DEFAULT false;
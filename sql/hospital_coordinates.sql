@@ -0,0 +1,6 @@
+-- Hospital coordinates for nearest-hospital dispatch (spatial.py). Rows
+-- without coordinates are simply left out of the index.
+
+ALTER TABLE Hospitals
+    ADD COLUMN IF NOT EXISTS Latitude double precision CHECK (Latitude BETWEEN -90 AND 90),
+    ADD COLUMN IF NOT EXISTS Longitude double precision CHECK (Longitude BETWEEN -180 AND 180);
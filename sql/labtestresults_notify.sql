@@ -0,0 +1,15 @@
+-- Notifies listeners whenever LabTestResults changes, so the in-process
+-- response caches (cache.py) are invalidated immediately instead of waiting
+-- for their TTL. Statement-level, so a bulk load sends a single notification.
+
+CREATE OR REPLACE FUNCTION notify_labtestresults_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('labtestresults_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS labtestresults_changed ON LabTestResults;
+CREATE TRIGGER labtestresults_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON LabTestResults
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_labtestresults_changed();
@@ -0,0 +1,78 @@
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+# Cold-start accounting. main imports this module first, so the clock starts
+# before any heavy import; main then records named phases (imports, pool
+# warm-up, ...) that are served on /startup.
+#
+# `python startup.py` prints the per-package import cost of `import main`
+# using the interpreter's -X importtime output.
+
+_started = time.perf_counter()
+_last_mark = _started
+_phases = []
+ready = False
+
+
+def mark(name):
+    # Records the time since the previous mark under `name`
+    global _last_mark
+    now = time.perf_counter()
+    _phases.append({"phase": name, "seconds": round(now - _last_mark, 6)})
+    _last_mark = now
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append({"phase": name, "seconds": round(time.perf_counter() - started, 6)})
+
+
+def set_ready():
+    global ready
+    ready = True
+    mark("ready")
+
+
+def report():
+    return {
+        "ready": ready,
+        "seconds_since_import": round(time.perf_counter() - _started, 6),
+        "phases": list(_phases),
+    }
+
+
+def import_costs(module="main"):
+    # Cumulative import time per top-level package, in seconds
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    costs = {}
+    pattern = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+    for line in result.stderr.splitlines():
+        match = pattern.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # Only the outermost imports; nested ones are already in their parent
+        if indent == 1:
+            package = name.split(".")[0]
+            costs[package] = costs.get(package, 0) + cumulative / 1e6
+    return dict(sorted(costs.items(), key=lambda item: item[1], reverse=True))
+
+
+if __name__ == "__main__":
+    module = sys.argv[1] if len(sys.argv) > 1 else "main"
+    costs = import_costs(module)
+    total = sum(costs.values())
+    for package, seconds in costs.items():
+        print(f"{package:<30} {seconds * 1000:9.1f} ms")
+    print(f"{'total':<30} {total * 1000:9.1f} ms")
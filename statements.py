@@ -0,0 +1,71 @@
+from operator import attrgetter
+
+import psycopg2.extensions
+
+# INSERT statements derived once from the Pydantic models' field
+# definitions. Each statement is PREPAREd at most once per psycopg2
+# connection; asyncpg already keeps prepared statements per connection, so
+# handing it the same SQL text every time is enough there.
+
+_registry = {}
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    # psycopg2 connection that remembers which statements it has prepared
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+class InsertStatement:
+    def __init__(self, model, table, converters=None, returning=None):
+        self.model = model
+        self.table = table
+        self.columns = tuple(model.model_fields)
+        self.name = f"insert_{table.lower()}"
+
+        # attrgetter with several names returns a tuple in one C call
+        getter = attrgetter(*self.columns)
+        self._get = getter if len(self.columns) > 1 else lambda instance: (getter(instance),)
+        converters = converters or {}
+        self._converters = [
+            (position, converters[column])
+            for position, column in enumerate(self.columns)
+            if column in converters
+        ]
+
+        placeholders = ", ".join(f"${i}" for i in range(1, len(self.columns) + 1))
+        self.sql = f"INSERT INTO {table} ({', '.join(self.columns)}) VALUES ({placeholders})"
+        if returning:
+            self.sql += f" RETURNING {returning}"
+        self.prepare_sql = f"PREPARE {self.name} AS {self.sql}"
+        self.execute_sql = f"EXECUTE {self.name} ({', '.join(['%s'] * len(self.columns))})"
+
+    def params(self, instance):
+        values = self._get(instance)
+        if self._converters:
+            values = list(values)
+            for position, convert in self._converters:
+                values[position] = convert(values[position])
+            values = tuple(values)
+        return values
+
+    def execute(self, cursor, instance):
+        # Runs the insert on a psycopg2 cursor through a server-side prepared statement
+        prepared = getattr(cursor.connection, "prepared_statements", None)
+        if prepared is None:
+            raise TypeError("Connection was not created with statements.PreparedConnection")
+        if self.name not in prepared:
+            cursor.execute(self.prepare_sql)
+            prepared.add(self.name)
+        cursor.execute(self.execute_sql, self.params(instance))
+
+
+def register(model, table, converters=None, returning=None):
+    statement = InsertStatement(model, table, converters=converters, returning=returning)
+    _registry[model] = statement
+    return statement
+
+
+def for_model(model):
+    return _registry[model]
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tokens  # noqa: E402
+
+BULK_ROUTES = ("/patients/bulk", "/hospitals/bulk", "/doctors/bulk")
+
+
+def test_bulk_routes_need_verified_staff():
+    # Needs the app's own dependencies; the lifespan (and so the database) is not started
+    for module in ("fastapi", "httpx", "asyncpg", "psycopg2", "argon2", "pydantic"):
+        pytest.importorskip(module)
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    # What anyone gets by signing up at /patients/new or /doctors/new
+    for role in ("patient", "doctor"):
+        token = tokens.issue(f"{role}@example.com", role)["access_token"]
+        for path in BULK_ROUTES:
+            response = client.post(path, json=[], headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 403
+    for path in BULK_ROUTES:
+        assert client.post(path, json=[]).status_code == 401
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("asyncpg")
+
+import cache  # noqa: E402
+
+
+def test_hit_after_put():
+    responses = cache.ResponseCache()
+    responses.put("key", b"body", responses.version)
+    assert responses.get("key") == b"body"
+    assert responses.stats()["hits"] == 1
+
+
+def test_invalidate_drops_everything():
+    responses = cache.ResponseCache()
+    responses.put("key", b"body", responses.version)
+    responses.invalidate()
+    assert responses.get("key") is None
+    assert responses.stats()["entries"] == 0
+
+
+def test_body_built_from_old_data_is_not_cached():
+    responses = cache.ResponseCache()
+    version = responses.version
+    responses.invalidate()  # a change arrives while the body is being built
+    responses.put("key", b"stale", version)
+    assert responses.get("key") is None
+
+
+def test_evicts_least_recently_used_by_bytes():
+    responses = cache.ResponseCache(max_bytes=10)
+    responses.put("a", b"aaaa", 0)
+    responses.put("b", b"bbbb", 0)
+    responses.get("a")
+    responses.put("c", b"cccc", 0)
+    assert responses.get("b") is None
+    assert responses.get("a") == b"aaaa"
+    assert responses.stats()["bytes"] <= 10
+
+
+def test_expires_after_ttl():
+    responses = cache.ResponseCache(ttl=0.01)
+    responses.put("key", b"body", 0)
+    time.sleep(0.02)
+    assert responses.get("key") is None
+
+
+def test_concurrent_misses_load_once():
+    responses = cache.ResponseCache()
+    loads = []
+
+    def load():
+        loads.append(1)
+        time.sleep(0.05)
+        return b"body"
+
+    results = []
+    def fetch():
+        results.append(responses.get_or_load("key", load))
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [b"body"] * 4
+    assert len(loads) == 1
+    stats = responses.stats()
+    # Each caller counts once: one hit or one miss
+    assert stats["hits"] + stats["misses"] == 4
+
+
+class FakeListenConnection:
+    def __init__(self):
+        self.listeners = {}
+        self.terminated = False
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    async def execute(self, query):
+        pass
+
+    def terminate(self):
+        self.terminated = True
+
+
+def test_notify_invalidates_the_cache(monkeypatch):
+    responses = cache.ResponseCache()
+    conn = FakeListenConnection()
+    received = []
+
+    async def connect(**kwargs):
+        return conn
+
+    monkeypatch.setattr(cache.asyncpg, "connect", connect)
+
+    async def scenario():
+        task = asyncio.create_task(
+            cache.listen_for_changes(
+                responses, "labtestresults_changed", retry=0.01, listeners=[("presence", received.append)]
+            )
+        )
+        while "presence" not in conn.listeners:
+            await asyncio.sleep(0.001)
+        responses.put("key", b"body", responses.version)
+
+        # What asyncpg calls on a NOTIFY: (connection, pid, channel, payload)
+        conn.listeners["labtestresults_changed"](conn, 1, "labtestresults_changed", "INSERT")
+        assert responses.get("key") is None
+        conn.listeners["presence"](conn, 1, "presence", "payload")
+        assert received == ["payload"]
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert conn.terminated
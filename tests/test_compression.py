@@ -0,0 +1,75 @@
+import asyncio
+import gzip
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression  # noqa: E402
+
+
+def respond(content_type, chunks, accept="gzip", minimum_size=100):
+    # Runs one request through the middleware; returns (headers, body) as sent
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        for position, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": position < len(chunks) - 1})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept.encode())]}
+    asyncio.run(compression.CompressionMiddleware(app, minimum_size=minimum_size)(scope, None, send))
+    headers = dict(sent[0]["headers"])
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return headers, body
+
+
+def decoded(headers, body):
+    if headers.get(b"content-encoding") == b"gzip":
+        return gzip.decompress(body)
+    return body
+
+
+def test_negotiate_prefers_the_highest_quality_offered():
+    assert compression.negotiate(None) is None
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("gzip;q=0") is None
+    assert compression.negotiate("gzip, deflate") == "gzip"
+    assert compression.negotiate("*") == compression.available()[0]
+
+
+def test_small_bodies_are_sent_as_they_are():
+    headers, body = respond(b"application/json", [b"[1,2,3]"])
+    assert b"content-encoding" not in headers
+    assert body == b"[1,2,3]"
+
+
+def test_bodies_over_the_threshold_are_compressed():
+    payload = b"[" + b",".join(b"1" for _ in range(500)) + b"]"
+    headers, body = respond(b"application/json", [payload])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert int(headers[b"content-length"]) == len(body) < len(payload)
+    assert decoded(headers, body) == payload
+
+
+def test_streamed_bodies_are_compressed_chunk_by_chunk():
+    chunks = [b"[", b",".join(b"1" for _ in range(200)), b"]"]
+    headers, body = respond(b"application/json", chunks)
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    assert decoded(headers, body) == b"".join(chunks)
+
+
+def test_event_streams_are_never_compressed():
+    event = b"event: presence\ndata: " + b"x" * 1000 + b"\n\n"
+    headers, body = respond(b"text/event-stream; charset=utf-8", [event, event])
+    assert b"content-encoding" not in headers
+    assert body == event + event
+
+
+def test_binary_types_are_left_alone():
+    headers, body = respond(b"application/vnd.apache.parquet", [b"PAR1" * 100])
+    assert b"content-encoding" not in headers
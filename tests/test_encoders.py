@@ -0,0 +1,102 @@
+import datetime
+import decimal
+import json
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import encoders  # noqa: E402
+
+COLUMNS = ["id", "taken", "day", "value", "count", "ratio", "missing", "ref", "wait"]
+ROWS = [
+    (
+        1,
+        datetime.datetime(2024, 3, 1, 8, 30, 15, 250000),
+        datetime.date(2024, 3, 1),
+        decimal.Decimal("5.25"),
+        decimal.Decimal("12"),
+        float("nan"),
+        None,
+        uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        datetime.timedelta(minutes=1, seconds=30),
+    ),
+    (2, None, None, decimal.Decimal("NaN"), None, float("inf"), None, None, None),
+]
+
+# What the endpoints answered before orjson: FastAPI's jsonable_encoder over
+# the row dicts, with NaN and infinities replaced by None
+EXPECTED = [
+    {
+        "id": 1,
+        "taken": "2024-03-01T08:30:15.250000",
+        "day": "2024-03-01",
+        "value": 5.25,
+        "count": 12,
+        "ratio": None,
+        "missing": None,
+        "ref": "12345678-1234-5678-1234-567812345678",
+        "wait": 90.0,
+    },
+    {
+        "id": 2,
+        "taken": None,
+        "day": None,
+        "value": None,
+        "count": None,
+        "ratio": None,
+        "missing": None,
+        "ref": None,
+        "wait": None,
+    },
+]
+
+
+def test_rows_encode_like_the_old_endpoints():
+    assert json.loads(encoders.dumps_rows(COLUMNS, ROWS)) == EXPECTED
+
+
+def test_integral_decimals_stay_integers():
+    assert encoders.dumps([decimal.Decimal("12"), decimal.Decimal("1E+2")]) == b"[12,100]"
+
+
+def test_json_array_stream_joins_to_one_document():
+    batches = [(COLUMNS, ROWS[:1]), (COLUMNS, []), (COLUMNS, ROWS[1:])]
+    body = b"".join(encoders.iter_json_array(batches))
+    assert json.loads(body) == EXPECTED
+    assert b"".join(encoders.iter_json_array([])) == b"[]"
+
+
+def test_ndjson_is_one_row_per_line():
+    body = b"".join(encoders.iter_ndjson([(COLUMNS, ROWS[:1]), (COLUMNS, ROWS[1:])]))
+    lines = body.decode().splitlines()
+    assert [json.loads(line) for line in lines] == EXPECTED
+    assert body.endswith(b"\n")
+
+
+def test_unknown_types_are_rejected():
+    with pytest.raises(TypeError):
+        encoders.dumps({"value": object()})
+
+
+def test_matches_pandas_records():
+    # The old /patient_data path: DataFrame records with NaN/NaT/inf as None
+    pd = pytest.importorskip("pandas")
+    np = pytest.importorskip("numpy")
+    df = pd.DataFrame(
+        {
+            "value": [1.5, np.nan, np.inf],
+            "taken": [pd.Timestamp("2024-03-01 08:30"), pd.NaT, pd.Timestamp("2024-03-02")],
+            "count": np.array([1, 2, 3], dtype=np.int64),
+        }
+    )
+    old = df.replace([np.inf, -np.inf], None)
+    old = old.astype(object).where(pd.notnull(old), None)
+    expected = [
+        {key: value.isoformat() if isinstance(value, pd.Timestamp) else value for key, value in record.items()}
+        for record in old.to_dict(orient="records")
+    ]
+    assert json.loads(encoders.dumps(df.to_dict(orient="records"))) == expected
@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+psycopg2 = pytest.importorskip("psycopg2")
+for module in ("pyarrow", "argon2", "pydantic"):  # export imports py_functions
+    pytest.importorskip(module)
+
+import export  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, cnxn):
+        self._cnxn = cnxn
+
+    def copy_expert(self, query, file):
+        # Like the server: keeps writing until the query is cancelled
+        while not self._cnxn.cancelled.is_set():
+            file.write(b"x" * 65536)
+        raise psycopg2.extensions.QueryCanceledError("canceling statement due to user request")
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cancel_error=None):
+        self.cancelled = threading.Event()
+        self._cancel_error = cancel_error
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def cancel(self):
+        if self._cancel_error is not None:
+            raise self._cancel_error
+        self.cancelled.set()
+
+
+def test_close_stops_an_unread_copy():
+    cnxn = FakeConnection()
+    pipe = export._CopyPipe(cnxn, "COPY ...")
+    assert pipe.reader.read(1024)
+    pipe.close()
+    assert cnxn.cancelled.is_set()
+    assert not pipe._thread.is_alive()
+
+
+def test_close_joins_even_when_cancel_fails():
+    # The writer is blocked on a full pipe; closing the reader unblocks it
+    cnxn = FakeConnection(cancel_error=psycopg2.OperationalError("connection lost"))
+    pipe = export._CopyPipe(cnxn, "COPY ...")
+    assert pipe.reader.read(1024)
+    pipe.close()
+    assert not pipe._thread.is_alive()
+    assert isinstance(pipe.error, OSError)
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# membership imports async_db, which needs the app's database and model dependencies
+for module in ("asyncpg", "psycopg2", "argon2", "pydantic", "email_validator"):
+    pytest.importorskip(module)
+
+import membership  # noqa: E402
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def rows(keys):
+    async def load():
+        for key in keys:
+            yield key
+
+    return load
+
+
+class Database:
+    # Counts the existence queries that get through to "the database"
+    def __init__(self, registered):
+        self.registered = set(registered)
+        self.queries = 0
+
+    def query(self, *keys):
+        async def ask():
+            self.queries += 1
+            return any(key in self.registered for key in keys)
+
+        return ask
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = membership.BloomFilter(1000)
+    keys = [membership.email_key(f"user{i}@example.com") for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+
+def test_bloom_filter_false_positive_rate_is_near_target():
+    bloom = membership.BloomFilter(1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"in{i}")
+    hits = sum(f"out{i}" in bloom for i in range(10000))
+    assert hits < 300  # 1% target, with plenty of slack
+
+
+def test_not_ready_always_asks_the_database():
+    index = membership.MembershipIndex("test")
+    db = Database(["email:a@example.com"])
+    assert run(index.exists(["email:a@example.com"], db.query("email:a@example.com"))) is True
+    assert run(index.exists(["email:b@example.com"], db.query("email:b@example.com"))) is False
+    assert db.queries == 2
+
+
+def test_definitely_new_keys_skip_the_database():
+    index = membership.MembershipIndex("test", min_capacity=100)
+    registered = [membership.email_key(f"user{i}@example.com") for i in range(50)]
+    run(index.rebuild(rows(registered)))
+    db = Database(registered)
+
+    # Registered keys are always "maybe" and fall back to the database
+    assert run(index.exists([registered[0]], db.query(registered[0]))) is True
+    assert db.queries == 1
+
+    new = [membership.email_key(f"new{i}@example.com") for i in range(200)]
+    results = [run(index.exists([key], db.query(key))) for key in new]
+    assert not any(results)
+    # Only Bloom false positives reach the database
+    assert db.queries - 1 < 20
+    assert index.stats()["skipped"] >= 180
+
+
+def test_local_inserts_are_known_without_a_query():
+    index = membership.MembershipIndex("test")
+    run(index.rebuild(rows([])))
+    index.add(*membership.patient_keys("new@example.com", "R1"))
+    db = Database([])
+    assert run(index.exists([membership.referral_key("R1")], db.query())) is True
+    assert db.queries == 0
+
+
+def test_keys_added_during_a_rebuild_survive_it():
+    index = membership.MembershipIndex("test")
+
+    def load():
+        async def keys():
+            index.add("email:during@example.com")
+            yield "email:before@example.com"
+
+        return keys()
+
+    run(index.rebuild(load))
+    assert index.lookup("email:during@example.com") is True
+    assert index.lookup("email:before@example.com") is None
+
+
+def test_patient_keys_skip_an_empty_referral():
+    assert membership.patient_keys("a@example.com", None) == ("email:a@example.com", None)
+    index = membership.MembershipIndex("test")
+    run(index.rebuild(rows([])))
+    assert index.lookup(*membership.patient_keys("a@example.com", None)) is False
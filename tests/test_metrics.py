@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+REQUESTS = metrics.Counter("test_requests_total", "Requests seen by the test workers.")
+LATENCY = metrics.Histogram("test_latency_seconds", "Latency seen by the test workers.", buckets=(0.1, 1.0))
+BUSY = metrics.Gauge("test_busy", "Busy test workers.")
+
+
+def fork_worker(amount):
+    # A worker that counts, snapshots and exits, like a gunicorn worker being recycled
+    pid = os.fork()
+    if pid == 0:
+        REQUESTS.inc(amount, route="/")
+        LATENCY.observe(0.5, route="/")
+        BUSY.set(1)
+        metrics.write_snapshot()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+
+def sample(text, prefix):
+    return sorted(line for line in text.splitlines() if line.startswith(prefix))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_scrape_adds_up_every_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "_directory", None)
+    metrics.enable_multiprocess(str(tmp_path))
+    first = fork_worker(3)
+    second = fork_worker(4)
+
+    text = metrics.render()
+    assert sample(text, "test_requests_total") == ['test_requests_total{route="/"} 7']
+    assert sample(text, "test_latency_seconds_count") == ['test_latency_seconds_count{route="/"} 2']
+    # Gauges stay per worker
+    assert len(sample(text, "test_busy{")) == 2
+
+    # An exited worker's counts stay in the totals; its gauges go
+    metrics.mark_process_dead(first)
+    text = metrics.render()
+    assert sample(text, "test_requests_total") == ['test_requests_total{route="/"} 7']
+    assert sample(text, "test_latency_seconds_count") == ['test_latency_seconds_count{route="/"} 2']
+    assert [line for line in sample(text, "test_busy{") if f'worker="{second}-' in line]
+    assert not [line for line in sample(text, "test_busy{") if f'worker="{first}-' in line]
+
+
+def test_single_process_render_is_unchanged(monkeypatch):
+    monkeypatch.setattr(metrics, "_directory", None)
+    REQUESTS.inc(route="/single")
+    assert 'test_requests_total{route="/single"} 1' in metrics.render()
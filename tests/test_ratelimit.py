@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ratelimit  # noqa: E402
+
+WINDOW = 60
+LIMIT = 10
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(100 * WINDOW)  # on a window boundary
+    monkeypatch.setattr(ratelimit.time, "time", clock)
+    return clock
+
+
+def hit(backend, key="login:1.2.3.4", cost=1):
+    return asyncio.run(backend.hit(key, LIMIT, WINDOW, cost))
+
+
+def test_limit_within_one_window(clock):
+    backend = ratelimit.MemoryBackend()
+    assert [hit(backend) for _ in range(LIMIT)] == [0] * LIMIT
+    assert hit(backend) > 0
+    # Other keys are counted separately
+    assert hit(backend, key="login:5.6.7.8") == 0
+
+
+def test_previous_window_slides_out_gradually(clock):
+    backend = ratelimit.MemoryBackend()
+    for _ in range(LIMIT):
+        hit(backend)
+    # Right after the boundary the previous window still counts in full
+    clock.now += WINDOW
+    assert hit(backend) > 0
+    # Halfway through, half of it has slid out
+    clock.now += WINDOW // 2
+    assert [hit(backend) for _ in range(LIMIT // 2)] == [0] * (LIMIT // 2)
+    assert hit(backend) > 0
+
+
+def test_idle_for_two_windows_starts_over(clock):
+    backend = ratelimit.MemoryBackend()
+    for _ in range(LIMIT):
+        hit(backend)
+    clock.now += 2 * WINDOW
+    assert [hit(backend) for _ in range(LIMIT)] == [0] * LIMIT
+
+
+def test_retry_after_is_exact(clock):
+    # Waiting out Retry-After is enough, and a second less is not
+    for start, burst in ((0, LIMIT), (WINDOW // 3, LIMIT), (WINDOW - 1, LIMIT // 2)):
+        backend = ratelimit.MemoryBackend()
+        clock.now = 100 * WINDOW + start
+        for _ in range(burst):
+            hit(backend)
+        while not hit(backend):
+            pass
+        retry_after = hit(backend)
+        attempted_at = clock.now
+        clock.now = attempted_at + retry_after - 1
+        assert hit(backend) > 0
+        clock.now = attempted_at + retry_after
+        assert hit(backend) == 0
+
+
+def test_rejected_attempts_are_not_counted(clock):
+    backend = ratelimit.MemoryBackend()
+    for _ in range(LIMIT):
+        hit(backend)
+    for _ in range(50):
+        hit(backend)
+    clock.now += 2 * WINDOW - 1
+    # Only the LIMIT allowed attempts are left to slide out
+    assert hit(backend) == 0
+
+
+def test_cost_charges_several_attempts(clock):
+    backend = ratelimit.MemoryBackend()
+    assert hit(backend, cost=LIMIT - 2) == 0
+    assert hit(backend, cost=3) > 0
+    assert hit(backend, cost=2) == 0
+
+
+def test_limiter_raises_rate_limited(clock):
+    limiter = ratelimit.RateLimiter(ratelimit.MemoryBackend(), {"login": (2, WINDOW)})
+
+    async def attempts():
+        await limiter.check("login", "a@example.com")
+        await limiter.check("login", "a@example.com")
+        with pytest.raises(ratelimit.RateLimited) as rejected:
+            await limiter.check("login", "a@example.com")
+        assert rejected.value.retry_after >= 1
+        with pytest.raises(ValueError):
+            await limiter.check("login", "b@example.com", cost=3)
+
+    asyncio.run(attempts())
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import random
+import sys
+from datetime import datetime, time, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# schedule imports async_db, which needs the app's database and model dependencies
+for module in ("asyncpg", "psycopg2", "argon2", "pydantic", "email_validator"):
+    pytest.importorskip(module)
+
+import config  # noqa: E402
+import schedule  # noqa: E402
+
+MONDAY = datetime(2030, 1, 7)
+DAY_START = time(8, 0)
+DAY_END = time(17, 0)
+GRID = timedelta(minutes=config.APPOINTMENT_MINUTES)
+
+
+def at(hour, minute=0, days=0):
+    return MONDAY + timedelta(days=days, hours=hour, minutes=minute)
+
+
+def random_bookings(rng, count):
+    # Non-overlapping bookings over a few days, off the slot grid as well as on it
+    bookings, cursor = [], at(7)
+    for appointment_id in range(count):
+        cursor += timedelta(minutes=rng.choice([0, 5, 15, 30, 45, 90, 600]))
+        end = cursor + timedelta(minutes=rng.choice([10, 15, 30, 60]))
+        bookings.append((cursor, end, appointment_id))
+        cursor = end
+    return bookings
+
+
+def brute_conflict(bookings, start, end, ignore=None):
+    hits = [b[2] for b in bookings if b[2] != ignore and b[0] < end and start < b[1]]
+    return hits[0] if hits else None
+
+
+def brute_free_slots(bookings, after, count, minutes, horizon):
+    length = timedelta(minutes=minutes)
+    slots, day = [], after.replace(hour=0, minute=0, second=0, microsecond=0)
+    while len(slots) < count and day < after + horizon:
+        candidate = datetime.combine(day.date(), DAY_START)
+        closing = datetime.combine(day.date(), DAY_END)
+        # Every grid point in working hours that is free and clear of the last slot
+        while len(slots) < count and candidate + length <= closing:
+            free = not any(b[0] < candidate + length and candidate < b[1] for b in bookings)
+            clear = not slots or candidate >= slots[-1] + length
+            if after <= candidate < after + horizon and free and clear:
+                slots.append(candidate)
+            candidate += GRID
+        day += timedelta(days=1)
+    return slots
+
+
+def test_doctor_key_is_canonical():
+    assert schedule.doctor_key("007") == "7"
+    assert schedule.doctor_key(7) == "7"
+    assert schedule.doctor_key("0") == "0"
+    for bad in ("", "-1", "7a", " 7", "٧"):  # the last is an Arabic-Indic seven
+        assert schedule.doctor_key(bad) is None
+
+
+def test_conflicts_match_brute_force():
+    rng = random.Random(7)
+    for _ in range(20):
+        bookings = random_bookings(rng, 30)
+        index = schedule.DoctorSchedule(bookings)
+        for _ in range(200):
+            start = at(6) + timedelta(minutes=rng.randrange(0, 3 * 24 * 60, 5))
+            end = start + timedelta(minutes=rng.choice([5, 30, 60, 240]))
+            ignore = rng.choice([None, rng.randrange(30)])
+            found = index.conflict(start, end, ignore=ignore)
+            expected = brute_conflict(bookings, start, end, ignore)
+            assert (found is None) == (expected is None), (start, end, ignore)
+
+
+def test_touching_bookings_do_not_conflict():
+    index = schedule.DoctorSchedule([(at(9), at(9, 30), 1)])
+    assert index.conflict(at(9, 30), at(10)) is None
+    assert index.conflict(at(8, 30), at(9)) is None
+    assert index.conflict(at(9, 15), at(9, 45)) == 1
+    # A booking never conflicts with itself when it is moved
+    assert index.conflict(at(9, 15), at(9, 45), ignore=1) is None
+
+
+def test_add_and_remove_keep_the_index_sorted():
+    index = schedule.DoctorSchedule()
+    index.add(at(11), at(11, 30), 2)
+    index.add(at(9), at(9, 30), 1)
+    assert index.conflict(at(9), at(12)) == 2
+    assert index.remove(at(11), 2)
+    assert not index.remove(at(11), 2)
+    assert index.conflict(at(9), at(12)) == 1
+    assert len(index) == 1
+
+
+def test_free_slots_match_brute_force():
+    rng = random.Random(21)
+    horizon = timedelta(days=5)
+    for _ in range(30):
+        bookings = random_bookings(rng, 25)
+        index = schedule.DoctorSchedule(bookings)
+        after = at(0) + timedelta(minutes=rng.randrange(0, 2 * 24 * 60, 5))
+        minutes = rng.choice([15, 30, 60])
+        found = index.free_slots(after, 12, minutes, DAY_START, DAY_END, horizon)
+        assert found == brute_free_slots(bookings, after, 12, minutes, horizon)
+
+
+def test_free_slots_stay_in_working_hours():
+    index = schedule.DoctorSchedule([(at(8), at(16, 40), 1)])
+    slots = index.free_slots(at(7), 3, 30, DAY_START, DAY_END, timedelta(days=2))
+    # 16:40 is off the grid and 17:00 is closing, so the next slot is tomorrow
+    assert slots == [at(8, days=1), at(8, 30, days=1), at(9, days=1)]
+
+
+class Database:
+    def __init__(self, doctors, rows):
+        self.doctors = doctors
+        self.rows = rows
+        self.loads = 0
+
+
+def fake_db(monkeypatch, db):
+    async def doctor_exists(_, doctor_id):
+        return doctor_id in db.doctors
+
+    async def doctor_appointments(_, doctor_id, since):
+        db.loads += 1
+        return db.rows
+
+    monkeypatch.setattr(schedule.async_db, "doctor_exists", doctor_exists)
+    monkeypatch.setattr(schedule.async_db, "doctor_appointments", doctor_appointments)
+
+
+def test_index_loads_once_and_skips_unknown_doctors(monkeypatch):
+    tomorrow = (datetime.now() + timedelta(days=1)).date()
+    db = Database({"7"}, [(1, tomorrow, time(9), 30)])
+    fake_db(monkeypatch, db)
+    index = schedule.ScheduleIndex(ttl=60)
+
+    async def lookups():
+        async with index.lock("7"):
+            first = await index.get(db, "7")
+            again = await index.get(db, "7")
+        async with index.lock("8"):
+            missing = await index.get(db, "8")
+        return first, again, missing
+
+    first, again, missing = asyncio.run(lookups())
+    assert first is again and len(first) == 1
+    assert missing is None
+    assert db.loads == 1
+    # Nobody holds a lock, so none is kept; unknown ids are not cached
+    assert index._locks == {}
+    assert index.stats()["doctors"] == 1
+
+
+def test_lock_serialises_one_doctor(monkeypatch):
+    index = schedule.ScheduleIndex(ttl=60)
+    events = []
+
+    async def book(doctor_id, name):
+        async with index.lock(doctor_id):
+            events.append(("in", name))
+            await asyncio.sleep(0)
+            events.append(("out", name))
+
+    async def race():
+        await asyncio.gather(book("7", "a"), book("7", "b"), book("8", "c"))
+
+    asyncio.run(race())
+    seven = [event for event in events if event[1] != "c"]
+    assert seven == [("in", "a"), ("out", "a"), ("in", "b"), ("out", "b")]
+    assert events.index(("in", "c")) < events.index(("out", "a"))
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# search imports async_db, which needs the app's database and model dependencies
+for module in ("asyncpg", "psycopg2", "argon2", "pydantic", "email_validator"):
+    pytest.importorskip(module)
+
+import search  # noqa: E402
+
+FIRST = ["ann", "annabelle", "joanna", "hannah", "bob", "robert", "li", "marian", "mariana"]
+LAST = ["smith", "smithson", "goldsmith", "okafor", "nakamura", "li", "annan"]
+SPECIALTIES = ["Cardiology", "Oncology", "Paediatrics", "Cardiothoracic Surgery"]
+
+
+def patient(id, name, email=None, access_no=None):
+    return search.patient_document(id, {"name": name, "email": email or f"p{id}@example.com", "access_no": access_no})
+
+
+def doctor(id, name, specialty):
+    return search.doctor_document(id, {"DoctorName": name, "Specialty": specialty, "Email": f"d{id}@example.com"})
+
+
+def hospital(id, name, kind="General"):
+    return search.hospital_document(id, {"HospitalName": name, "Type": kind, "Email": f"h{id}@example.com"})
+
+
+def build(docs, max_candidates=100000):
+    index = search.SearchIndex(max_candidates)
+    for doc in docs:
+        index.add(doc)
+    return index
+
+
+def random_documents(rng, count):
+    docs = []
+    for id in range(1, count + 1):
+        name = f"{rng.choice(FIRST)} {rng.choice(LAST)}"
+        if id % 3:
+            docs.append(patient(id, name, access_no=f"AC{rng.randrange(10000)}"))
+        else:
+            docs.append(doctor(id, name, rng.choice(SPECIALTIES)))
+    return docs
+
+
+def brute_search(docs, query, kind=None):
+    terms = set(search.tokens(query))
+    results = {}
+    for doc in docs:
+        if kind is not None and doc.kind != kind:
+            continue
+        scores = [doc.score(term) for term in terms]
+        if all(scores):
+            results[(doc.kind, doc.id)] = sum(scores)
+    return results
+
+
+def by_key(results):
+    return {(result["kind"], result["id"]): result["score"] for result in results}
+
+
+def test_tokens_are_lowercase_alphanumeric():
+    assert search.tokens("Anne-Marie O'Neil") == ("anne", "marie", "o", "neil")
+    assert search.tokens(None) == ()
+    assert search.tokens("x" * 100) == ("x" * search.MAX_TOKEN_LENGTH,)
+
+
+def test_exact_prefix_and_infix_matches():
+    index = build([patient(1, "Ann Smith"), patient(2, "Annabelle Jones"), patient(3, "Joanna Lee")])
+    assert by_key(index.search("ann")) == {
+        ("patient", 1): search.EXACT * 3,
+        ("patient", 2): search.PREFIX * 3,
+        ("patient", 3): search.INFIX * 3,
+    }
+    # Best match first
+    assert [result["id"] for result in index.search("ann")] == [1, 2, 3]
+    # Infix matching needs a whole trigram
+    assert [result["id"] for result in index.search("an")] == [1, 2]
+
+
+def test_shorter_label_first_among_equal_scores():
+    index = build([patient(1, "Mariana Lopez"), patient(2, "Marian Li")])
+    assert [result["id"] for result in index.search("mari")] == [2, 1]
+
+
+def test_name_outranks_email():
+    index = build([patient(1, "Someone Else", email="smith@example.com"), patient(2, "Jo Smith")])
+    assert [result["id"] for result in index.search("smith")] == [2, 1]
+
+
+@pytest.mark.parametrize("query", ["smith", "anna", "mari", "ann smi", "cardio li", "nakamura robert", "ac12"])
+def test_results_match_brute_force(query):
+    docs = random_documents(random.Random(24), 600)
+    index = build(docs)
+    assert by_key(index.search(query, limit=len(docs))) == brute_search(docs, query)
+    assert by_key(index.search(query, limit=len(docs), kind="doctor")) == brute_search(docs, query, kind="doctor")
+
+
+def test_limit_keeps_the_best_results():
+    docs = random_documents(random.Random(5), 600)
+    index = build(docs)
+    expected = sorted(brute_search(docs, "smith").values(), reverse=True)[:10]
+    assert [result["score"] for result in index.search("smith", limit=10)] == expected
+
+
+def test_kind_filter():
+    index = build([patient(1, "Grace Hopper"), doctor(1, "Grace Kelly", "Cardiology"), hospital(1, "Grace Hospital")])
+    assert {result["kind"] for result in index.search("grace")} == {"patient", "doctor", "hospital"}
+    assert [result["kind"] for result in index.search("grace", kind="hospital")] == ["hospital"]
+
+
+def test_replaced_documents_are_not_returned():
+    index = build([patient(1, "Ann Smith")])
+    index.add(patient(1, "Ann Jones"))
+    assert index.search("smith") == []
+    assert [(result["id"], result["label"]) for result in index.search("ann")] == [(1, "Ann Jones")]
+    assert index.stats()["documents"] == 1
+
+
+def test_scan_stops_at_max_candidates():
+    index = build([patient(id, "Ann Smith") for id in range(1, 101)], max_candidates=20)
+    assert len(index.search("ann smith", limit=100)) <= 20
+    assert index.stats()["truncated"] == 1
+
+
+def test_rebuild_keeps_documents_added_meanwhile():
+    stored = random_documents(random.Random(9), 50)
+    index = search.SearchIndex()
+
+    async def load():
+        for doc in stored:
+            yield doc
+        # A signup lands on this worker while the tables are being read
+        index.add(patient(1000, "Zelda Quinn"))
+
+    asyncio.run(index.rebuild(load))
+    assert index.ready
+    assert [result["id"] for result in index.search("zelda")] == [1000]
+    assert by_key(index.search("smith", limit=100)) == brute_search(stored, "smith")
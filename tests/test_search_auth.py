@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tokens  # noqa: E402
+
+
+def bearer(role, staff=False):
+    return tokens.issue(f"{role}@example.com", role, staff=staff)["access_token"]
+
+
+def test_patient_token_is_not_staff():
+    claims = tokens.verify(bearer("patient"))
+    with pytest.raises(tokens.Forbidden):
+        tokens.require_staff(claims)
+
+
+def test_self_registered_doctor_is_not_staff():
+    claims = tokens.verify(bearer("doctor"))
+    with pytest.raises(tokens.Forbidden):
+        tokens.require_staff(claims)
+
+
+def test_verified_doctor_is_staff():
+    claims = tokens.verify(bearer("doctor", staff=True))
+    assert tokens.require_staff(claims) is claims
+
+
+def test_refresh_keeps_staff():
+    refresh_token = tokens.issue("doctor@example.com", "doctor", staff=True)["refresh_token"]
+    claims = tokens.verify(tokens.refresh(refresh_token)["access_token"])
+    assert tokens.require_staff(claims) is claims
+
+
+def test_search_rejects_patient_token():
+    # Needs the app's own dependencies; the lifespan (and so the database) is not started
+    for module in ("fastapi", "httpx", "asyncpg", "psycopg2", "argon2", "pydantic"):
+        pytest.importorskip(module)
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    for token in (bearer("patient"), bearer("doctor")):
+        response = client.get("/search", params={"q": "a"}, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 403
+    response = client.get("/search", params={"q": "a"})
+    assert response.status_code == 401
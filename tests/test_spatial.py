@@ -0,0 +1,108 @@
+import asyncio
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# spatial imports async_db, which needs the app's database and model dependencies
+for module in ("asyncpg", "psycopg2", "argon2", "pydantic", "email_validator"):
+    pytest.importorskip(module)
+
+import spatial  # noqa: E402
+
+KINDS = ["General", "Clinic", "Trauma"]
+
+
+def random_hospitals(rng, count, lat_range, lon_range, first_id=1):
+    return [
+        spatial.hospital_record(
+            hospital_id,
+            f"Hospital {hospital_id}",
+            rng.choice(KINDS),
+            rng.uniform(*lat_range),
+            rng.uniform(*lon_range),
+            "112",
+        )
+        for hospital_id in range(first_id, first_id + count)
+    ]
+
+
+def brute_nearest(hospitals, lat, lon, k, kind=None):
+    candidates = [h for h in hospitals if kind is None or h["Type"].lower() == kind.lower()]
+    candidates.sort(key=lambda h: spatial.haversine_km(lat, lon, h["Latitude"], h["Longitude"]))
+    return [h["HospitalID"] for h in candidates[:k]]
+
+
+def build(hospitals, cell_degrees=0.25):
+    index = spatial.HospitalIndex(cell_degrees)
+    for hospital in hospitals:
+        index.add(hospital)
+    return index
+
+
+def ids(results):
+    return [hospital["HospitalID"] for _, hospital in results]
+
+
+def test_haversine_known_distance():
+    # One degree of latitude, and London to Paris
+    assert spatial.haversine_km(0, 0, 1, 0) == pytest.approx(111.19, abs=0.01)
+    assert spatial.haversine_km(51.5074, -0.1278, 48.8566, 2.3522) == pytest.approx(343.5, abs=1)
+
+
+@pytest.mark.parametrize(
+    "lat_range, lon_range",
+    [
+        ((-1, 1), (36, 38)),  # one dense city
+        ((-35, 5), (15, 50)),  # spread over a continent
+        ((60, 80), (-20, 40)),  # far north, where cells are narrow
+    ],
+)
+def test_nearest_matches_brute_force(lat_range, lon_range):
+    rng = random.Random(22)
+    hospitals = random_hospitals(rng, 2000, lat_range, lon_range)
+    index = build(hospitals)
+    for _ in range(200):
+        lat = rng.uniform(lat_range[0] - 2, lat_range[1] + 2)
+        lon = rng.uniform(lon_range[0] - 2, lon_range[1] + 2)
+        k = rng.choice([1, 3, 10])
+        kind = rng.choice([None, "general", "Trauma"])
+        results = index.nearest(lat, lon, k, kind)
+        assert ids(results) == brute_nearest(hospitals, lat, lon, k, kind)
+        distances = [distance for distance, _ in results]
+        assert distances == sorted(distances)
+
+
+def test_fewer_hospitals_than_asked_for():
+    hospitals = random_hospitals(random.Random(1), 2, (0, 1), (0, 1))
+    index = build(hospitals)
+    assert sorted(ids(index.nearest(0.5, 0.5, 5))) == [1, 2]
+    assert index.nearest(0.5, 0.5, 3, kind="Hospice") == []
+    assert spatial.HospitalIndex().nearest(0, 0, 3) == []
+
+
+def test_hospitals_without_coordinates_are_skipped():
+    index = build([spatial.hospital_record(1, "Nowhere", "General", None, None, "112")])
+    assert index.stats()["hospitals"] == 0
+
+
+def test_rebuild_keeps_hospitals_added_meanwhile():
+    rng = random.Random(3)
+    stored = random_hospitals(rng, 50, (0, 1), (0, 1))
+    added = random_hospitals(rng, 1, (0, 1), (0, 1), first_id=1000)[0]
+    index = spatial.HospitalIndex()
+
+    async def load():
+        for hospital in stored:
+            yield hospital
+        # A signup lands on this worker while the table is being read
+        index.add(added)
+
+    asyncio.run(index.rebuild(load))
+    assert index.ready
+    assert index.stats()["hospitals"] == 51
+    lat, lon = added["Latitude"], added["Longitude"]
+    assert ids(index.nearest(lat, lon, 1)) == [1000]
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+import tokens  # noqa: E402
+
+
+def pair(email="patient@example.com", role="patient"):
+    return tokens.issue(email, role, "Pat")
+
+
+def test_access_token_round_trip():
+    claims = tokens.verify(pair()["access_token"])
+    assert (claims["sub"], claims["role"], claims["name"]) == ("patient@example.com", "patient", "Pat")
+
+
+def test_tampered_token_is_rejected():
+    payload, signature = pair()["access_token"].split(".")
+    forged = tokens.encode({**tokens.decode(f"{payload}.{signature}"), "role": "doctor"}).split(".")[0]
+    with pytest.raises(tokens.TokenError):
+        tokens.verify(f"{forged}.{signature}")
+    with pytest.raises(tokens.TokenError):
+        tokens.verify("not a token")
+
+
+def test_token_types_are_not_interchangeable():
+    issued = pair()
+    with pytest.raises(tokens.TokenError):
+        tokens.verify(issued["refresh_token"])
+    with pytest.raises(tokens.TokenError):
+        tokens.verify(issued["access_token"], tokens.REFRESH)
+
+
+def test_access_token_expires(monkeypatch):
+    access_token = pair()["access_token"]
+    later = time.time() + config.ACCESS_TOKEN_TTL + 1
+    monkeypatch.setattr(tokens.time, "time", lambda: later)
+    with pytest.raises(tokens.TokenError, match="expired"):
+        tokens.verify(access_token)
+
+
+def test_revoked_token_is_rejected():
+    access_token = pair()["access_token"]
+    tokens.revoked.revoke(tokens.verify(access_token))
+    with pytest.raises(tokens.TokenError, match="revoked"):
+        tokens.verify(access_token)
+
+
+def test_refresh_rotates_the_refresh_token():
+    issued = pair()
+    rotated = tokens.refresh(issued["refresh_token"])
+    assert tokens.verify(rotated["access_token"])["sub"] == "patient@example.com"
+    # The old refresh token was used up; the new one works once
+    with pytest.raises(tokens.TokenError):
+        tokens.refresh(issued["refresh_token"])
+    tokens.refresh(rotated["refresh_token"])
+
+
+def test_revocations_are_forgotten_once_expired(monkeypatch):
+    revoked = tokens.RevocationSet()
+    now = time.time()
+    revoked.revoke({"jti": "old", "exp": now + 10})
+    revoked.revoke({"jti": "live", "exp": now + 1000})
+    monkeypatch.setattr(tokens.time, "time", lambda: now + 100)
+    revoked.revoke({"jti": "new", "exp": now + 1000})
+    assert revoked.stats()["revoked_tokens"] == 2
+    assert revoked.is_revoked({"jti": "live"})
+    assert not revoked.is_revoked({"jti": "old"})
@@ -0,0 +1,153 @@
+import base64
+import hashlib
+import heapq
+import hmac
+import json
+import os
+import threading
+import time
+
+import config
+
+# Stateless session tokens: base64url(JSON claims) + "." + base64url(HMAC-SHA256).
+# Checking one is a hash over a few hundred bytes, with no database round trip
+# and no Argon2. Access tokens are short-lived; refresh tokens are rotated on
+# every use. Revocations are kept in memory per worker, so on a multi-worker
+# deployment a logout is only guaranteed everywhere once the token expires.
+
+ACCESS = "access"
+REFRESH = "refresh"
+
+if config.TOKEN_SECRET:
+    _secret = config.TOKEN_SECRET.encode("utf-8")
+else:
+    # Tokens then only validate in this process and die with it
+    print("TOKEN_SECRET is not set; using a random per-process signing key")
+    _secret = os.urandom(32)
+
+
+class TokenError(Exception):
+    # Invalid, expired or revoked token; callers should answer 401
+    pass
+
+
+class Forbidden(Exception):
+    # Valid token whose role may not do this; callers should answer 403
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def _sign(payload):
+    return hmac.new(_secret, payload, hashlib.sha256).digest()
+
+
+def encode(claims):
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return (payload + b"." + _b64encode(_sign(payload))).decode("ascii")
+
+
+def decode(token):
+    # Returns the claims of a correctly signed token (expiry is not checked here)
+    try:
+        payload, signature = token.encode("ascii").split(b".")
+        signature = _b64decode(signature)
+    except (UnicodeEncodeError, ValueError):
+        raise TokenError("Malformed token.")
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise TokenError("Invalid token signature.")
+    try:
+        return json.loads(_b64decode(payload))
+    except ValueError:
+        raise TokenError("Malformed token.")
+
+
+class RevocationSet:
+    """Revoked token ids, kept until the tokens expire."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}  # jti -> exp
+        self._expiry = []  # heap of (exp, jti), soonest first
+
+    def revoke(self, claims):
+        now = time.time()
+        with self._lock:
+            if claims["jti"] not in self._tokens:
+                heapq.heappush(self._expiry, (claims["exp"], claims["jti"]))
+            self._tokens[claims["jti"]] = claims["exp"]
+            # Expired tokens fail on their own; forget them. Only the expired
+            # entries are touched, so a revoke stays O(log n)
+            while self._expiry and self._expiry[0][0] <= now:
+                _, jti = heapq.heappop(self._expiry)
+                del self._tokens[jti]
+
+    def is_revoked(self, claims):
+        with self._lock:
+            return claims["jti"] in self._tokens
+
+    def stats(self):
+        with self._lock:
+            return {"revoked_tokens": len(self._tokens)}
+
+
+revoked = RevocationSet()
+
+
+def _claims(sub, role, typ, ttl, name=None, staff=False):
+    now = time.time()
+    claims = {
+        "sub": sub,
+        "role": role,
+        "typ": typ,
+        "jti": os.urandom(12).hex(),
+        "iat": now,
+        "exp": int(now + ttl),
+    }
+    if name is not None:
+        claims["name"] = name
+    if staff:
+        # May look up other people's records (search, bulk registration, lab
+        # results); only granted to doctors verified out of band
+        claims["staff"] = True
+    return claims
+
+
+def issue(sub, role, name=None, staff=False):
+    # A fresh access/refresh pair, in the OAuth2 token response shape
+    return {
+        "access_token": encode(_claims(sub, role, ACCESS, config.ACCESS_TOKEN_TTL, name, staff)),
+        "refresh_token": encode(_claims(sub, role, REFRESH, config.REFRESH_TOKEN_TTL, name, staff)),
+        "token_type": "bearer",
+        "expires_in": config.ACCESS_TOKEN_TTL,
+    }
+
+
+def verify(token, typ=ACCESS):
+    claims = decode(token)
+    if claims.get("typ") != typ:
+        raise TokenError(f"Wrong token type, expected {typ}.")
+    if claims["exp"] < time.time():
+        raise TokenError("Token has expired.")
+    if revoked.is_revoked(claims):
+        raise TokenError("Token has been revoked.")
+    return claims
+
+
+def require_staff(claims):
+    if not claims.get("staff"):
+        raise Forbidden("Only verified staff accounts may do this.")
+    return claims
+
+
+def refresh(refresh_token):
+    # Rotates the refresh token: the old one can not be used again
+    claims = verify(refresh_token, REFRESH)
+    revoked.revoke(claims)
+    return issue(claims["sub"], claims["role"], claims.get("name"), claims.get("staff", False))